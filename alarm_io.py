@@ -0,0 +1,763 @@
+"""Потоковый импорт и экспорт будильников: CSV, JSON Lines, iCalendar
+
+Файлы читаются и пишутся по строке (по событию для .ics), поэтому память не
+зависит от размера файла. Разобранные будильники вставляются в хранилище
+пачками через AlarmStore.add_many; ошибочная строка не прерывает импорт, а
+попадает в отчёт с номером строки.
+
+Колонки CSV (порядок любой, лишние игнорируются):
+    id, type, time, date, weekdays, rule, start, calendars, exdates, label,
+    enabled, repeat_5min, snooze_minutes, snooze_count, hooks
+    type - date/weekly/rule или дата/неделя/правило (если пусто - по заполненным полям)
+    date - ГГГГ-ММ-ДД или ДД.ММ.ГГГГ; weekdays - "пн,ср" или "0,2"
+    rule - RRULE ("FREQ=MONTHLY;BYDAY=-1FR") или JSON-словарь из recurrence.py
+    start - первый день правила (DTSTART): от него считаются INTERVAL и COUNT,
+            им же заполняются пустые BYDAY и BYMONTHDAY; если пусто - день импорта
+    calendars, exdates - через запятую; флаги - 1/0, true/false, да/нет, вкл/выкл
+    hooks - JSON-список действий при срабатывании (hooks.py)
+В JSON Lines - те же поля, списки и правило можно писать как в хранилище.
+В iCalendar будильник - VEVENT: DTSTART, RRULE, EXDATE, SUMMARY, а повторы
+звонка - REPEAT и DURATION во вложенном VALARM. Включён ли будильник и его
+календари пропусков хранятся в X-WAKE-UP-ENABLED и X-WAKE-UP-CALENDARS.
+Действия при срабатывании в iCalendar не попадают.
+"""
+import csv
+import json
+import os
+import time
+from datetime import date, datetime, timedelta, timezone
+from itertools import islice
+from pathlib import Path
+
+from alarm_store import ALARM_TYPES_RU, WEEKDAYS_RU
+from hooks import parse_hooks
+from recurrence import compile_rule, DEFAULT_START
+
+
+CSV_FIELDS = ('id', 'type', 'time', 'date', 'weekdays', 'rule', 'start', 'calendars', 'exdates', 'label',
+              'enabled', 'repeat_5min', 'snooze_minutes', 'snooze_count', 'hooks')
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.ics': 'ical'}
+
+TRUE_WORDS = {'1', 'true', 'yes', 'да', 'вкл', 'on'}
+FALSE_WORDS = {'0', 'false', 'no', 'нет', 'выкл', 'off', ''}
+
+ICAL_DAYS = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+ICAL_FREQS = {'HOURLY': 'hourly', 'DAILY': 'daily', 'WEEKLY': 'weekly', 'MONTHLY': 'monthly'}
+RRULE_PARTS = {'FREQ', 'INTERVAL', 'UNTIL', 'COUNT', 'BYDAY', 'BYMONTHDAY', 'WKST'}
+MAX_REPORTED_ERRORS = 100  # Дальше ошибки только считаются
+STORE_PATH = Path("res") / "alarms.jsonl"  # Сохранённые будильники: общий файл окна и cli.py
+
+
+class ImportReport:
+    """Итог импорта: сколько добавлено, сколько строк отвергнуто и первые ошибки"""
+    def __init__(self, path):
+        self.path = path
+        self.added = 0
+        self.error_count = 0
+        self.errors = []  # [(номер строки, текст)]
+        self.seconds = 0.0
+
+    def error(self, line_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line_number, message))
+
+    def format(self):
+        lines = [f"{Path(self.path).name}: добавлено {self.added}, с ошибками {self.error_count} "
+                 f"за {self.seconds:.2f} с"]
+        for line_number, message in self.errors:
+            lines.append(f"  строка {line_number}: {message}")
+        if self.error_count > len(self.errors):
+            lines.append(f"  ... и ещё {self.error_count - len(self.errors)}")
+        return "\n".join(lines)
+
+
+# --- Разбор полей ---
+
+def parse_flag(value, default=False):
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_WORDS:
+        return True
+    if text in FALSE_WORDS:
+        return False if text else default
+    raise ValueError(f"Не понял флаг: {value}")
+
+
+def parse_clock(value):
+    """Время Ч:ММ или ЧЧ:ММ -> "ЧЧ:ММ" """
+    hours, _, minutes = str(value).strip().partition(':')
+    if not hours.isdigit() or len(minutes) != 2 or not minutes.isdigit():
+        raise ValueError(f"Неверное время: {value}")
+    hours, minutes = int(hours), int(minutes)
+    if hours > 23 or minutes > 59:
+        raise ValueError(f"Неверное время: {value}")
+    return f"{hours:02d}:{minutes:02d}"
+
+
+def parse_day(value):
+    """Дата ГГГГ-ММ-ДД или ДД.ММ.ГГГГ -> "ГГГГ-ММ-ДД" """
+    text = str(value).strip()
+    if '.' in text:
+        day, month, year = text.split('.')
+        return date(int(year), int(month), int(day)).isoformat()
+    return date.fromisoformat(text).isoformat()
+
+
+def split_list(value):
+    """Список из JSON-массива или строки через запятую/пробел"""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [item for item in str(value).replace(',', ' ').split() if item]
+
+
+def parse_weekdays(value):
+    weekdays = set()
+    for item in split_list(value):
+        text = str(item).strip().lower()
+        if text in WEEKDAYS_RU:
+            weekdays.add(WEEKDAYS_RU.index(text))
+        elif text.upper() in ICAL_DAYS:
+            weekdays.add(ICAL_DAYS.index(text.upper()))
+        elif text.isdigit() and int(text) < 7:
+            weekdays.add(int(text))
+        else:
+            raise ValueError(f"Неверный день недели: {item}")
+    return sorted(weekdays)
+
+
+def parse_exdate(value):
+    """Исключение: день "ГГГГ-ММ-ДД" или момент "ГГГГ-ММ-ДДTЧЧ:ММ" """
+    text = str(value).strip()
+    if len(text) > 10:
+        return datetime.fromisoformat(text).strftime("%Y-%m-%dT%H:%M")
+    return parse_day(text)
+
+
+def alarm_from_record(record, keep_id=False):
+    """Будильник хранилища из записи файла; ValueError с понятным текстом при ошибке"""
+    def field(name):
+        value = record.get(name)
+        return None if value is None or value == '' else value
+
+    alarm_type = field('type')
+    if alarm_type is None:
+        alarm_type = 'rule' if field('rule') else 'weekly' if field('weekdays') else 'date'
+    alarm_type = ALARM_TYPES_RU.get(str(alarm_type).strip().lower(), str(alarm_type).strip().lower())
+    if alarm_type not in ALARM_TYPES_RU.values():
+        raise ValueError(f"Неизвестный тип будильника: {alarm_type}")
+    if field('time') is None:
+        raise ValueError("Не указано время")
+
+    alarm = {'type': alarm_type, 'time': parse_clock(record['time'])}
+    if alarm_type == 'date':
+        if field('date') is None:
+            raise ValueError("Не указана дата")
+        alarm['date'] = parse_day(record['date'])
+    elif alarm_type == 'weekly':
+        alarm['weekdays'] = parse_weekdays(field('weekdays'))
+        if not alarm['weekdays']:
+            raise ValueError("Не указаны дни недели")
+    else:
+        rule = field('rule')
+        if rule is None:
+            raise ValueError("Не указано правило")
+        start = date.fromisoformat(parse_day(record['start'])) if field('start') is not None else None
+        if isinstance(rule, str):
+            if rule.lstrip().startswith('{'):
+                rule = json.loads(rule)
+            else:
+                # Без start правило начинается в день импорта, а не в DEFAULT_START
+                rule = rrule_to_rule(rule, start or date.today(), alarm['time'])
+        if not isinstance(rule, dict):
+            raise ValueError(f"Неверное правило: {rule}")
+        if start is not None and not rule.get('start'):
+            rule = dict(rule, start=start.isoformat())
+        alarm['rule'] = rule
+
+    exdates = [parse_exdate(item) for item in split_list(field('exdates'))]
+    if exdates:
+        if alarm_type == 'rule':
+            alarm['rule'] = dict(alarm['rule'], exdates=sorted(set(alarm['rule'].get('exdates', [])) | set(exdates)))
+        else:
+            alarm['exdates'] = exdates
+
+    alarm['label'] = str(field('label') or '')
+    alarm['calendars'] = [str(name) for name in split_list(field('calendars'))]
+    alarm['enabled'] = parse_flag(field('enabled'), True)
+    alarm['repeat_5min'] = parse_flag(field('repeat_5min'))
+    alarm['snooze_minutes'] = int(field('snooze_minutes') or 5)
+    alarm['snooze_count'] = int(field('snooze_count') or 1)
+    if alarm['snooze_minutes'] < 1 or alarm['snooze_count'] < 0:
+        raise ValueError("Неверные параметры повтора")
+    hooks = parse_hooks(field('hooks'))
+    if hooks:
+        alarm['hooks'] = hooks
+
+    last_triggered = field('last_triggered')
+    alarm['last_triggered'] = datetime.fromisoformat(last_triggered) if last_triggered else None
+    if keep_id and field('id') is not None:
+        alarm['id'] = int(record['id'])
+    return alarm
+
+
+# --- RRULE ---
+
+def parse_ical_moment(value):
+    """Момент или дата iCalendar; время в UTC переводится в местное"""
+    value = value.strip()
+    if 'T' not in value:
+        return datetime.strptime(value, "%Y%m%d")
+    utc = value.endswith('Z')
+    moment = datetime.strptime(value.rstrip('Z')[:15], "%Y%m%dT%H%M%S")
+    if utc:
+        moment = moment.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    return moment
+
+
+def rrule_to_rule(text, start=None, time_str="00:00"):
+    """Правило recurrence.py из строки RRULE; ValueError для неподдерживаемых частей
+
+    start - день DTSTART, time_str - время срабатывания. Без start правило
+    отсчитывается от DEFAULT_START, а COUNT не принимается: считать его не от чего.
+    """
+    parts = {}
+    for item in text.strip().removeprefix('RRULE:').split(';'):
+        if not item:
+            continue
+        name, _, value = item.partition('=')
+        name = name.strip().upper()
+        if name not in RRULE_PARTS:
+            raise ValueError(f"RRULE: {name} не поддерживается")
+        parts[name] = value.strip().upper()
+
+    freq = ICAL_FREQS.get(parts.get('FREQ'))
+    if freq is None:
+        raise ValueError(f"RRULE: частота {parts.get('FREQ')} не поддерживается")
+    rule = {'freq': freq}
+    if 'INTERVAL' in parts:
+        rule['interval'] = int(parts['INTERVAL'])
+    if start is not None:
+        rule['start'] = start.isoformat()
+    if 'UNTIL' in parts:
+        rule['until'] = parse_ical_moment(parts['UNTIL']).date().isoformat()
+
+    byday = [item for item in parts.get('BYDAY', '').split(',') if item]
+    if freq == 'weekly':
+        rule['weekdays'] = sorted({ICAL_DAYS.index(item) for item in byday if item in ICAL_DAYS})
+        if len(rule['weekdays']) != len(byday):
+            raise ValueError(f"RRULE: неверный BYDAY {parts['BYDAY']}")
+        if not byday:
+            rule['weekdays'] = [(start or DEFAULT_START).weekday()]
+    elif freq == 'monthly':
+        rule['monthdays'] = [int(day) for day in parts.get('BYMONTHDAY', '').split(',') if day]
+        nth_weekdays = []
+        for item in byday:
+            nth, day = item[:-2], item[-2:]
+            if day not in ICAL_DAYS or not nth.lstrip('+-').isdigit():
+                raise ValueError(f"RRULE: BYDAY {item} без номера недели не поддерживается")
+            nth_weekdays.append([ICAL_DAYS.index(day), int(nth)])
+        if nth_weekdays:
+            rule['nth_weekdays'] = nth_weekdays
+        if not rule['monthdays'] and not nth_weekdays:
+            rule['monthdays'] = [(start or DEFAULT_START).day]
+        if not rule['monthdays']:
+            del rule['monthdays']
+    elif byday or 'BYMONTHDAY' in parts:
+        raise ValueError(f"RRULE: BYDAY/BYMONTHDAY для {parts['FREQ']} не поддерживаются")
+
+    if 'COUNT' in parts:
+        # COUNT переводится в последний день: для почасовых правил это было бы неточно
+        if freq == 'hourly':
+            raise ValueError("RRULE: COUNT для HOURLY не поддерживается")
+        if start is None:
+            raise ValueError("RRULE: COUNT без начала правила (DTSTART) не поддерживается")
+        count = int(parts['COUNT'])
+        first = datetime.combine(start, datetime.min.time()) - timedelta(minutes=1)
+        fires = list(islice(compile_rule(rule, time_str).iter_after(first), count))
+        if not fires:
+            raise ValueError("RRULE: по правилу нет ни одного срабатывания")
+        rule['until'] = fires[-1].date().isoformat()
+    return rule
+
+
+def rule_to_rrule(rule):
+    """Строка RRULE для правила recurrence.py (без start и exdates - они идут в DTSTART и EXDATE)"""
+    parts = [f"FREQ={rule['freq'].upper()}"]
+    if rule.get('interval', 1) != 1:
+        parts.append(f"INTERVAL={rule['interval']}")
+    if rule.get('until'):
+        parts.append(f"UNTIL={rule['until'].replace('-', '')}T235959")
+    if rule['freq'] == 'weekly':
+        parts.append("BYDAY=" + ",".join(ICAL_DAYS[day] for day in sorted(rule.get('weekdays', ()))))
+    elif rule['freq'] == 'monthly':
+        if rule.get('monthdays'):
+            parts.append("BYMONTHDAY=" + ",".join(str(day) for day in rule['monthdays']))
+        if rule.get('nth_weekdays'):
+            parts.append("BYDAY=" + ",".join(f"{nth}{ICAL_DAYS[day]}" for day, nth in rule['nth_weekdays']))
+    return ";".join(parts)
+
+
+# --- Чтение ---
+
+def read_csv(file):
+    """(номер строки, запись) по строкам CSV с заголовком"""
+    reader = csv.DictReader(file)
+    try:
+        for record in reader:
+            yield reader.line_num, record
+    except csv.Error as e:
+        raise ValueError(f"CSV, строка {reader.line_num}: {e}")
+
+
+def read_jsonl(file):
+    """(номер строки, запись) по строкам JSON Lines; битая строка - (номер, ValueError)"""
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("ожидался объект JSON")
+            yield line_number, record
+        except ValueError as e:
+            yield line_number, ValueError(f"JSON: {e}")
+
+
+def unfold_lines(file):
+    """(номер строки, логическая строка) с развёрнутыми продолжениями iCalendar"""
+    current = None
+    start = 0
+    for line_number, line in enumerate(file, 1):
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield start, current
+        current, start = line, line_number
+    if current is not None:
+        yield start, current
+
+
+def unescape_text(value):
+    return (value.replace('\\n', '\n').replace('\\N', '\n').replace('\\,', ',')
+            .replace('\\;', ';').replace('\\\\', '\\'))
+
+
+def escape_text(value):
+    return (value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\n', '\\n'))
+
+
+def read_ical(file):
+    """(номер строки BEGIN:VEVENT, запись) по событиям iCalendar"""
+    event = None
+    in_alarm = False
+    for line_number, line in unfold_lines(file):
+        head, _, value = line.partition(':')
+        name, *params = head.split(';')
+        name = name.upper()
+        if name == 'BEGIN' and value.upper() == 'VEVENT':
+            event = {'line': line_number, 'exdates': []}
+        elif event is None:
+            continue
+        elif name == 'BEGIN' and value.upper() == 'VALARM':
+            in_alarm = True
+        elif name == 'END' and value.upper() == 'VALARM':
+            in_alarm = False
+        elif name == 'END' and value.upper() == 'VEVENT':
+            try:
+                yield event['line'], event_to_record(event)
+            except ValueError as e:
+                yield event['line'], e
+            event = None
+        elif in_alarm:
+            if name in ('REPEAT', 'DURATION'):
+                event[name] = value
+        elif name in ('DTSTART', 'RRULE', 'SUMMARY', 'X-WAKE-UP-ENABLED', 'X-WAKE-UP-CALENDARS'):
+            event[name] = value
+        elif name == 'EXDATE':
+            event['exdates'].extend(value.split(','))
+
+
+def parse_duration_minutes(value):
+    """Минуты из длительности iCalendar вида PT5M, PT1H30M, P1D"""
+    value = value.strip().upper().lstrip('+')
+    if not value.startswith('P'):
+        raise ValueError(f"Неверная длительность: {value}")
+    minutes = 0
+    number = ''
+    for char in value[1:]:
+        if char.isdigit():
+            number += char
+        elif char in 'WDHMS' and number:
+            minutes += int(number) * {'W': 7 * 1440, 'D': 1440, 'H': 60, 'M': 1, 'S': 0}[char]
+            number = ''
+        elif char != 'T':
+            raise ValueError(f"Неверная длительность: {value}")
+    return minutes
+
+
+def event_to_record(event):
+    """Запись будильника из свойств VEVENT"""
+    if 'DTSTART' not in event:
+        raise ValueError("В событии нет DTSTART")
+    start = parse_ical_moment(event['DTSTART'])
+    time_str = start.strftime("%H:%M")
+    record = {'time': time_str, 'label': unescape_text(event.get('SUMMARY', ''))}
+    exdates = []
+    for item in event['exdates']:
+        moment = parse_ical_moment(item)
+        exdates.append(moment.date().isoformat() if 'T' not in item else moment.strftime("%Y-%m-%dT%H:%M"))
+
+    if 'RRULE' not in event:
+        record.update(type='date', date=start.date().isoformat())
+    else:
+        rule = rrule_to_rule(event['RRULE'], start.date(), time_str)
+        simple = set(rule) == {'freq', 'start', 'weekdays'} and rule['freq'] == 'weekly'
+        if simple and start.date() <= date.today():
+            # Простое еженедельное правило, уже начавшееся, - обычный будильник по дням недели
+            record.update(type='weekly', weekdays=rule['weekdays'])
+        else:
+            if exdates:
+                rule['exdates'] = exdates
+                exdates = []
+            record.update(type='rule', rule=rule)
+    if exdates:
+        record['exdates'] = exdates
+
+    if 'REPEAT' in event:
+        record['snooze_count'] = int(event['REPEAT'])
+        record['repeat_5min'] = record['snooze_count'] > 0
+        if 'DURATION' in event:
+            record['snooze_minutes'] = max(1, parse_duration_minutes(event['DURATION']))
+    if 'X-WAKE-UP-ENABLED' in event:
+        record['enabled'] = event['X-WAKE-UP-ENABLED']
+    if 'X-WAKE-UP-CALENDARS' in event:
+        record['calendars'] = unescape_text(event['X-WAKE-UP-CALENDARS'])
+    return record
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl, 'ical': read_ical}
+
+
+def detect_format(path, fmt=None):
+    fmt = fmt or FORMATS.get(Path(path).suffix.lower())
+    if fmt not in READERS:
+        raise ValueError(f"Неизвестный формат файла: {Path(path).name}")
+    return fmt
+
+
+def read_alarms(path, fmt=None, keep_ids=False):
+    """(номер строки, будильник или ValueError) по файлу, лениво"""
+    fmt = detect_format(path, fmt)
+    with open(path, encoding="utf-8-sig", newline='') as file:
+        for line_number, record in READERS[fmt](file):
+            if isinstance(record, Exception):
+                yield line_number, record
+                continue
+            try:
+                yield line_number, alarm_from_record(record, keep_ids)
+            except (ValueError, TypeError) as e:
+                yield line_number, ValueError(str(e))
+
+
+def import_alarms(store, path, fmt=None, batch_size=10000, keep_ids=False, now=None):
+    """Импортировать файл в хранилище пачками по batch_size, вернуть ImportReport
+
+    Каждая пачка - одна досортировка индексов хранилища за O(n), поэтому
+    пачки крупные: на 100 тыс. строк пачки по 1000 вдвое медленнее.
+    """
+    report = ImportReport(path)
+    started = time.perf_counter()
+    batch = []
+    lines = []
+
+    def flush():
+        errors = store.add_many(batch, now)
+        for position, message in errors:
+            report.error(lines[position], message)
+        report.added += len(batch) - len(errors)
+        batch.clear()
+        lines.clear()
+
+    for line_number, alarm in read_alarms(path, fmt, keep_ids):
+        if isinstance(alarm, Exception):
+            report.error(line_number, str(alarm))
+            continue
+        batch.append(alarm)
+        lines.append(line_number)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+# --- Запись ---
+
+def alarm_to_record(alarm):
+    """Запись для CSV: списки через запятую, правило - строкой RRULE и первым днём"""
+    rule = alarm.get('rule')
+    if rule and rule.get('exdates'):
+        rule_text = json.dumps(rule, ensure_ascii=False)  # В RRULE нет исключений
+    else:
+        rule_text = rule_to_rrule(rule) if rule else ''
+    # Правило без start отсчитывается от DEFAULT_START: без него при импорте оно начнётся в день импорта
+    start = (rule.get('start') or DEFAULT_START.isoformat()) if rule else ''
+    return {
+        'id': alarm['id'],
+        'type': alarm['type'],
+        'time': alarm['time'],
+        'date': alarm.get('date', ''),
+        'weekdays': ",".join(WEEKDAYS_RU[day] for day in alarm.get('weekdays', ())),
+        'rule': rule_text,
+        'start': start,
+        'calendars': ",".join(alarm.get('calendars') or ()),
+        'exdates': ",".join(alarm.get('exdates', ())),
+        'label': alarm.get('label', ''),
+        'enabled': int(alarm['enabled']),
+        'repeat_5min': int(alarm.get('repeat_5min', False)),
+        'snooze_minutes': alarm.get('snooze_minutes', 5),
+        'snooze_count': alarm.get('snooze_count', 1),
+        'hooks': json.dumps(alarm['hooks'], ensure_ascii=False) if alarm.get('hooks') else '',
+    }
+
+
+def alarm_to_dict(alarm):
+    """Копия будильника, которую можно отдать в json.dumps"""
+    record = dict(alarm)
+    if record.get('last_triggered') is not None:
+        record['last_triggered'] = record['last_triggered'].isoformat()
+    return record
+
+
+def alarm_to_json(alarm):
+    """Строка JSON Lines: будильник как в хранилище"""
+    return json.dumps(alarm_to_dict(alarm), ensure_ascii=False)
+
+
+def ical_moment(day, time_str):
+    return f"{day.replace('-', '')}T{time_str.replace(':', '')}00"
+
+
+def alarm_to_vevent(alarm):
+    """Строки VEVENT (с VALARM) для будильника"""
+    rule = alarm.get('rule')
+    if alarm['type'] == 'date':
+        start = alarm['date']
+    elif alarm['type'] == 'weekly':
+        start, rule = DEFAULT_START.isoformat(), {'freq': 'weekly', 'weekdays': alarm['weekdays']}
+    else:
+        start = rule.get('start') or DEFAULT_START.isoformat()
+    lines = ["BEGIN:VEVENT", f"UID:alarm-{alarm['id']}@the-wake-up",
+             f"DTSTART:{ical_moment(start, alarm['time'])}"]
+    if rule:
+        lines.append(f"RRULE:{rule_to_rrule(rule)}")
+    for item in list(alarm.get('exdates', ())) + list((rule or {}).get('exdates', ())):
+        if len(item) > 10:
+            lines.append(f"EXDATE:{ical_moment(item[:10], item[11:16])}")
+        else:
+            lines.append(f"EXDATE;VALUE=DATE:{item.replace('-', '')}")
+    if alarm.get('label'):
+        lines.append(f"SUMMARY:{escape_text(alarm['label'])}")
+    lines.append(f"X-WAKE-UP-ENABLED:{'TRUE' if alarm['enabled'] else 'FALSE'}")
+    if alarm.get('calendars'):
+        lines.append(f"X-WAKE-UP-CALENDARS:{escape_text(','.join(alarm['calendars']))}")
+    lines += ["BEGIN:VALARM", "ACTION:AUDIO", "TRIGGER:PT0S"]
+    if alarm.get('repeat_5min'):
+        lines += [f"REPEAT:{alarm.get('snooze_count', 1)}", f"DURATION:PT{alarm.get('snooze_minutes', 5)}M"]
+    lines += ["END:VALARM", "END:VEVENT"]
+    return lines
+
+
+def fold_line(line):
+    """Строка iCalendar, разбитая по 75 символов"""
+    if len(line) <= 75:
+        return line
+    return "\r\n ".join(line[i:i + 74] for i in range(0, len(line), 74))
+
+
+def export_alarms(alarms, path, fmt=None):
+    """Записать будильники (любой итерируемый набор) в файл, вернуть их количество"""
+    fmt = detect_format(path, fmt)
+    count = 0
+    with open(path, "w", encoding="utf-8", newline='') as file:
+        if fmt == 'csv':
+            writer = csv.DictWriter(file, CSV_FIELDS)
+            writer.writeheader()
+            for alarm in alarms:
+                writer.writerow(alarm_to_record(alarm))
+                count += 1
+        elif fmt == 'jsonl':
+            for alarm in alarms:
+                file.write(alarm_to_json(alarm) + "\n")
+                count += 1
+        else:
+            file.write("BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//the-wake-up//RU\r\n")
+            for alarm in alarms:
+                file.write("".join(fold_line(line) + "\r\n" for line in alarm_to_vevent(alarm)))
+                count += 1
+            file.write("END:VCALENDAR\r\n")
+    return count
+
+
+# --- Сохранённое хранилище ---
+
+def load_store(store, path=STORE_PATH, now=None):
+    """Загрузить сохранённые будильники вместе с их id, вернуть ImportReport"""
+    if not Path(path).exists():
+        return ImportReport(path)
+    return import_alarms(store, path, 'jsonl', keep_ids=True, now=now)
+
+
+def save_store(store, path=STORE_PATH):
+    """Сохранить будильники: пишется временный файл и подменяет старый,
+    так что читатель никогда не увидит файл наполовину записанным"""
+    return write_store((alarm_to_json(alarm) for alarm in store), path)
+
+
+def write_store(lines, path=STORE_PATH):
+    """Записать готовые строки JSON Lines (alarm_to_json) так же, как save_store;
+    строки можно подготовить заранее, а писать в другом потоке"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(path.name + ".tmp")
+    count = 0
+    with open(temporary, "w", encoding="utf-8", newline='') as file:
+        for line in lines:
+            file.write(line + "\n")
+            count += 1
+    os.replace(temporary, path)
+    return count
+
+
+if __name__ == "__main__":
+    # Проверка правил RRULE: COUNT и INTERVAL от DTSTART, обратный импорт всех форматов.
+    # Затем бенчмарк: разбор файла в 1 млн строк в постоянной памяти и импорт 100 тыс. в хранилище
+    import random
+    import resource
+    import sys
+    import tempfile
+
+    from alarm_store import AlarmStore
+    from recurrence import compile_alarm
+
+    def fires(alarm, after, count=8):
+        return [moment.isoformat() for moment in islice(compile_alarm(alarm).iter_after(after), count)]
+
+    failures = []
+    today = date.today()
+    counted = alarm_from_record({'time': "08:00", 'rule': "FREQ=DAILY;COUNT=5", 'start': "19.10.2026"})
+    if fires(counted, datetime(2026, 10, 1)) != [f"2026-10-{day}T08:00:00" for day in range(19, 24)]:
+        failures.append(f"COUNT=5 от 19.10.2026: {fires(counted, datetime(2026, 10, 1))}")
+    counted = alarm_from_record({'time': "08:00", 'rule': "FREQ=DAILY;COUNT=5"})
+    if counted['rule'].get('until') != (today + timedelta(days=4)).isoformat():
+        failures.append(f"COUNT=5 без start кончается {counted['rule'].get('until')}, а не через 4 дня")
+    try:
+        rrule_to_rule("FREQ=DAILY;COUNT=3")
+        failures.append("COUNT без start принят")
+    except ValueError:
+        pass
+    weekly = alarm_from_record({'time': "07:15", 'rule': "FREQ=WEEKLY;INTERVAL=2", 'start': "2026-10-21"})
+    if weekly['rule']['weekdays'] != [2]:
+        failures.append(f"пустой BYDAY взят не из start: {weekly['rule']['weekdays']}")
+
+    rules = ["FREQ=DAILY;INTERVAL=3;COUNT=4", "FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TH", "FREQ=WEEKLY;INTERVAL=3",
+             "FREQ=MONTHLY;INTERVAL=2", "FREQ=MONTHLY;BYDAY=-1FR;COUNT=3", "FREQ=HOURLY;INTERVAL=5"]
+    originals = AlarmStore()
+    for position, rule in enumerate(rules):
+        originals.add(alarm_from_record({'time': "06:40", 'rule': rule, 'start': f"2026-11-0{position + 1}"}))
+    originals.add(alarm_from_record({'time': "06:40", 'rule': json.dumps({'freq': 'daily', 'interval': 4})}))
+    with tempfile.TemporaryDirectory() as directory:
+        for fmt in ('csv', 'jsonl', 'ics'):
+            path = Path(directory, f"rules.{fmt}")
+            export_alarms(originals, path)
+            copy = AlarmStore()
+            import_alarms(copy, path, keep_ids=True)
+            for alarm in originals:
+                again = copy.get(alarm['id'])
+                if again is None or fires(again, datetime(2026, 10, 1)) != fires(alarm, datetime(2026, 10, 1)):
+                    failures.append(f"{fmt}: правило {alarm['rule']} после импорта "
+                                    f"{again and again['rule']}")
+    for failure in failures:
+        print(f"ОШИБКА: {failure}")
+    print(f"Правила RRULE: {'ошибок ' + str(len(failures)) if failures else 'все проверки прошли'}")
+    if failures:
+        sys.exit(1)
+
+    random.seed(1)
+    LABELS = ["Подъём", "Работа", "Таблетки", "Спортзал", "Созвон", "Полить цветы"]
+
+    def random_row(i):
+        kind = random.random()
+        row = {'time': f"{random.randrange(24)}:{random.randrange(60):02d}",
+               'label': f"{random.choice(LABELS)} {i % 10}"}
+        if kind < 0.4:
+            row.update(type='неделя', weekdays=",".join(random.sample(WEEKDAYS_RU, random.randint(1, 5))))
+        elif kind < 0.7:
+            row.update(type='дата', date=f"{random.randint(1, 28)}.{random.randint(1, 12)}.2027")
+        elif kind < 0.999:
+            row.update(type='правило', rule=random.choice(
+                ["FREQ=DAILY;INTERVAL=2", "FREQ=MONTHLY;BYDAY=-1FR", "FREQ=MONTHLY;BYMONTHDAY=1,15",
+                 "FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TH", "FREQ=HOURLY;INTERVAL=6"]))
+        else:
+            row.update(type='правило', rule="FREQ=YEARLY")  # Неподдерживаемая частота - ошибка строки
+        return row
+
+    with tempfile.TemporaryDirectory() as directory:
+        big = Path(directory, "big.csv")
+        with open(big, "w", encoding="utf-8", newline='') as file:
+            writer = csv.DictWriter(file, CSV_FIELDS)
+            writer.writeheader()
+            for i in range(1000000):
+                writer.writerow(random_row(i))
+        print(f"CSV на 1 млн строк: {os.path.getsize(big) / 1e6:.0f} МБ")
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        parsed = errors = 0
+        for _, alarm in read_alarms(big):
+            if isinstance(alarm, Exception):
+                errors += 1
+            else:
+                parsed += 1
+        elapsed = time.perf_counter() - started
+        rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+        print(f"Разбор: {parsed} будильников, {errors} ошибок за {elapsed:.1f} с "
+              f"({elapsed:.1f} мкс/строка), рост пиковой памяти процесса {rss_growth} КБ")
+
+        small = Path(directory, "small.csv")
+        with open(big, encoding="utf-8") as source, open(small, "w", encoding="utf-8") as target:
+            target.writelines(islice(source, 100001))
+        store = AlarmStore()
+        now = datetime(2026, 10, 19, 12, 0)
+        report = import_alarms(store, small, now=now)
+        print(f"Импорт 100 тыс. в хранилище: добавлено {report.added}, ошибок {report.error_count} "
+              f"за {report.seconds:.2f} с")
+
+        started = time.perf_counter()
+        single = AlarmStore()
+        for _, alarm in islice(read_alarms(small), 20000):
+            if not isinstance(alarm, Exception):
+                single.add(alarm, now)
+        print(f"Для сравнения 20 тыс. по одному через add: {time.perf_counter() - started:.2f} с")
+
+        for fmt in ('csv', 'jsonl', 'ics'):
+            path = Path(directory, f"out.{fmt}")
+            started = time.perf_counter()
+            count = export_alarms(store, path)
+            export_time = time.perf_counter() - started
+            copy = AlarmStore()
+            again = import_alarms(copy, path, keep_ids=True, now=now)
+            same = sum(1 for alarm in store if copy.get(alarm['id']) is not None
+                       and copy.rules[alarm['id']].next_after(now) == store.rules[alarm['id']].next_after(now))
+            print(f"Экспорт {fmt}: {count} за {export_time:.2f} с, {os.path.getsize(path) / 1e6:.1f} МБ; "
+                  f"обратный импорт {again.added} (ошибок {again.error_count}), совпало срабатываний {same}")
@@ -0,0 +1,753 @@
+"""Хранилище будильников с поддерживаемыми индексами сортировки"""
+import bisect
+import heapq
+from datetime import datetime, time as dt_time, timedelta
+
+from recurrence import compile_alarm, to_minutes
+
+
+NO_FIRE = float('inf')  # Ключ для будильников, которые больше не сработают
+
+WEEKDAYS_RU = ["пн", "вт", "ср", "чт", "пт", "сб", "вс"]
+ALARM_TYPES_RU = {"дата": 'date', "неделя": 'weekly', "правило": 'rule'}
+
+SORT_MATCHES = 4096  # Найденных не больше - сортируются сами, иначе обходится индекс представления
+VIEW_PAGE = 1024  # Записей индекса за шаг обхода
+
+# Номера установленных битов для каждого значения байта
+BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+
+def parse_time(time_str):
+    """Время из строки ЧЧ:ММ (strptime в разы медленнее)"""
+    return dt_time(int(time_str[:2]), int(time_str[3:5]))
+
+
+def next_fire_time(alarm, now):
+    """Ближайшее срабатывание будильника строго после now (или None)"""
+    return compile_alarm(alarm).next_after(now)
+
+
+def minute_start(now):
+    """Момент чуть раньше начала текущей минуты: от него ищется срабатывание,
+    чтобы будильник на текущую минуту ещё успел зазвонить"""
+    return now.replace(second=0, microsecond=0) - timedelta(microseconds=1)
+
+
+def minute_of_day(time_str):
+    """Минута суток из строки ЧЧ:ММ"""
+    return int(time_str[:2]) * 60 + int(time_str[3:5])
+
+
+def alarm_weekdays(alarm):
+    """Дни недели, в которые будильник может сработать"""
+    return compile_alarm(alarm).weekdays
+
+
+def query_minute(text):
+    """Минута суток из ЧЧ:ММ в строке поиска или None, если это не время (25:00, 09:99, 7:00)"""
+    digits = text[:2] + text[3:]
+    if len(text) != 5 or text[2] != ":" or not (digits.isascii() and digits.isdigit()):
+        return None
+    hour, minute = int(text[:2]), int(text[3:])
+    return hour * 60 + minute if hour <= 23 and minute <= 59 else None
+
+
+def query_range(token):
+    """(начало, конец) в минутах из "07:00-09:30" или "07:00", иначе None"""
+    if len(token) == 5:
+        start = end = query_minute(token)
+    elif len(token) == 11 and token[5] == "-":
+        start, end = query_minute(token[:5]), query_minute(token[6:])
+    else:
+        return None
+    return None if start is None or end is None else (start, end)
+
+
+def parse_query(text):
+    """Разбор строки поиска в параметры AlarmStore.query
+
+    Понимает диапазон "07:00-09:30" или время "07:00", дни недели "пн".."вс",
+    "дата"/"неделя"/"правило", "вкл"/"выкл"; остальные слова ищутся в подписи.
+    """
+    params = {}
+    words = []
+    for token in text.lower().split():
+        if token in WEEKDAYS_RU:
+            params['weekday'] = WEEKDAYS_RU.index(token)
+        elif token in ALARM_TYPES_RU:
+            params['alarm_type'] = ALARM_TYPES_RU[token]
+        elif token in ("вкл", "выкл"):
+            params['enabled'] = token == "вкл"
+        elif query_range(token):
+            params['start'], params['end'] = query_range(token)
+        else:
+            words.append(token)
+    if words:
+        params['text'] = " ".join(words)
+    return params
+
+
+def merge_sorted(index, entries):
+    """Влить записи в отсортированный список
+
+    Досортировка стоит O(n) сравнений на весь список, insort - сдвиг
+    памяти на запись; маленькую пачку в большой индекс дешевле вставить по одной.
+    """
+    if len(entries) * 64 < len(index):
+        for entry in entries:
+            bisect.insort(index, entry)
+    elif entries:
+        index.extend(entries)
+        index.sort()
+
+
+class Bitset:
+    """Битовое множество номеров слотов поверх bytearray: изменение за O(1)"""
+    def __init__(self):
+        self.data = bytearray()
+
+    def add(self, slot):
+        byte_index = slot >> 3
+        if byte_index >= len(self.data):
+            # Растём с запасом, чтобы не расширять массив на каждую вставку
+            self.data.extend(bytes(max(byte_index + 1, 2 * len(self.data)) - len(self.data)))
+        self.data[byte_index] |= 1 << (slot & 7)
+
+    def discard(self, slot):
+        byte_index = slot >> 3
+        if byte_index < len(self.data):
+            self.data[byte_index] &= ~(1 << (slot & 7)) & 0xFF
+
+    def __contains__(self, slot):
+        byte_index = slot >> 3
+        return byte_index < len(self.data) and bool(self.data[byte_index] >> (slot & 7) & 1)
+
+    def clear(self):
+        self.data = bytearray()
+
+    def to_int(self):
+        """Всё множество одним числом для быстрых & и | """
+        return int.from_bytes(self.data, 'little')
+
+
+class QueryResult:
+    """Результат поиска: битовое множество слотов, будильники достаются лениво"""
+    def __init__(self, store, bits):
+        self.store = store
+        self.count = bits.bit_count()
+        self.data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, alarm):
+        slot = self.store.slots.get(alarm['id'])
+        if slot is None:
+            return False
+        byte_index = slot >> 3
+        return byte_index < len(self.data) and bool(self.data[byte_index] >> (slot & 7) & 1)
+
+    def __iter__(self):
+        slot_alarms = self.store.slot_alarms
+        for byte_index, value in enumerate(self.data):
+            if value:
+                base = byte_index << 3
+                for bit in BYTE_BITS[value]:
+                    yield slot_alarms[base + bit]
+
+
+class AlarmStore:
+    """Будильники по стабильным id и отсортированные представления по колонкам
+
+    Запись ищется и удаляется по id за O(1); порядок (добавления, времени,
+    типа, статуса) хранится отдельно в индексах [(ключ, id)].
+    """
+    # Представления, по которым можно упорядочить список
+    SORT_KEYS = ('added', 'next', 'type', 'enabled')
+
+    def __init__(self):
+        self.records = {}  # id -> будильник
+        self.keys = {}  # id -> {представление: ключ сортировки}
+        self.rules = {}  # id -> скомпилированное правило повторения
+        self.calendars = {}  # Имя -> Calendar: дни, которые будильники могут пропускать
+        self.keyed_after = datetime.min  # Самый поздний момент, от которого считались ключи 'next'
+        self.indexes = {name: [] for name in self.SORT_KEYS}  # [(ключ, id)]
+        self.next_id = 1
+        self.version = 0  # Меняется при любом изменении, окна по нему перерисовываются
+        # id добавленных, удалённых и изменённых будильников с прошлого take_touched();
+        # None - не отслеживаются (отслеживает общая база, shared_store.py)
+        self.touched = None
+
+        # Вторичные индексы для поиска. Каждый будильник занимает слот -
+        # номер бита в битовых множествах; освободившиеся слоты переиспользуются
+        self.slots = {}  # id -> слот
+        self.slot_alarms = []  # Слот -> будильник (или None)
+        self.free_slots = []
+        self.filter_keys = {}  # Слот -> (минута суток, дни недели, тип, включён)
+        self.occupied = Bitset()
+        self.enabled_bits = Bitset()
+        self.type_bits = {alarm_type: Bitset() for alarm_type in ALARM_TYPES_RU.values()}
+        self.weekday_bits = [Bitset() for _ in range(7)]
+        self.minute_index = []  # Отсортированный [(минута суток, слот)]
+        self.hour_bits = [Bitset() for _ in range(24)]  # Целые часы диапазона без перебора
+        self.word_bits = {}  # Слово подписи -> слоты
+        self.word_counts = {}
+        self.words = []  # Отсортированные слова подписей для поиска по префиксу
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records.values())
+
+    def __getitem__(self, alarm_id):
+        return self.records[alarm_id]
+
+    def __contains__(self, alarm_id):
+        return alarm_id in self.records
+
+    def get(self, alarm_id):
+        """Будильник по id (или None, если его уже удалили)"""
+        return self.records.get(alarm_id)
+
+    def sort_keys(self, alarm, after):
+        """Ключи сортировки будильника для каждого индекса
+
+        'next' - первое срабатывание строго после after.
+        """
+        self.keyed_after = max(self.keyed_after, after)
+        next_time = self.rules[alarm['id']].next_after(after)
+        return {
+            'added': alarm['id'],
+            'next': next_time.timestamp() if next_time else NO_FIRE,
+            'type': ('date', 'weekly', 'rule').index(alarm['type']),
+            'enabled': 0 if alarm['enabled'] else 1,  # Включённые выше
+        }
+
+    def _index(self, alarm_id, keys):
+        for name, key in keys.items():
+            bisect.insort(self.indexes[name], (key, alarm_id))
+        self.keys[alarm_id] = keys
+
+    def _unindex(self, alarm_id):
+        for name, key in self.keys.pop(alarm_id).items():
+            index = self.indexes[name]
+            del index[bisect.bisect_left(index, (key, alarm_id))]
+
+    def _index_filters(self, slot, alarm, pending=None):
+        keys = (minute_of_day(alarm['time']), self.rules[alarm['id']].weekdays,
+                alarm['type'], alarm['enabled'],
+                tuple(set(alarm.get('label', '').lower().split())))
+        minute, weekdays, alarm_type, enabled, words = keys
+        self.filter_keys[slot] = keys
+        for word in words:
+            if word not in self.word_bits:
+                self.word_bits[word] = Bitset()
+                self.word_counts[word] = 0
+                bisect.insort(self.words, word)
+            self.word_bits[word].add(slot)
+            self.word_counts[word] += 1
+        self.occupied.add(slot)
+        if enabled:
+            self.enabled_bits.add(slot)
+        self.type_bits[alarm_type].add(slot)
+        for weekday in weekdays:
+            self.weekday_bits[weekday].add(slot)
+        if pending is None:
+            bisect.insort(self.minute_index, (minute, slot))
+        else:
+            pending['minute'].append((minute, slot))
+        self.hour_bits[minute // 60].add(slot)
+
+    def _unindex_filters(self, slot):
+        minute, weekdays, alarm_type, enabled, words = self.filter_keys.pop(slot)
+        for word in words:
+            self.word_bits[word].discard(slot)
+            self.word_counts[word] -= 1
+            if not self.word_counts[word]:
+                del self.word_bits[word]
+                del self.word_counts[word]
+                del self.words[bisect.bisect_left(self.words, word)]
+        self.occupied.discard(slot)
+        self.enabled_bits.discard(slot)
+        self.type_bits[alarm_type].discard(slot)
+        for weekday in weekdays:
+            self.weekday_bits[weekday].discard(slot)
+        del self.minute_index[bisect.bisect_left(self.minute_index, (minute, slot))]
+        self.hour_bits[minute // 60].discard(slot)
+
+    def add(self, alarm, now=None):
+        """Добавить будильник, вернуть его id
+
+        Будильник с уже заданным id (например, загруженный из файла) его сохраняет.
+        Ошибка в правиле повторения - ValueError, будильник не добавляется.
+        """
+        alarm_id = self._insert(alarm, minute_start(now or datetime.now()))
+        self.version += 1
+        return alarm_id
+
+    def add_many(self, alarms, now=None):
+        """Добавить пачку будильников, вернуть [(номер в пачке, текст ошибки)] для отвергнутых
+
+        Индексы не пересортировываются на каждую вставку: записи пачки
+        вливаются в каждый индекс одной сортировкой в конце.
+        """
+        after = minute_start(now or datetime.now())
+        pending = {name: [] for name in self.SORT_KEYS}
+        pending['minute'] = []
+        errors = []
+        for position, alarm in enumerate(alarms):
+            try:
+                self._insert(alarm, after, pending)
+            except KeyError as e:
+                errors.append((position, f"нет поля {e}"))
+            except (ValueError, TypeError) as e:
+                errors.append((position, str(e)))
+
+        for name in self.SORT_KEYS:
+            merge_sorted(self.indexes[name], pending[name])
+        merge_sorted(self.minute_index, pending['minute'])
+        self.version += 1
+        return errors
+
+    def _insert(self, alarm, after, pending=None):
+        """Вставить будильник во все индексы; pending - отложенные записи сортированных индексов"""
+        alarm_id = alarm.get('id')
+        if alarm_id is not None and alarm_id in self.records:
+            raise ValueError(f"Будильник с id {alarm_id} уже есть")
+        rule = compile_alarm(alarm, self.calendars)
+        if alarm_id is None:
+            alarm_id = self.next_id
+            alarm['id'] = alarm_id
+        self.next_id = max(self.next_id, alarm_id + 1)
+
+        self.records[alarm_id] = alarm
+        self.rules[alarm_id] = rule
+        self._touch(alarm_id)
+        keys = self.sort_keys(alarm, after)
+        if pending is None:
+            self._index(alarm_id, keys)
+        else:
+            self.keys[alarm_id] = keys
+            for name, key in keys.items():
+                pending[name].append((key, alarm_id))
+
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.slot_alarms[slot] = alarm
+        else:
+            slot = len(self.slot_alarms)
+            self.slot_alarms.append(alarm)
+        self.slots[alarm_id] = slot
+        self._index_filters(slot, alarm, pending)
+        return alarm_id
+
+    def remove(self, alarm_id):
+        """Удалить будильник по id, вернуть удалённую запись (или None)"""
+        alarm = self.records.pop(alarm_id, None)
+        if alarm is None:
+            return None
+        self._unindex(alarm_id)
+        del self.rules[alarm_id]
+
+        slot = self.slots.pop(alarm_id)
+        self._unindex_filters(slot)
+        self.slot_alarms[slot] = None
+        self.free_slots.append(slot)
+        self._touch(alarm_id)
+        self.version += 1
+        return alarm
+
+    def clear(self):
+        """Удалить все будильники"""
+        if self.touched is not None:
+            self.touched.update(self.records)
+        self.records.clear()
+        self.keys.clear()
+        self.rules.clear()
+        for index in self.indexes.values():
+            index.clear()
+
+        self.slots.clear()
+        self.slot_alarms.clear()
+        self.free_slots.clear()
+        self.filter_keys.clear()
+        self.minute_index.clear()
+        self.word_bits.clear()
+        self.word_counts.clear()
+        self.words.clear()
+        for bits in [self.occupied, self.enabled_bits, *self.type_bits.values(),
+                     *self.weekday_bits, *self.hour_bits]:
+            bits.clear()
+        self.version += 1
+
+    def set_calendars(self, calendars, now=None):
+        """Заменить календари исключений и пересчитать будильники, которые на них ссылаются"""
+        self.calendars = calendars
+        for alarm_id, alarm in self.records.items():
+            if alarm.get('calendars'):
+                self.reindex(alarm_id, now)
+
+    def set_enabled(self, alarm_id, enabled):
+        """Включить/выключить будильник
+
+        Правило от этого не меняется, поэтому обновляются только ключ
+        'enabled' и битовое множество включённых, а не все индексы.
+        """
+        alarm = self.records[alarm_id]
+        if alarm['enabled'] == enabled:
+            return
+        alarm['enabled'] = enabled
+        keys = self.keys[alarm_id]
+        index = self.indexes['enabled']
+        del index[bisect.bisect_left(index, (keys['enabled'], alarm_id))]
+        keys['enabled'] = 0 if enabled else 1
+        bisect.insort(index, (keys['enabled'], alarm_id))
+
+        slot = self.slots[alarm_id]
+        if enabled:
+            self.enabled_bits.add(slot)
+        else:
+            self.enabled_bits.discard(slot)
+        minute, weekdays, alarm_type, _, words = self.filter_keys[slot]
+        self.filter_keys[slot] = (minute, weekdays, alarm_type, enabled, words)
+        self._touch(alarm_id)
+        self.version += 1
+
+    def reindex(self, alarm_id, now=None):
+        """Обновить все индексы после изменения полей будильника"""
+        alarm = self.records[alarm_id]
+        self.rules[alarm_id] = compile_alarm(alarm, self.calendars)
+        self._unindex(alarm_id)
+        self._index(alarm_id, self.sort_keys(alarm, minute_start(now or datetime.now())))
+        slot = self.slots[alarm_id]
+        self._unindex_filters(slot)
+        self._index_filters(slot, alarm)
+        self._touch(alarm_id)
+        self.version += 1
+
+    def set_last_triggered(self, alarm_id, moment):
+        """Запомнить последнее срабатывание; индексы от него не зависят, меняется только version"""
+        self.records[alarm_id]['last_triggered'] = moment
+        self.version += 1
+
+    def _touch(self, alarm_id):
+        if self.touched is not None:
+            self.touched.add(alarm_id)
+
+    def take_touched(self):
+        """id изменённых будильников с прошлого вызова (None - не отслеживались); дальше отслеживаются"""
+        touched, self.touched = self.touched, set()
+        return touched
+
+    def refresh(self, now):
+        """Пересчитать ключи "следующего срабатывания", которые уже наступили
+
+        Устаревшие ключи всегда в начале индекса, поэтому обходятся
+        только они, а не весь список. Возвращает [(момент, будильник)]
+        наступивших срабатываний включённых будильников - это и есть
+        будильники, которым пора звонить.
+        """
+        index = self.indexes['next']
+        count = bisect.bisect_right(index, (now.timestamp(), NO_FIRE))
+        if not count:
+            return []
+        stale = index[:count]
+        del index[:count]
+
+        # Меняется только ключ 'next', остальные индексы не трогаем
+        self.keyed_after = max(self.keyed_after, now)
+        due = []
+        rekeyed = []
+        for key, alarm_id in stale:
+            alarm = self.records[alarm_id]
+            if alarm['enabled']:
+                due.append((datetime.fromtimestamp(key), alarm))
+            next_time = self.rules[alarm_id].next_after(now)
+            next_key = next_time.timestamp() if next_time else NO_FIRE
+            self.keys[alarm_id]['next'] = next_key
+            rekeyed.append((next_key, alarm_id))
+
+        if len(rekeyed) > 64:
+            # Пачку проще влить одной сортировкой: timsort сливает два отсортированных куска
+            index.extend(rekeyed)
+            index.sort()
+        else:
+            for entry in rekeyed:
+                bisect.insort(index, entry)
+        self.version += 1
+        return due
+
+    def sorted_view(self, name):
+        """Индекс [(ключ, id)] представления; name=None - порядок добавления"""
+        return self.indexes[name or 'added']
+
+    def iter_view(self, name, reverse=False):
+        """Будильники в порядке представления name (None - порядок добавления)"""
+        index = self.sorted_view(name)
+        return (self.records[alarm_id] for _, alarm_id in (reversed(index) if reverse else index))
+
+    def query_view(self, found, name, reverse=False):
+        """Найденные будильники (QueryResult) в порядке представления name, лениво
+
+        Немного найденных сортируются по своим ключам. Иначе индекс обходится
+        страницами, каждая пересекается с битами результата по слотам, и обход
+        кончается, как только встретились все найденные.
+        """
+        if len(found) <= SORT_MATCHES:
+            keys = self.keys
+            name = name or 'added'
+            entries = sorted(((keys[alarm['id']][name], alarm['id']) for alarm in found), reverse=reverse)
+            return (self.records[alarm_id] for _, alarm_id in entries)
+        return self._scan_view(found, self.sorted_view(name), reverse)
+
+    def _scan_view(self, found, index, reverse):
+        slots = self.slots
+        records = self.records
+        data = found.data
+        size = len(data)
+        left = len(found)
+        if reverse:
+            pages = (index[max(0, end - VIEW_PAGE):end][::-1] for end in range(len(index), 0, -VIEW_PAGE))
+        else:
+            pages = (index[start:start + VIEW_PAGE] for start in range(0, len(index), VIEW_PAGE))
+        for page in pages:
+            for _, alarm_id in page:
+                slot = slots[alarm_id]
+                byte_index = slot >> 3
+                if byte_index < size and data[byte_index] >> (slot & 7) & 1:
+                    yield records[alarm_id]
+                    left -= 1
+                    if not left:
+                        return
+
+    def view_item(self, view, position):
+        """Будильник на позиции индекса"""
+        return self.records[view[position][1]]
+
+    def occurrences(self, start, end, enabled=True):
+        """Все срабатывания в [start, end] по времени: поток (момент, будильник)
+
+        Ленивое k-путевое слияние генераторов срабатываний отдельных
+        будильников через кучу. Если окно начинается не раньше момента, от
+        которого считались ключи 'next', будильник попадает в кучу только
+        когда слияние доходит до его ключа: раньше ключа у него срабатываний
+        нет. Поэтому первая страница окна на месяц по 100 000 будильников не
+        требует обойти их все. Поток действителен, пока хранилище не менялось
+        (см. version). enabled=None - вместе с выключенными.
+        """
+        after = start - timedelta(microseconds=1)
+        end_key = end.timestamp()
+        index = self.indexes['next']
+        heap = []
+
+        def admit(alarm_id):
+            alarm = self.records[alarm_id]
+            if enabled is not None and alarm['enabled'] != enabled:
+                return
+            fires = self.rules[alarm_id].iter_after(after)
+            first = next(fires, None)
+            if first is not None and first <= end:
+                heapq.heappush(heap, (first, alarm_id, alarm, fires))
+
+        if after >= self.keyed_after:
+            position = 0
+        else:
+            # Окно в прошлом: ключи не помогают, берём все будильники сразу
+            for alarm_id in list(self.records):
+                admit(alarm_id)
+            position = len(index)
+
+        while True:
+            limit = heap[0][0].timestamp() if heap else end_key
+            while position < len(index) and index[position][0] <= limit:
+                admit(index[position][1])
+                position += 1
+                limit = heap[0][0].timestamp() if heap else end_key
+            if not heap:
+                return
+            fire_time, alarm_id, alarm, fires = heap[0]
+            yield fire_time, alarm
+            following = next(fires, None)
+            if following is not None and following <= end:
+                heapq.heapreplace(heap, (following, alarm_id, alarm, fires))
+            else:
+                heapq.heappop(heap)
+
+    def next_enabled(self):
+        """Включённый будильник с ближайшим срабатыванием и его время"""
+        for key, alarm_id in self.indexes['next']:
+            if key == NO_FIRE:
+                break
+            alarm = self.records[alarm_id]
+            if alarm['enabled']:
+                return alarm, datetime.fromtimestamp(key)
+        return None, None
+
+    def prefix_bits(self, prefix):
+        """Битовое множество будильников, в подписи которых есть слово с этим префиксом"""
+        bits = 0
+        position = bisect.bisect_left(self.words, prefix)
+        while position < len(self.words) and self.words[position].startswith(prefix):
+            bits |= self.word_bits[self.words[position]].to_int()
+            position += 1
+        return bits
+
+    def minute_bits(self, start, end):
+        """Битовое множество будильников со временем в диапазоне минут [start, end]"""
+        # Минуты вне суток (вызов из API) обрезаются: часовых множеств всего 24
+        start = min(max(start, 0), 24 * 60 - 1)
+        end = min(max(end, 0), 24 * 60 - 1)
+        if start > end:  # Диапазон через полночь: 22:00-06:00
+            return self.minute_bits(start, 24 * 60 - 1) | self.minute_bits(0, end)
+
+        # Целые часы берутся из часовых множеств, по индексу минут - только края
+        first_hour = -(-start // 60)
+        last_hour = (end + 1) // 60
+        if first_hour >= last_hour:
+            return self.minute_slice_bits(start, end)
+        bits = 0
+        for hour in range(first_hour, last_hour):
+            bits |= self.hour_bits[hour].to_int()
+        if start < first_hour * 60:
+            bits |= self.minute_slice_bits(start, first_hour * 60 - 1)
+        if last_hour * 60 <= end:
+            bits |= self.minute_slice_bits(last_hour * 60, end)
+        return bits
+
+    def minute_slice_bits(self, start, end):
+        """Битовое множество по отсортированному индексу минут"""
+        low = bisect.bisect_left(self.minute_index, (start, -1))
+        high = bisect.bisect_right(self.minute_index, (end, len(self.slot_alarms)))
+        data = bytearray((len(self.slot_alarms) + 7) >> 3)
+        for _, slot in self.minute_index[low:high]:
+            data[slot >> 3] |= 1 << (slot & 7)
+        return int.from_bytes(data, 'little')
+
+    def query(self, start=None, end=None, weekday=None, alarm_type=None, enabled=None, text=None):
+        """Будильники, подходящие под все заданные условия
+
+        start/end - минуты суток, weekday - 0..6, alarm_type - 'date'/'weekly',
+        enabled - True/False, text - начала слов подписи. Условия пересекаются
+        как битовые множества; будильники достаются из результата лениво.
+        """
+        bits = self.occupied.to_int()
+        if enabled is not None:
+            enabled_bits = self.enabled_bits.to_int()
+            bits = bits & enabled_bits if enabled else bits & ~enabled_bits
+        if alarm_type is not None:
+            bits &= self.type_bits[alarm_type].to_int()
+        if weekday is not None:
+            bits &= self.weekday_bits[weekday].to_int()
+        if text:
+            for word in text.lower().split():
+                bits &= self.prefix_bits(word)
+        if start is not None and bits:
+            bits &= self.minute_bits(start, start if end is None else end)
+        return QueryResult(self, bits)
+
+    def fires_between(self, start, end):
+        """Срабатывания включённых будильников с минутами в отрезке [start, end]
+
+        Возвращает [(момент, будильник)] по возрастанию момента. Для будильников
+        по дате и дням недели каждый день отрезка разбирается одним запросом
+        к индексу минут и дней недели, будильники с правилом (они могут звонить
+        несколько раз в сутки) перечисляют свои срабатывания сами.
+        """
+        fires = []
+        day = start.date()
+        while day <= end.date():
+            first = start.hour * 60 + start.minute if day == start.date() else 0
+            last = end.hour * 60 + end.minute if day == end.date() else 24 * 60 - 1
+            for alarm in self.query(start=first, end=last, weekday=day.weekday(), enabled=True):
+                if alarm['type'] == 'rule':
+                    continue
+                fire_time = datetime.combine(day, parse_time(alarm['time']))
+                # Правило отсекает чужие даты и исключённые дни
+                minutes = to_minutes(fire_time)
+                if self.rules[alarm['id']].next_minute(minutes) == minutes:
+                    fires.append((fire_time, alarm))
+            day += timedelta(days=1)
+
+        for alarm in self.query(alarm_type='rule', enabled=True):
+            for fire_time in self.rules[alarm['id']].between(start, end):
+                fires.append((fire_time, alarm))
+        fires.sort(key=lambda fire: (fire[0], fire[1]['id']))
+        return fires
+
+
+if __name__ == "__main__":
+    # Бенчмарк расписания: поток срабатываний на 30 дней по 100 000 будильников
+    import random
+    import time
+    import tracemalloc
+    from itertools import islice
+
+    random.seed(1)
+    now = datetime(2026, 10, 19, 12, 0, 30)
+    store = AlarmStore()
+    started = time.perf_counter()
+    for _ in range(100000):
+        time_str = f"{random.randrange(24):02d}:{random.randrange(60):02d}"
+        kind = random.random()
+        if kind < 0.3:
+            day = now.date() + timedelta(days=random.randrange(-10, 365))
+            alarm = {'type': 'date', 'date': day.isoformat(), 'time': time_str}
+        elif kind < 0.8:
+            alarm = {'type': 'weekly', 'weekdays': random.sample(range(7), random.randint(1, 5)), 'time': time_str}
+        else:
+            rule = random.choice(({'freq': 'daily', 'interval': random.randint(1, 5)},
+                                  {'freq': 'monthly', 'nth_weekdays': [[random.randrange(7), -1]]},
+                                  {'freq': 'monthly', 'monthdays': [random.randint(1, 31)]}))
+            alarm = {'type': 'rule', 'rule': rule, 'time': time_str}
+        alarm['enabled'] = random.random() < 0.8
+        store.add(alarm, now)
+    print(f"Будильников: {len(store)}, добавление {time.perf_counter() - started:.1f} с")
+
+    end = now + timedelta(days=30)
+    started = time.perf_counter()
+    first_page = list(islice(store.occurrences(now, end), 20))
+    print(f"Первая страница (20): {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    started = time.perf_counter()
+    count = sum(1 for _ in islice(store.occurrences(now, end), 10000))
+    print(f"Первые {count}: {(time.perf_counter() - started) * 1000:.0f} мс")
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    count = 0
+    last = None
+    for fire_time, alarm in store.occurrences(now, end):
+        assert last is None or fire_time >= last
+        last = fire_time
+        count += 1
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"Всё окно: {count} срабатываний за {elapsed:.1f} с (под tracemalloc), "
+          f"пик памяти {peak / 1e6:.1f} МБ против ~{count * 120 / 1e6:.0f} МБ для списка")
+
+    # Поиск с сортировкой: страница из 20 строк против фильтрации всего индекса
+    for title, found in (("пн", store.query(weekday=0)), ("07:00-07:10", store.query(start=420, end=430)),
+                         ("включённые", store.query(enabled=True))):
+        for name in ('next', 'type'):
+            for reverse in (False, True):
+                offset = min(2000, len(found) // 2)
+                started = time.perf_counter()
+                page = list(islice(store.query_view(found, name, reverse), offset, offset + 20))
+                view_ms = (time.perf_counter() - started) * 1000
+                started = time.perf_counter()
+                expected = list(islice((alarm for alarm in store.iter_view(name, reverse) if alarm in found),
+                                       offset, offset + 20))
+                filter_ms = (time.perf_counter() - started) * 1000
+                assert len(page) == 20 and page == expected, (title, name, reverse)
+                print(f"Поиск «{title}» ({len(found)}), {name}{' обратно' if reverse else ''}, "
+                      f"строки {offset}-{offset + 20}: {view_ms:.1f} мс, фильтр индекса {filter_ms:.1f} мс")
+
+    # Время вне суток в строке поиска - слово подписи, а не диапазон
+    for text in ("20:00-25:00", "07:00-09:99", "24:00", "7:00"):
+        assert parse_query(text) == {'text': text}, text
+    assert parse_query("22:00-06:00") == {'start': 22 * 60, 'end': 6 * 60}
+    assert store.minute_bits(20 * 60, 25 * 60) == store.minute_bits(20 * 60, 24 * 60 - 1)
+    print("Строка поиска: время вне суток не ломает поиск")
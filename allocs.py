@@ -0,0 +1,301 @@
+"""Выделения памяти за кадр и за тик по классам окон (tracemalloc)
+
+Кадр, в котором создаются Label, Rectangle и Sprite, выделяет сотни
+килобайт; надписи pyglet держат циклические ссылки, так что этот мусор
+копится до сборщика мусора, а тот останавливает программу. Окна поэтому
+создают надписи и фигуры один раз и в кадре только рисуют их.
+
+AllocationMeter, пока включён, оборачивает on_draw классов окон программы
+и обратные вызовы часов pyglet, принадлежащие объектам программы, и для
+каждого вызова записывает через tracemalloc:
+    пик  - сколько байт было выделено сверх начала вызова в худший момент;
+    остаток - сколько из них осталось после вызова (мусор с циклами, утечки).
+Кадры считаются по классу окна, тики - по классу владельца обратного вызова
+(AlarmApp.update обновляет и часы главного окна).
+
+    python main.py --allocs  - замер с запуска, отчёт в журнал при выходе
+
+tracemalloc замедляет программу в разы, так что в рабочей сборке замер
+выключен и ничего не стоит.
+
+python allocs.py - проверка: главное окно, окно будильника, список и выбор
+мелодии рисуются без остановки; код выхода 1, если в среднем за кадр пик
+больше FRAME_BUDGET или остаток больше RETAINED_BUDGET байт.
+"""
+import gc
+import tracemalloc
+
+import pyglet
+
+from journal import log
+from stats import Histogram
+from tracing import SCHEDULE_METHODS, window_classes
+
+
+# Границы корзин в байтах
+BYTE_BOUNDS = (0, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+FRAME_BUDGET = 2048  # Средний пик за кадр, байт; pyglet сам выделяет несколько сотен на вызовы GL
+RETAINED_BUDGET = 64  # Средний остаток за кадр, байт
+FRAME = 'кадр'
+TICK = 'тик'
+
+
+def owner_name(func):
+    """Класс объекта, которому принадлежит обратный вызов, или None (функции, лямбды, сам pyglet)"""
+    owner = getattr(func, '__self__', None)
+    if owner is None or type(owner).__module__.startswith('pyglet'):
+        return None
+    return type(owner).__name__
+
+
+class MeteredCall:
+    """Обёртка обратного вызова часов; равна исходной функции, так что unschedule её находит"""
+    __slots__ = ('func', 'key', 'meter')
+
+    def __init__(self, func, key, meter):
+        self.func = func
+        self.key = key
+        self.meter = meter
+
+    def __call__(self, *args, **kwargs):
+        return self.meter.measure(self.key, self.func, *args, **kwargs)
+
+    def __eq__(self, other):
+        if isinstance(other, MeteredCall):
+            other = other.func
+        return self.func == other
+
+    def __hash__(self):
+        return hash(self.func)
+
+
+def metered_draw(method, meter):
+    """Обёртка on_draw класса окна: выделения записываются по классу самого окна"""
+    def on_draw(window):
+        return meter.measure((type(window).__name__, FRAME), method, window)
+    on_draw.__wrapped__ = method
+    on_draw.__qualname__ = method.__qualname__
+    return on_draw
+
+
+class AllocationMeter:
+    """Выделения по (класс, кадр/тик); start() оборачивает, stop() возвращает всё как было"""
+    def __init__(self):
+        self.enabled = False
+        self.own_tracing = False  # tracemalloc запущен нами, а не снаружи
+        self.clock = None
+        self.handlers = []  # (класс, исходный on_draw)
+        self.depth = 0
+        self.peaks = {}  # (класс, вид) -> Histogram пиков
+        self.retained = {}  # (класс, вид) -> сумма остатков
+        self.collections = [0, 0, 0]  # Сборок мусора по поколениям, пока замер включён
+        self.overhead = (0, 0)  # Пик и остаток самого замера (пустой вызов)
+
+    def start(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.own_tracing = True
+        self.calibrate()
+        # Часы: уже стоящие в расписании вызовы объектов программы и все новые
+        self.clock = clock = pyglet.clock.get_default()
+        for item in self.scheduled_items():
+            item.func = self.wrap(item.func)
+        for name in SCHEDULE_METHODS:
+            original = getattr(clock, name)
+
+            def schedule(func, *args, _original=original, **kwargs):
+                return _original(self.wrap(func), *args, **kwargs)
+            setattr(clock, name, schedule)
+        for cls in window_classes():
+            method = cls.__dict__.get('on_draw')
+            if callable(method):
+                self.handlers.append((cls, method))
+                cls.on_draw = metered_draw(method, self)
+        gc.callbacks.append(self.count_collection)
+        log.info('allocs-started', "Замер выделений памяти включён")
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        for name in SCHEDULE_METHODS:
+            self.clock.__dict__.pop(name, None)
+        for item in self.scheduled_items():
+            if isinstance(item.func, MeteredCall):
+                item.func = item.func.func
+        for cls, method in self.handlers:
+            cls.on_draw = method
+        self.handlers.clear()
+        gc.callbacks.remove(self.count_collection)
+        if self.own_tracing:
+            tracemalloc.stop()
+            self.own_tracing = False
+
+    def wrap(self, func):
+        if isinstance(func, MeteredCall):
+            return func
+        name = owner_name(func)
+        return func if name is None else MeteredCall(func, (name, TICK), self)
+
+    def scheduled_items(self):
+        clock = self.clock
+        items = list(clock._schedule_items) + list(clock._schedule_interval_items)
+        if clock._current_interval_item is not None:
+            items.append(clock._current_interval_item)
+        return items
+
+    def measure(self, key, function, *args, **kwargs):
+        if self.depth:
+            # Вложенный вызов (тик рисует окно) входит в объемлющий: reset_peak сбил бы его пик
+            return function(*args, **kwargs)
+        self.depth = 1
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        try:
+            return function(*args, **kwargs)
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            self.depth = 0
+            self.record(key, peak - before, current - before)
+
+    def calibrate(self):
+        """Сколько показывает замер пустого вызова: это вычитается из каждого замера"""
+        samples = []
+        self.record = lambda key, peak, retained: samples.append((peak, retained))
+        for _ in range(20):
+            self.measure(None, int)
+        del self.record
+        samples.sort()
+        self.overhead = samples[len(samples) // 2]
+
+    def record(self, key, peak, retained):
+        peak = max(peak - self.overhead[0], 0)
+        retained -= self.overhead[1]  # Меньше нуля, если вызов освободил больше, чем выделил
+        histogram = self.peaks.get(key)
+        if histogram is None:
+            histogram = self.peaks[key] = Histogram(BYTE_BOUNDS)
+            self.retained[key] = 0
+        histogram.record(peak)
+        self.retained[key] += retained
+
+    def count_collection(self, phase, info):
+        if phase == 'start':
+            self.collections[info['generation']] += 1
+
+    def reset(self):
+        self.peaks.clear()
+        self.retained.clear()
+        self.collections = [0, 0, 0]
+
+    def report(self):
+        """{(класс, вид): {'calls', 'peak', 'peak_max', 'retained'}} - средние байты на вызов"""
+        return {key: {'calls': histogram.count, 'peak': histogram.mean(), 'peak_max': histogram.max,
+                      'retained': self.retained[key] / histogram.count}
+                for key, histogram in self.peaks.items() if histogram.count}
+
+    def format(self):
+        report = self.report()
+        if not report:
+            return "Выделения памяти: вызовов не было"
+        lines = ["Выделения памяти (байт на вызов: средний пик, макс пик, остаток):"]
+        for (name, kind), values in sorted(report.items()):
+            lines.append(f"  {name} {kind}: {values['calls']} вызовов, пик {values['peak']:.0f}, "
+                         f"макс {values['peak_max']:.0f}, остаток {values['retained']:.0f}")
+        lines.append("Сборок мусора по поколениям: " + ", ".join(map(str, self.collections)))
+        return "\n".join(lines)
+
+    def finish(self):
+        """Выход из программы: отчёт в журнал и снять обёртки"""
+        if not self.enabled:
+            return
+        log.info('allocations', "{report}", report=self.format(), collections=self.collections,
+                 windows={f"{name} {kind}": values for (name, kind), values in self.report().items()})
+        self.stop()
+
+
+if __name__ == "__main__":
+    # Проверка бюджета: окна рисуются по кругу DURATION секунд, часы pyglet идут между кадрами
+    import sys
+    import tempfile
+    import time
+    from pathlib import Path
+
+    if "--display" not in sys.argv:
+        pyglet.options['headless'] = True
+    import scheduler
+    import status
+    # Не трогаем res/alarms.jsonl и res/status.bin запущенной программы
+    directory = Path(tempfile.mkdtemp())
+    scheduler.STORE_PATH = directory / "alarms.jsonl"
+    status.STATUS_PATH = directory / "status.bin"
+    import main
+
+    DURATION = 3.0
+    WARMUP_FRAMES = 30
+    CHECKED = ('MainWindow', 'AlarmWindow', 'AlarmListWindow', 'SoundSelectWindow')
+
+    app = main.AlarmApp(lazy=False)
+    app.alarms.add_many([
+        {'type': 'weekly', 'time': '06:30', 'weekdays': [0, 2, 4], 'label': "работа", 'enabled': True},
+        {'type': 'weekly', 'time': '09:00', 'weekdays': [5, 6], 'label': "выходные", 'enabled': False},
+        {'type': 'date', 'date': '2030-01-02', 'time': '07:00', 'label': "поезд", 'enabled': True},
+    ])
+    windows = [app.main_window, main.AlarmWindow(app.main_window), main.AlarmListWindow(app),
+               main.SoundSelectWindow(app)]
+    pyglet.window.Window._enable_event_queue = False  # Вне pyglet.app.run события окна иначе копятся в очереди
+    clock = pyglet.clock.get_default()
+    meter = AllocationMeter()
+
+    def run(seconds):
+        """Все окна по кадру, потом тик часов; столько проходов, сколько влезет в seconds"""
+        passes = 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            for window in windows:
+                window.draw(1 / 60)
+            clock.tick(True)
+            passes += 1
+        return passes
+
+    # Прогрев: шрифты, текстуры глифов, первая вёрстка надписей
+    run(1.0)
+    for _ in range(WARMUP_FRAMES):
+        for window in windows:
+            window.draw(1 / 60)
+    meter.start()
+    run(0.5)
+    meter.reset()
+    # Остаток за кадр честный, только пока сборщик мусора не убирает циклы посреди замера
+    gc.collect()
+    gc.disable()
+    passes = run(DURATION)
+    gc.enable()
+    report = meter.report()
+    meter.reset()
+    # Сборки мусора за то же время при обычной работе сборщика
+    collected_passes = run(DURATION)
+    collections = list(meter.collections)
+    meter.stop()
+    app.shutdown()
+    log.flush()  # Сообщения программы - до таблицы
+
+    failed = []
+    print(f"Проходов по всем окнам: {passes} (с tracemalloc, сборщик мусора выключен)")
+    for (name, kind), values in sorted(report.items()):
+        over = name in CHECKED and kind == FRAME and (values['peak'] > FRAME_BUDGET
+                                                      or values['retained'] > RETAINED_BUDGET)
+        if over:
+            failed.append(name)
+        print(f"{name + ' ' + kind:<24} {values['calls']:6} вызовов, пик {values['peak']:8.0f} Б "
+              f"(макс {values['peak_max']:8.0f}), остаток {values['retained']:8.0f} Б"
+              f"{'  ПРЕВЫШЕН БЮДЖЕТ' if over else ''}")
+    missing = [name for name in CHECKED if (name, FRAME) not in report]
+    print(f"Бюджет кадра: пик <= {FRAME_BUDGET} Б, остаток <= {RETAINED_BUDGET} Б")
+    print(f"Сборок мусора за {collected_passes} проходов: поколения 0/1/2 - "
+          f"{'/'.join(map(str, collections))}")
+    if missing:
+        print(f"Нет кадров: {', '.join(missing)}")
+    sys.exit(1 if failed or missing else 0)
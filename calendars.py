@@ -0,0 +1,167 @@
+"""Календари исключений (праздники, отпуска) из локальных файлов
+
+Файл - текст в UTF-8, по дате или диапазону дат на строку:
+    # Комментарий
+    [ru]                                   # начало календаря ru (необязательно)
+    2026-01-01..2026-01-08 Новогодние каникулы
+    2026-02-23 День защитника Отечества
+Без заголовка [имя] календарь называется по имени файла. Несколько файлов
+могут дополнять один и тот же календарь.
+"""
+import bisect
+from datetime import date
+from pathlib import Path
+
+
+class Calendar:
+    """Скомпилированный календарь: битовое множество дней и отрезки подряд идущих дней
+
+    Проверка "пропускается ли день" - один бит, O(1). Следующий
+    непропущенный день находится бинарным поиском по отрезкам, так что
+    серия праздников перепрыгивается целиком, а не по дню.
+    """
+    def __init__(self, name, days):
+        self.name = name
+        days = sorted(set(days))
+        self.count = len(days)
+        self.first = days[0] if days else 0
+        span = days[-1] - self.first + 1 if days else 0
+        self.bits = bytearray((span + 7) >> 3)
+
+        self.run_starts = []
+        self.run_ends = []
+        for day in days:
+            offset = day - self.first
+            self.bits[offset >> 3] |= 1 << (offset & 7)
+            if self.run_ends and self.run_ends[-1] == day - 1:
+                self.run_ends[-1] = day
+            else:
+                self.run_starts.append(day)
+                self.run_ends.append(day)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, day):
+        """Пропускается ли день (номер дня date.toordinal())"""
+        offset = day - self.first
+        return 0 <= offset < len(self.bits) << 3 and bool(self.bits[offset >> 3] >> (offset & 7) & 1)
+
+    def skipped_until(self, day):
+        """Последний день серии пропусков, в которую попал day, или None"""
+        if day not in self:
+            return None
+        return self.run_ends[bisect.bisect_right(self.run_starts, day) - 1]
+
+
+def parse_calendar_lines(lines, default_name, days_by_name, errors, source=""):
+    """Разобрать строки календаря в days_by_name: имя -> [номера дней]
+
+    Ошибочные строки не прерывают разбор, а складываются в errors.
+    """
+    name = default_name
+    for line_number, line in enumerate(lines, 1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            name = line[1:-1].strip() or default_name
+            continue
+
+        token = line.split(None, 1)[0]
+        try:
+            if '..' in token:
+                first, last = token.split('..', 1)
+                first = date.fromisoformat(first).toordinal()
+                last = date.fromisoformat(last).toordinal()
+                if last < first:
+                    raise ValueError("конец диапазона раньше начала")
+                days_by_name.setdefault(name, []).extend(range(first, last + 1))
+            else:
+                days_by_name.setdefault(name, []).append(date.fromisoformat(token).toordinal())
+        except ValueError as e:
+            errors.append(f"{source}:{line_number}: {line} ({e})")
+
+
+def load_calendars(directory):
+    """Загрузить все календари из *.txt в папке, вернуть ({имя: Calendar}, [ошибки])"""
+    days_by_name = {}
+    errors = []
+    directory = Path(directory)
+    if directory.is_dir():
+        for path in sorted(directory.glob("*.txt")):
+            try:
+                with open(path, encoding="utf-8") as file:
+                    parse_calendar_lines(file, path.stem, days_by_name, errors, path.name)
+            except (OSError, UnicodeDecodeError) as e:
+                errors.append(f"{path.name}: {e}")
+    calendars = {name: Calendar(name, days) for name, days in days_by_name.items()}
+    return calendars, errors
+
+
+if __name__ == "__main__":
+    # Бенчмарк: 200 регионов по ~3000 дат, следующее срабатывание с пропуском праздников
+    import random
+    import tempfile
+    import time
+    from datetime import datetime
+
+    from recurrence import compile_rule
+
+    random.seed(1)
+    first_day = date(2020, 1, 1).toordinal()
+    with tempfile.TemporaryDirectory() as directory:
+        for region in range(200):
+            lines = [f"[region{region}]"]
+            day = first_day
+            while day < first_day + 20 * 365:
+                day += random.randint(1, 5)
+                # Иногда длинный отпуск - серия подряд идущих дней
+                length = random.choice((1, 1, 1, 2, 3, 14))
+                lines.append(f"{date.fromordinal(day).isoformat()}..{date.fromordinal(day + length - 1).isoformat()}")
+                day += length
+            Path(directory, f"region{region}.txt").write_text("\n".join(lines), encoding="utf-8")
+
+        started = time.perf_counter()
+        calendars, errors = load_calendars(directory)
+        load_time = time.perf_counter() - started
+
+    total_days = sum(len(calendar) for calendar in calendars.values())
+    print(f"Календарей: {len(calendars)}, дней: {total_days}, ошибок: {len(errors)}")
+    print(f"Загрузка и компиляция: {load_time * 1000:.0f} мс")
+
+    names = list(calendars)
+    probes = [(calendars[random.choice(names)], first_day + random.randrange(20 * 365)) for _ in range(1000000)]
+    started = time.perf_counter()
+    hits = sum(1 for calendar, day in probes if day in calendar)
+    probe_time = time.perf_counter() - started
+    print(f"Проверка дня: {probe_time / len(probes) * 1e9:.0f} нс, пропускается {hits / len(probes):.0%}")
+
+    rules = []
+    for _ in range(100000):
+        skips = [calendars[name] for name in random.sample(names, random.randint(1, 3))]
+        rule = {'freq': 'weekly', 'weekdays': random.sample(range(7), random.randint(1, 5))}
+        rules.append((compile_rule(rule, "07:30", skips), compile_rule(rule, "07:30"), skips))
+
+    now = datetime(2026, 10, 19, 12, 0)
+    started = time.perf_counter()
+    found = [with_calendars.next_after(now) for with_calendars, _, _ in rules]
+    with_time = time.perf_counter() - started
+    started = time.perf_counter()
+    for _, plain, _ in rules:
+        plain.next_after(now)
+    plain_time = time.perf_counter() - started
+    print(f"Следующее срабатывание: {with_time / len(rules) * 1e6:.1f} мкс с календарями, "
+          f"{plain_time / len(rules) * 1e6:.1f} мкс без них")
+
+    # Сверка с перебором по дням
+    errors = 0
+    for (with_calendars, plain, skips), expected_time in list(zip(rules, found))[:2000]:
+        moment = now
+        while True:
+            moment = plain.next_after(moment)
+            if not any(moment.toordinal() in calendar for calendar in skips):
+                break
+        if moment != expected_time:
+            errors += 1
+    print(f"Расхождений с перебором по дням: {errors}")
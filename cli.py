@@ -0,0 +1,191 @@
+"""Будильники из командной строки, без запуска окна программы
+
+    python cli.py add 07:30 --weekdays пн,ср,пт --label "Подъём"
+    python cli.py add 9:00 --date 01.12.2026
+    python cli.py add 8:00 --rule "FREQ=MONTHLY;BYDAY=-1FR" --calendar ru
+    python cli.py list [поиск ...] [--sort next|type|enabled]
+    python cli.py next [-n 5]
+    python cli.py enable|disable|delete ID [ID ...]
+    python cli.py import ФАЙЛ [ФАЙЛ ...]
+
+Работает с тем же файлом res/alarms.jsonl, что и окно (запущенное окно
+подхватывает изменения в течение секунды). pyglet не импортируется, так что
+команда выполняется за десятки миллисекунд и годится для cron и скриптов.
+Код возврата: 0 - успех, 1 - ошибка в данных или нет такого будильника.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from pathlib import Path
+
+from alarm_io import STORE_PATH, alarm_from_record, import_alarms, load_store, save_store
+from alarm_store import AlarmStore, parse_query
+from calendars import load_calendars
+from recurrence import describe_rule
+
+
+BASE_DIR = Path(__file__).resolve().parent  # res/ ищется рядом с программой, а не в текущей папке
+NEXT_HORIZON = timedelta(days=400)  # Дальше команда next не заглядывает
+
+
+def describe(alarm):
+    """Когда звонит будильник, коротко"""
+    if alarm['type'] == 'date':
+        return ".".join(reversed(alarm['date'].split('-')))
+    if alarm['type'] == 'weekly':
+        return describe_rule({'freq': 'weekly', 'weekdays': alarm['weekdays']})
+    return describe_rule(alarm['rule'])
+
+
+def format_alarm(alarm, next_time=None):
+    status = "вкл " if alarm['enabled'] else "выкл"
+    when = next_time.strftime("%d.%m.%Y %H:%M") if next_time else "-"
+    return f"{alarm['id']:>5}  {status}  {alarm['time']}  {describe(alarm):<20}  {when:<16}  {alarm.get('label', '')}"
+
+
+def open_store(args):
+    """Хранилище с календарями и сохранёнными будильниками"""
+    store = AlarmStore()
+    calendars, errors = load_calendars(args.store.parent / "calendars")
+    for error in errors:
+        print(f"Ошибка в календаре: {error}", file=sys.stderr)
+    store.set_calendars(calendars)
+    report = load_store(store, args.store)
+    if report.error_count:
+        print(report.format(), file=sys.stderr)
+    return store
+
+
+def command_add(args, store):
+    record = {'time': args.time, 'date': args.date, 'weekdays': args.weekdays, 'rule': args.rule,
+              'start': args.start, 'label': args.label, 'calendars': args.calendar, 'enabled': not args.disabled}
+    if args.snooze:
+        record.update(repeat_5min=True, snooze_minutes=args.snooze, snooze_count=args.repeats)
+    try:
+        record['hooks'] = [json.loads(hook) for hook in args.hook]
+        alarm = alarm_from_record(record)
+        if alarm['type'] == 'date' and datetime.fromisoformat(f"{alarm['date']}T{alarm['time']}") < datetime.now():
+            raise ValueError("Нельзя установить на прошедшее время")
+        store.add(alarm)
+    except ValueError as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+    save_store(store, args.store)
+    print(f"Добавлен: {format_alarm(alarm, store.rules[alarm['id']].next_after(datetime.now()))}")
+    return 0
+
+
+def command_list(args, store):
+    if args.query:
+        found = store.query(**parse_query(" ".join(args.query)))
+        alarms = store.query_view(found, args.sort)
+    else:
+        alarms = store.iter_view(args.sort)
+    now = datetime.now()
+    for alarm in alarms:
+        print(format_alarm(alarm, store.rules[alarm['id']].next_after(now)))
+    return 0
+
+
+def command_next(args, store):
+    now = datetime.now()
+    fires = list(islice(store.occurrences(now, now + NEXT_HORIZON), args.count))
+    if not fires:
+        print("Включённых будильников нет")
+    for moment, alarm in fires:
+        print(format_alarm(alarm, moment))
+    return 0
+
+
+def command_set(args, store):
+    """enable, disable и delete: по списку id, отсутствующие - ошибка"""
+    missing = [alarm_id for alarm_id in args.ids if alarm_id not in store]
+    for alarm_id in args.ids:
+        if alarm_id in missing:
+            continue
+        if args.command == 'delete':
+            store.remove(alarm_id)
+        else:
+            store.set_enabled(alarm_id, args.command == 'enable')
+    if len(missing) < len(args.ids):
+        save_store(store, args.store)
+    for alarm_id in missing:
+        print(f"Нет будильника {alarm_id}", file=sys.stderr)
+    return 1 if missing else 0
+
+
+def command_import(args, store):
+    failed = False
+    for path in args.files:
+        try:
+            report = import_alarms(store, path)
+        except (OSError, ValueError) as e:
+            print(f"Не удалось прочитать {path}: {e}", file=sys.stderr)
+            failed = True
+            continue
+        print(report.format())
+        failed = failed or report.error_count > 0
+    save_store(store, args.store)
+    return 1 if failed else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="Будильники без запуска окна")
+    parser.add_argument("--store", type=Path, default=BASE_DIR / STORE_PATH,
+                        help="файл будильников (по умолчанию res/alarms.jsonl рядом с программой)")
+    parser.add_argument("--timing", action="store_true", help="вывести время запуска и выполнения")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="добавить будильник")
+    add.add_argument("time", help="время ЧЧ:ММ")
+    when = add.add_mutually_exclusive_group(required=True)
+    when.add_argument("--date", help="дата ДД.ММ.ГГГГ или ГГГГ-ММ-ДД")
+    when.add_argument("--weekdays", help="дни недели: пн,ср или 0,2")
+    when.add_argument("--rule", help="правило RRULE, например FREQ=MONTHLY;BYDAY=-1FR")
+    add.add_argument("--start", help="первый день правила ДД.ММ.ГГГГ (по умолчанию сегодня)")
+    add.add_argument("--label", default="", help="подпись")
+    add.add_argument("--calendar", action="append", default=[], help="пропускать дни календаря (можно несколько)")
+    add.add_argument("--snooze", type=int, default=0, help="повторять через N минут")
+    add.add_argument("--repeats", type=int, default=1, help="сколько раз повторять")
+    add.add_argument("--disabled", action="store_true", help="добавить выключенным")
+    add.add_argument("--hook", action="append", default=[],
+                     help='действие при срабатывании, JSON: {"type": "command", "run": ["notify-send", "$label"]}')
+    add.set_defaults(handler=command_add)
+
+    listing = commands.add_parser("list", help="список будильников")
+    listing.add_argument("query", nargs="*", help='поиск как в окне списка: "пн 07:00-09:00 вкл"')
+    listing.add_argument("--sort", choices=("added", "next", "type", "enabled"), default="added")
+    listing.set_defaults(handler=command_list)
+
+    upcoming = commands.add_parser("next", help="ближайшие срабатывания")
+    upcoming.add_argument("-n", "--count", type=int, default=1)
+    upcoming.set_defaults(handler=command_next)
+
+    for name, text in (("enable", "включить"), ("disable", "выключить"), ("delete", "удалить")):
+        command = commands.add_parser(name, help=f"{text} будильники по id")
+        command.add_argument("ids", type=int, nargs="+")
+        command.set_defaults(handler=command_set)
+
+    importing = commands.add_parser("import", help="импорт из .csv, .jsonl, .ics")
+    importing.add_argument("files", nargs="+")
+    importing.set_defaults(handler=command_import)
+    return parser
+
+
+def main(argv=None):
+    started = time.perf_counter()
+    args = build_parser().parse_args(argv)
+    store = open_store(args)
+    loaded = time.perf_counter()
+    code = args.handler(args, store)
+    if args.timing:
+        print(f"Загрузка {len(store)} будильников: {(loaded - started) * 1000:.1f} мс, "
+              f"команда: {(time.perf_counter() - loaded) * 1000:.1f} мс", file=sys.stderr)
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,548 @@
+"""Управление запущенной программой из других процессов: JSON-RPC 2.0 через Unix-сокет
+
+Запрос (или пакет запросов - JSON-массив) занимает одну строку, ответ - тоже.
+Методы (параметры - по имени):
+    add {time, date|weekdays|rule, label, ...} -> id       (поля как в alarm_io)
+    list {query, sort, offset, limit}         -> {"total": N, "alarms": [...]}  (limit <= LIST_LIMIT)
+    enable / disable / toggle {id}            -> включён ли будильник
+    delete {id}                               -> true
+    stop {}                                   -> сколько звонков остановлено
+    next {count}                              -> [{"id": ..., "time": "ГГГГ-ММ-ДДTЧЧ:ММ"}]
+    trace {enabled}                           -> включена ли трассировка (tracing.py)
+    trace_dump {path}                         -> {"path": ..., "events": N}
+Пакет из тысяч изменений - один обмен по сокету; подряд идущие add
+вставляются в хранилище через add_many.
+
+Сокет обслуживает asyncio в отдельном потоке, а хранилище меняется только в
+потоке pyglet: запросы копятся в очереди, и pump() на каждом кадре разбирает
+их не дольше PUMP_BUDGET. Большой пакет растягивается на несколько кадров.
+Перед каждым шагом pump() сверяет с бюджетом замеренную цену шага, а не
+только уже потраченное время: пачка add уменьшается, когда растёт хранилище,
+а list отдаёт не больше LIST_LIMIT будильников за запрос. Добавленные
+будильники замораживаются от полной сборки мусора (AlarmApp.freeze_alarms)
+каждые FREEZE_ADDS штук: иначе на 100 тыс. она останавливает кадр на 0.3 с.
+"""
+import asyncio
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from pathlib import Path
+
+from alarm_io import alarm_from_record, alarm_to_dict
+from alarm_store import parse_query
+from journal import log
+
+
+CONTROL_PATH = Path("res") / "control.sock"
+PUMP_BUDGET = 0.004  # Секунд работы с очередью за кадр (кадр при 60 к/с - 16.7 мс)
+ADD_CHUNK = 50  # Больше всего add подряд в одном add_many
+LIST_LIMIT = 1000  # Больше всего будильников в ответе list
+FREEZE_ADDS = 1000  # Через сколько добавленных будильников они замораживаются
+MAX_LINE = 64 * 1024 * 1024  # Самая длинная строка запроса
+NEXT_HORIZON = timedelta(days=400)
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+
+class RpcError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+def error_response(request_id, code, message):
+    return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': code, 'message': message}}
+
+
+def resolve(future, result):
+    """Отдать результат, если клиент ещё ждёт (он мог отключиться)"""
+    if not future.done():
+        future.set_result(result)
+
+
+class Job:
+    """Запросы одной строки; разбираются в потоке pyglet, возможно за несколько кадров"""
+    def __init__(self, calls, loop, future):
+        self.calls = calls
+        self.loop = loop
+        self.future = future
+        self.responses = []
+        self.position = 0
+
+
+class ControlServer:
+    """JSON-RPC сервер: сокет в потоке asyncio, изменения - в pump() из потока pyglet"""
+    def __init__(self, app, path=CONTROL_PATH):
+        self.app = app
+        self.path = Path(path)
+        self.jobs = queue.SimpleQueue()
+        self.current = None  # Недоразобранный Job с прошлого кадра
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.calls_done = 0
+        # Замеренная цена шагов pump(), секунд: одного add в пачке и любого другого запроса
+        self.add_cost = 0.0
+        self.call_cost = 0.0
+        self.unfrozen = 0  # Добавлено будильников с последней заморозки
+        self.methods = {
+            'add': None,  # Обрабатывается пачками в run_adds
+            'list': self.rpc_list,
+            'enable': self.rpc_enable,
+            'disable': self.rpc_disable,
+            'toggle': self.rpc_toggle,
+            'delete': self.rpc_delete,
+            'stop': self.rpc_stop,
+            'next': self.rpc_next,
+            'trace': self.rpc_trace,
+            'trace_dump': self.rpc_trace_dump,
+        }
+
+    # --- Поток asyncio ---
+
+    def start(self):
+        """Открыть сокет в фоновом потоке; False, если не вышло"""
+        if not hasattr(socket, 'AF_UNIX'):
+            log.warning('control-disabled', "Unix-сокеты не поддерживаются: управление из других процессов отключено")
+            return False
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self.serve, args=(ready,), name="control", daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self.server is not None
+
+    async def attach(self):
+        """Открыть сокет в уже работающем цикле asyncio (main.py --asyncio) вместо своего потока"""
+        if not hasattr(socket, 'AF_UNIX'):
+            log.warning('control-disabled', "Unix-сокеты не поддерживаются: управление из других процессов отключено")
+            return False
+        self.loop = asyncio.get_running_loop()
+        try:
+            self.server = await self.open()
+        except OSError as e:
+            log.error('control-disabled', "Управление отключено, сокет {path}: {error}", path=str(self.path), error=str(e))
+            return False
+        return True
+
+    def serve(self, ready):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.server = self.loop.run_until_complete(self.open())
+        except OSError as e:
+            log.error('control-disabled', "Управление отключено, сокет {path}: {error}", path=str(self.path), error=str(e))
+            return
+        finally:
+            ready.set()
+        self.loop.run_forever()
+
+    async def open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.is_socket():
+            # Сокет остался от упавшего процесса - или программа уже запущена
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(str(self.path))
+                raise OSError("программа уже запущена")
+            except ConnectionRefusedError:
+                self.path.unlink()
+            finally:
+                probe.close()
+        server = await asyncio.start_unix_server(self.handle_client, str(self.path), limit=MAX_LINE)
+        os.chmod(self.path, 0o600)
+        return server
+
+    def stop(self):
+        if self.server is None:
+            return
+        if self.thread is None:
+            self.server.close()  # Сокет в общем цикле (attach)
+        else:
+            self.loop.call_soon_threadsafe(self.server.close)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(1)
+        self.server = None
+        try:
+            self.path.unlink()
+        except OSError:
+            pass
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self.submit(line)
+                if response is not None:
+                    writer.write(response)
+                    await writer.drain()
+        except (ConnectionError, ValueError):
+            pass  # Клиент отключился или прислал слишком длинную строку
+        finally:
+            writer.close()
+
+    async def submit(self, line):
+        """Поставить строку в очередь для потока pyglet и дождаться ответа"""
+        try:
+            message = json.loads(line)
+        except ValueError as e:
+            return self.encode(error_response(None, PARSE_ERROR, f"JSON: {e}"))
+        batch = isinstance(message, list)
+        if batch and not message:
+            return self.encode(error_response(None, INVALID_REQUEST, "Пустой пакет"))
+        future = self.loop.create_future()
+        self.jobs.put(Job(message if batch else [message], self.loop, future))
+        responses = await future
+        if not responses:
+            return None  # Одни уведомления - ответа нет
+        return self.encode(responses if batch else responses[0])
+
+    @staticmethod
+    def encode(message):
+        return (json.dumps(message, ensure_ascii=False) + "\n").encode()
+
+    # --- Поток pyglet ---
+
+    def pump(self, dt=None):
+        """Разобрать очередь запросов, не тратя больше PUMP_BUDGET за вызов
+
+        Шаг, который по замеренной цене не успевает до конца бюджета, ждёт
+        следующего кадра; первый шаг выполняется всегда, иначе дорогой запрос
+        не выполнился бы никогда.
+        """
+        if self.unfrozen >= FREEZE_ADDS:
+            self.app.freeze_alarms()  # Сливает списки сборщика: дешевле микросекунды
+            self.unfrozen = 0
+        deadline = time.perf_counter() + PUMP_BUDGET
+        first = True
+        while True:
+            if self.current is None:
+                try:
+                    self.current = self.jobs.get_nowait()
+                except queue.Empty:
+                    return
+            job = self.current
+            while job.position < len(job.calls):
+                now = time.perf_counter()
+                if self.is_add(job.calls[job.position]):
+                    # Пачка такая, чтобы уложиться в остаток бюджета
+                    fits = int((deadline - now) / self.add_cost) if self.add_cost else ADD_CHUNK
+                    if fits < 1 and not first:
+                        return  # Остальное - на следующем кадре
+                    limit = min(max(fits, 1), ADD_CHUNK)
+                    end = job.position + 1
+                    while end < len(job.calls) and end - job.position < limit and self.is_add(job.calls[end]):
+                        end += 1
+                    job.responses.extend(self.run_adds(job.calls[job.position:end]))
+                    self.add_cost = self.measured(self.add_cost, (time.perf_counter() - now) / (end - job.position))
+                    self.calls_done += end - job.position
+                    job.position = end
+                else:
+                    if now + self.call_cost > deadline and not first:
+                        return
+                    response = self.run_call(job.calls[job.position])
+                    if response is not None:
+                        job.responses.append(response)
+                    self.call_cost = self.measured(self.call_cost, time.perf_counter() - now)
+                    self.calls_done += 1
+                    job.position += 1
+                first = False
+            self.current = None
+            job.loop.call_soon_threadsafe(resolve, job.future, job.responses)
+
+    @staticmethod
+    def measured(estimate, cost):
+        """Новая оценка цены шага: дорогой шаг учитывается сразу, дешёвые снижают её постепенно"""
+        return cost if cost > estimate else estimate + (cost - estimate) / 8
+
+    @staticmethod
+    def is_add(call):
+        return isinstance(call, dict) and call.get('method') == 'add' and isinstance(call.get('params'), dict)
+
+    def run_call(self, call):
+        """Ответ на один запрос (None для уведомления)"""
+        if not isinstance(call, dict) or not isinstance(call.get('method'), str):
+            return error_response(None, INVALID_REQUEST, "Ожидался объект с полем method")
+        request_id = call.get('id')
+        try:
+            if call['method'] not in self.methods:
+                raise RpcError(METHOD_NOT_FOUND, f"Нет метода {call['method']}")
+            method = self.methods[call['method']]
+            if method is None:
+                # add без параметров или с параметрами-списком: сюда не дошёл бы только add-объект
+                raise RpcError(INVALID_PARAMS, "Параметры add - объект с полями будильника")
+            params = call.get('params', {})
+            result = method(*params) if isinstance(params, list) else method(**params)
+        except RpcError as e:
+            response = error_response(request_id, e.code, str(e))
+        except (ValueError, TypeError, KeyError) as e:
+            response = error_response(request_id, INVALID_PARAMS, str(e))
+        except Exception as e:
+            log.error('rpc-error', "Ошибка при выполнении {method}: {error}", method=call['method'], error=repr(e))
+            response = error_response(request_id, INTERNAL_ERROR, repr(e))
+        else:
+            response = {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+        return response if 'id' in call else None
+
+    def run_adds(self, calls):
+        """Ответы на подряд идущие add: разбор по одному, вставка одной пачкой"""
+        responses = [None] * len(calls)
+        alarms = []
+        owners = []  # Номер запроса для каждого разобранного будильника
+        for position, call in enumerate(calls):
+            try:
+                alarms.append(alarm_from_record(call['params']))
+                owners.append(position)
+            except (ValueError, TypeError) as e:
+                responses[position] = error_response(call.get('id'), INVALID_PARAMS, str(e))
+        errors = dict(self.app.alarms.add_many(alarms))
+        self.unfrozen += len(alarms) - len(errors)
+        for alarm_position, alarm in enumerate(alarms):
+            call = calls[owners[alarm_position]]
+            if alarm_position in errors:
+                response = error_response(call.get('id'), INVALID_PARAMS, errors[alarm_position])
+            else:
+                response = {'jsonrpc': '2.0', 'id': call.get('id'), 'result': alarm['id']}
+            responses[owners[alarm_position]] = response
+        return [response for response, call in zip(responses, calls) if 'id' in call]
+
+    # --- Методы ---
+
+    def alarm(self, alarm_id):
+        alarm = self.app.alarms.get(alarm_id)
+        if alarm is None:
+            raise RpcError(INVALID_PARAMS, f"Нет будильника {alarm_id}")
+        return alarm
+
+    def rpc_list(self, query="", sort="added", offset=0, limit=100):
+        store = self.app.alarms
+        if sort not in store.SORT_KEYS:
+            raise ValueError(f"Сортировка только по {', '.join(store.SORT_KEYS)}")
+        if not 0 <= limit <= LIST_LIMIT or offset < 0:
+            raise ValueError(f"limit от 0 до {LIST_LIMIT}, offset не меньше 0; дальше - следующими страницами")
+        if query:
+            found = store.query(**parse_query(query))
+            alarms = islice(store.query_view(found, sort), offset, offset + limit)
+            total = len(found)
+        else:
+            # Страница берётся срезом индекса: обход до offset стоил бы O(offset)
+            view = store.sorted_view(sort)
+            alarms = (store.view_item(view, position) for position in range(offset, min(offset + limit, len(view))))
+            total = len(store)
+        return {'total': total, 'alarms': [alarm_to_dict(alarm) for alarm in alarms]}
+
+    def set_enabled(self, alarm_id, enabled):
+        self.alarm(alarm_id)
+        self.app.alarms.set_enabled(alarm_id, enabled)
+        return enabled
+
+    def rpc_enable(self, id):
+        return self.set_enabled(id, True)
+
+    def rpc_disable(self, id):
+        return self.set_enabled(id, False)
+
+    def rpc_toggle(self, id):
+        return self.set_enabled(id, not self.alarm(id)['enabled'])
+
+    def rpc_delete(self, id):
+        self.alarm(id)
+        self.app.delete_alarm(id)
+        return True
+
+    def rpc_stop(self):
+        count = len(self.app.ringing)
+        self.app.stop_alarm()
+        return count
+
+    def rpc_next(self, count=1):
+        now = datetime.now()
+        return [{'id': alarm['id'], 'time': moment.isoformat(timespec='minutes')}
+                for moment, alarm in islice(self.app.alarms.occurrences(now, now + NEXT_HORIZON), count)]
+
+    def rpc_trace(self, enabled=True):
+        if enabled:
+            self.app.tracer.start()
+        else:
+            self.app.tracer.stop()
+        return self.app.tracer.enabled
+
+    def rpc_trace_dump(self, path=None):
+        try:
+            path, count = self.app.tracer.dump(path)
+        except OSError as e:
+            raise RpcError(INTERNAL_ERROR, f"Не удалось записать трассу: {e}")
+        return {'path': str(path), 'events': count}
+
+
+class ControlClient:
+    """Простой синхронный клиент для скриптов"""
+    def __init__(self, path=CONTROL_PATH, timeout=60):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(str(path))
+        self.file = self.sock.makefile('rwb')
+        self.next_id = 1
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def request(self, message):
+        self.file.write(json.dumps(message, ensure_ascii=False).encode() + b"\n")
+        self.file.flush()
+        return json.loads(self.file.readline())
+
+    def message(self, method, params):
+        message = {'jsonrpc': '2.0', 'id': self.next_id, 'method': method, 'params': params}
+        self.next_id += 1
+        return message
+
+    def call(self, method, **params):
+        response = self.request(self.message(method, params))
+        if 'error' in response:
+            raise RpcError(response['error']['code'], response['error']['message'])
+        return response['result']
+
+    def batch(self, calls):
+        """[(метод, параметры)] -> [результат или RpcError] в том же порядке"""
+        responses = self.request([self.message(method, params) for method, params in calls])
+        by_id = {response['id']: response for response in responses}
+        first = self.next_id - len(calls)
+        results = []
+        for request_id in range(first, self.next_id):
+            response = by_id[request_id]
+            if 'error' in response:
+                results.append(RpcError(response['error']['code'], response['error']['message']))
+            else:
+                results.append(response['result'])
+        return results
+
+
+if __name__ == "__main__":
+    # Бенчмарк: сервер с настоящим хранилищем, главный поток изображает кадры по 1/60 с, клиент -
+    # в отдельном процессе, как у настоящих скриптов (в том же процессе он отнимал бы GIL у кадров);
+    # код выхода 1, если pump() вышел из бюджета кадра или ошибки пришли не с теми кодами
+    import gc
+    import random
+    import subprocess
+    import sys
+    import tempfile
+
+    from alarm_store import AlarmStore
+    from stats import Histogram
+
+    def random_alarm():
+        return {'time': f"{random.randrange(24):02d}:{random.randrange(60):02d}",
+                'weekdays': random.sample(range(7), 2), 'label': random.choice(["Подъём", "Работа"])}
+
+    if len(sys.argv) == 3 and sys.argv[1] == "--client":
+        random.seed(1)
+        results = {}
+        client = ControlClient(sys.argv[2])
+        started = time.perf_counter()
+        for _ in range(300):
+            client.call('add', **random_alarm())
+        results['single'] = (300, time.perf_counter() - started)
+
+        ids = []
+        started = time.perf_counter()
+        for _ in range(100):
+            ids += client.batch([('add', random_alarm()) for _ in range(1000)])
+        results['batch add'] = (100000, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for position in range(0, 50000, 1000):
+            client.batch([('toggle', {'id': alarm_id}) for alarm_id in ids[position:position + 1000]])
+        results['batch toggle'] = (50000, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for _ in range(100):
+            client.call('list', query="пн 07:00-09:00", limit=100)
+        results['list'] = (100, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for offset in range(0, 100000, 10000):
+            client.call('list', sort="next", offset=offset, limit=LIST_LIMIT)
+        results['list 1000'] = (10, time.perf_counter() - started)
+
+        errors = client.batch([('add', {'time': "25:00", 'weekdays': [0]}), ('nope', {}), ('delete', {'id': 10 ** 9}),
+                               ('add', ["07:00"]), ('list', {'limit': 100000})])
+        errors = [[error.code, str(error)] for error in errors]
+        missing_params = client.request({'jsonrpc': '2.0', 'id': 0, 'method': 'add'})['error']
+        errors.append([missing_params['code'], missing_params['message']])
+        results['errors'] = errors
+        client.close()
+        print(json.dumps(results, ensure_ascii=False))
+        sys.exit(0)
+
+    class BenchApp:
+        def __init__(self):
+            self.alarms = AlarmStore()
+            self.ringing = {}
+
+        def delete_alarm(self, alarm_id):
+            self.alarms.remove(alarm_id)
+
+        def stop_alarm(self):
+            self.ringing.clear()
+
+        @staticmethod
+        def freeze_alarms():
+            gc.freeze()
+
+    app = BenchApp()
+    directory = tempfile.mkdtemp()
+    server = ControlServer(app, Path(directory, "control.sock"))
+    assert server.start()
+
+    worker = subprocess.Popen([sys.executable, __file__, "--client", str(server.path)],
+                              stdout=subprocess.PIPE, text=True)
+    # Бюджет сверяется по времени процессора потока кадров: на общем ядре настенное время
+    # включает и работу клиента и потока asyncio, которой pump() не управляет
+    bounds = (0.001, 0.002, 0.004, 0.006, 0.008, 0.016, 0.033)
+    frame_work = Histogram(bounds)
+    frame_wall = Histogram(bounds)
+    next_frame = time.perf_counter()
+    while worker.poll() is None:
+        started = time.perf_counter()
+        started_cpu = time.thread_time()
+        server.pump()
+        frame_work.record(time.thread_time() - started_cpu)
+        frame_wall.record(time.perf_counter() - started)
+        next_frame += 1 / 60
+        time.sleep(max(0.0, next_frame - time.perf_counter()))
+    server.stop()
+    results = json.loads(worker.stdout.read())
+
+    for name in ('single', 'batch add', 'batch toggle', 'list', 'list 1000'):
+        count, elapsed = results[name]
+        print(f"{name}: {count} за {elapsed:.2f} с, {count / elapsed:.0f} в секунду")
+    print("Ошибки в пакете:", [message for _, message in results['errors']])
+    codes = [code for code, _ in results['errors']]
+    expected = [INVALID_PARAMS, METHOD_NOT_FOUND, INVALID_PARAMS, INVALID_PARAMS, INVALID_PARAMS, INVALID_PARAMS]
+    print(f"Будильников в хранилище: {len(app.alarms)}")
+    print("Работа pump() за кадр (процессор потока кадров):")
+    print(frame_work.format("с"))
+    print("То же по настенному времени:")
+    print(frame_wall.format("с").splitlines()[0])
+    # Медиана - в бюджете; 99% вызовов укладываются в кадр (за бюджет выходит только один
+    # начатый шаг, например list с поиском); ни один не стоит больше двух кадров - редкие
+    # шаги дороже оценки (перестройка словарей хранилища) сбивают не больше одного кадра
+    over_budget = (frame_work.percentile(0.5) > PUMP_BUDGET or frame_work.percentile(0.99) > 1 / 60
+                   or frame_work.max > 2 / 60)
+    if over_budget:
+        print(f"pump() вышел из бюджета {PUMP_BUDGET * 1000:g} мс: p50 <= {frame_work.percentile(0.5) * 1000:g} мс, "
+              f"p99 <= {frame_work.percentile(0.99) * 1000:g} мс, макс {frame_work.max * 1000:.1f} мс")
+    if codes != expected:
+        print(f"Коды ошибок {codes}, ожидались {expected}")
+    sys.exit(1 if over_budget or codes != expected else 0)
@@ -0,0 +1,166 @@
+"""Цикл событий pyglet внутри asyncio
+
+pyglet.app.run() сам ждёт событий окон и таймеров pyglet.clock, поэтому всё
+остальное (сохранение, сокеты, поиск файлов) либо задерживает окна, либо
+заводит свои потоки. run_pyglet() делает то же, что EventLoop.run, но ждёт
+средствами asyncio: между кадрами в том же потоке работают корутины, и
+ни одна не ждёт дольше, чем длится шаг соседней.
+
+Ждём до ближайшего таймера pyglet.clock (перерисовка стоит в расписании,
+так что не дольше кадра) или до события окна: дескрипторы X11 и канал
+уведомлений pyglet asyncio слушает через add_reader. Где дескрипторов нет
+(Windows, macOS), события окон забираются на каждом кадре.
+
+python event_loop.py - ровность кадров и точность таймера pyglet.clock в
+родном цикле и в asyncio, без нагрузки и с фоновой работой по 2 мс.
+"""
+import asyncio
+import time
+
+import pyglet
+
+
+TIMER_SLACK = 0.001  # epoll отмеряет таймауты asyncio с округлением вверх до мс
+
+
+def redraw_windows(dt):
+    for window in pyglet.app.windows:
+        window.draw(dt)
+
+
+async def run_pyglet(interval=1 / 60):
+    """Аналог pyglet.app.run(interval) для asyncio: возвращается после pyglet.app.exit()
+
+    Шаг цикла pyglet - обычный обратный вызов asyncio (по таймеру или по
+    готовности дескриптора), а не корутина: он выполняется в той же итерации
+    цикла asyncio, в которой наступил его срок, и опаздывает не больше чем на
+    один шаг чужой корутины.
+    """
+    event_loop = pyglet.app.event_loop
+    platform_loop = pyglet.app.platform_event_loop
+    clock = pyglet.clock.get_default()
+    loop = asyncio.get_running_loop()
+    finished = loop.create_future()
+    timer = None
+
+    def step():
+        nonlocal timer
+        if timer is not None:
+            timer.cancel()
+            timer = None
+        if finished.done():
+            return
+        try:
+            # Таймер asyncio будит на TIMER_SLACK раньше, последнюю долю миллисекунды досыпаем сами
+            remaining = clock.get_sleep_time(True)
+            if remaining and remaining <= TIMER_SLACK:
+                time.sleep(remaining)
+            timeout = event_loop.idle()
+            platform_loop.step(0)
+        except Exception as e:
+            finished.set_exception(e)  # Как в pyglet.app.run: ошибка обработчика завершает цикл
+            return
+        if event_loop.has_exit:
+            finished.set_result(None)
+            return
+        if not readers:
+            timeout = interval if timeout is None else min(timeout, interval)
+        if timeout is not None:
+            timer = loop.call_later(max(0.0, timeout - TIMER_SLACK), step)
+
+    pyglet.clock.schedule_interval(redraw_windows, interval)
+    event_loop.has_exit = False
+    pyglet.window.Window._enable_event_queue = False
+    for window in pyglet.app.windows:
+        window.switch_to()
+        window.dispatch_pending_events()
+
+    readers = [device.fileno() for device in getattr(platform_loop, 'select_devices', ())]
+    for fd in readers:
+        loop.add_reader(fd, step)
+    platform_loop.start()
+    event_loop.dispatch_event('on_enter')
+    event_loop.is_running = True
+    try:
+        step()
+        await finished
+    finally:
+        if timer is not None:
+            timer.cancel()
+        event_loop.is_running = False
+        for fd in readers:
+            loop.remove_reader(fd)
+        pyglet.clock.unschedule(redraw_windows)
+        event_loop.dispatch_event('on_exit')
+        platform_loop.stop()
+
+
+if __name__ == "__main__":
+    # Бенчмарк: кадры 60 к/с и таймер 10 Гц, 5 с на режим
+    import statistics
+    import sys
+
+    if "--display" not in sys.argv:
+        pyglet.options['headless'] = True
+
+    DURATION = 5.0
+    WORK_SLICE = 0.002
+
+    def busy(seconds):
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            pass
+
+    async def background_work():
+        """Корутина с длинной работой, нарезанной кусками по 2 мс"""
+        while True:
+            busy(WORK_SLICE)
+            await asyncio.sleep(0)
+
+    window = pyglet.window.Window(200, 100, visible=False)
+
+    def measure(mode, load):
+        frames = []
+        timer = []
+        started = time.perf_counter()
+
+        @window.event
+        def on_draw():
+            frames.append(time.perf_counter())
+            window.clear()
+
+        def tick(dt):
+            timer.append(time.perf_counter())
+
+        def work(dt):
+            busy(WORK_SLICE)
+
+        pyglet.clock.schedule_interval(tick, 0.1)
+        pyglet.clock.schedule_once(lambda dt: pyglet.app.exit(), DURATION)
+        if mode == 'pyglet':
+            if load:
+                pyglet.clock.schedule(work)  # Без asyncio фоновая работа - на каждом проходе цикла
+            pyglet.app.run()
+            pyglet.clock.unschedule(work)
+            pyglet.clock.unschedule(pyglet.app.event_loop._redraw_windows)  # run() сам не снимает
+        else:
+            async def main():
+                task = asyncio.create_task(background_work()) if load else None
+                await run_pyglet()
+                if task:
+                    task.cancel()
+            asyncio.run(main())
+        pyglet.clock.unschedule(tick)
+        window.remove_handler('on_draw', on_draw)
+
+        intervals = [(b - a) * 1000 for a, b in zip(frames, frames[1:])]
+        timer_error = [abs((b - a) - 0.1) * 1000 for a, b in zip(timer, timer[1:])]
+        jitter = [abs(value - 1000 / 60) for value in intervals]
+        print(f"{mode:<8} {'нагрузка' if load else 'простой':<9} кадров {len(frames) / (time.perf_counter() - started):5.1f}/с, "
+              f"интервал p50 {statistics.median(intervals):5.1f} мс, отклонение p99 "
+              f"{sorted(jitter)[int(len(jitter) * 0.99)]:5.1f} мс, макс {max(intervals):5.1f} мс; "
+              f"таймер 10 Гц: ошибка средн {statistics.mean(timer_error):4.1f} мс, макс {max(timer_error):4.1f} мс")
+
+    for load in (False, True):
+        for mode in ('pyglet', 'asyncio'):
+            measure(mode, load)
@@ -0,0 +1,422 @@
+"""Поток событий будильников для других процессов: публикация и подписка
+
+События - JSON-объекты с полями type, seq (номер по порядку) и ts (время публикации):
+    fired            {id, label, time, fire_time, late, repeats_left}  будильник зазвонил
+    repeat-fired     {id, label, time, fire_time, late, repeats_left}  зазвонил повтор
+    stopped          {id}                                            звонок остановили
+    auto-stopped     {id}                                            звонок остановлен через минуту
+    repeat-scheduled {id, at, repeats_left}                          поставлен следующий повтор
+    hook-done        {id, hook, ok, seconds, error}                  выполнено действие будильника (hooks.py)
+
+Подписка:
+    Unix-сокет res/events.sock - события по строке JSON. Первой строкой клиент
+    присылает настройки: {"types": ["fired"], "policy": "drop-oldest", "queue": 256}
+    (можно пустой объект {}).
+    SSE - GET http://127.0.0.1:8765/events?types=fired,stopped&policy=drop-newest&queue=256
+    Порт задаёт переменная окружения WAKEUP_SSE_PORT: 0 - любой свободный (он
+    пишется в журнал), off - без SSE. Если порт занят, работает только сокет.
+
+publish() вызывается из потока pyglet и никого не ждёт: событие передаётся в
+поток asyncio, там один раз сериализуется и раскладывается по очередям
+подписчиков. Очередь подписчика ограничена; когда медленный подписчик её
+переполняет, действует его политика: drop-oldest выбрасывает старые события,
+drop-newest - новые, disconnect отключает подписчика. О выброшенных событиях
+подписчик узнаёт из события {"type": "dropped", "count": N}.
+"""
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from journal import log
+
+
+EVENTS_PATH = Path("res") / "events.sock"
+SSE_HOST = "127.0.0.1"
+DEFAULT_SSE_PORT = 8765
+EVENT_TYPES = ('fired', 'repeat-fired', 'stopped', 'auto-stopped', 'repeat-scheduled', 'hook-done')
+POLICIES = ('drop-oldest', 'drop-newest', 'disconnect')
+DEFAULT_QUEUE = 256  # Событий в очереди подписчика
+MAX_QUEUE = 65536
+HANDSHAKE_TIMEOUT = 5.0  # Секунд на строку настроек или заголовки HTTP
+
+SSE_HEADERS = (b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+               b"Cache-Control: no-cache\r\nConnection: keep-alive\r\n\r\n")
+
+
+def sse_port(value=None):
+    """Порт SSE из WAKEUP_SSE_PORT: число (0 - любой свободный) или None - SSE выключен"""
+    if value is None:
+        value = os.environ.get('WAKEUP_SSE_PORT', '')
+    value = value.strip()
+    if not value:
+        return DEFAULT_SSE_PORT
+    if value.lower() == 'off':
+        return None
+    try:
+        port = int(value)
+    except ValueError:
+        port = -1
+    if not 0 <= port <= 65535:
+        log.warning('sse-port', "WAKEUP_SSE_PORT={value} - не порт, SSE на {port}",
+                    value=value, port=DEFAULT_SSE_PORT)
+        return DEFAULT_SSE_PORT
+    return port
+
+
+def subscription_options(types=None, policy=None, queue=None):
+    """Проверенные настройки подписки: (типы или None - все, политика, длина очереди)"""
+    if types:
+        types = set(types)
+        unknown = types - set(EVENT_TYPES)
+        if unknown:
+            raise ValueError(f"Неизвестные события: {', '.join(sorted(unknown))}")
+    policy = policy or POLICIES[0]
+    if policy not in POLICIES:
+        raise ValueError(f"Политика только {', '.join(POLICIES)}")
+    queue = int(queue or DEFAULT_QUEUE)
+    if not 1 <= queue <= MAX_QUEUE:
+        raise ValueError(f"Очередь от 1 до {MAX_QUEUE}")
+    return types or None, policy, queue
+
+
+class Subscriber:
+    """Подписчик: ограниченная очередь готовых байтов и задача, которая их пишет"""
+    def __init__(self, writer, sse, types, policy, limit):
+        self.writer = writer
+        self.sse = sse
+        self.types = types
+        self.policy = policy
+        self.limit = limit
+        self.queue = deque()
+        self.wakeup = asyncio.Event()
+        self.dropped = 0
+        self.closed = False
+        self.delivered = 0
+
+    def offer(self, kind, line, sse):
+        """Положить событие в очередь; никогда не ждёт"""
+        if self.closed or (self.types is not None and kind not in self.types):
+            return
+        if len(self.queue) >= self.limit:
+            self.dropped += 1
+            if self.policy == 'drop-newest':
+                return
+            if self.policy == 'disconnect':
+                self.closed = True
+                self.wakeup.set()
+                return
+            self.queue.popleft()
+        self.queue.append(sse if self.sse else line)
+        self.wakeup.set()
+
+    def dropped_notice(self):
+        data = json.dumps({'type': 'dropped', 'count': self.dropped})
+        self.dropped = 0
+        return f"event: dropped\ndata: {data}\n\n".encode() if self.sse else (data + "\n").encode()
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            if self.closed:
+                return
+            chunks = []
+            if self.dropped:
+                chunks.append(self.dropped_notice())
+            self.delivered += len(self.queue)
+            chunks.extend(self.queue)
+            self.queue.clear()
+            # Пока ждём медленного читателя, новые события копятся в ограниченной очереди
+            self.writer.write(b"".join(chunks))
+            await self.writer.drain()
+
+
+class EventBus:
+    """Рассылка событий подписчикам через Unix-сокет и SSE"""
+    def __init__(self, path=EVENTS_PATH, host=SSE_HOST, port=None):
+        self.path = Path(path)
+        self.host = host
+        self.port = sse_port() if port is None else port  # None после sse_port() - SSE выключен
+        self.loop = None
+        self.thread = None
+        self.servers = []
+        self.owns_path = False  # Сокет по path открыт нами: только тогда его удаляет stop()
+        self.subscribers = set()
+        self.seq = 0
+        self.pending = deque()  # Опубликованные, но ещё не разосланные события
+        self.flush_scheduled = False
+
+    def start(self):
+        """Открыть сокет и SSE в фоновом потоке; False, если не открылось ни то, ни другое"""
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self.serve, args=(ready,), name="events", daemon=True)
+        self.thread.start()
+        ready.wait()
+        return bool(self.servers)
+
+    def serve(self, ready):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self.open())
+        finally:
+            ready.set()
+        if self.servers:
+            self.loop.run_forever()
+
+    async def open(self):
+        if hasattr(socket, 'AF_UNIX'):
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                if self.path.is_socket():
+                    # Сокет остался от упавшего процесса - или его слушает другой запуск
+                    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    try:
+                        probe.connect(str(self.path))
+                        raise OSError("сокет слушает другой запуск программы")
+                    except ConnectionRefusedError:
+                        self.path.unlink()
+                    finally:
+                        probe.close()
+                self.servers.append(await asyncio.start_unix_server(self.handle_socket, str(self.path)))
+                self.owns_path = True
+            except OSError as e:
+                log.error('events-disabled', "Сокет событий {path} не открыт: {error}", path=str(self.path), error=str(e))
+        if self.port is None:
+            return
+        try:
+            server = await asyncio.start_server(self.handle_http, self.host, self.port)
+        except OSError as e:
+            log.error('events-disabled', "SSE на {host}:{port} не открыт: {error}",
+                      host=self.host, port=self.port, error=str(e))
+            return
+        if not self.port:
+            self.port = server.sockets[0].getsockname()[1]
+            log.info('sse-port', "SSE: http://{host}:{port}/events", host=self.host, port=self.port)
+        self.servers.append(server)
+
+    async def attach(self):
+        """Открыть сокет и SSE в уже работающем цикле asyncio (main.py --asyncio) вместо своего потока"""
+        self.loop = asyncio.get_running_loop()
+        await self.open()
+        return bool(self.servers)
+
+    def stop(self):
+        if not self.servers:
+            return
+        if self.thread is None:
+            self.close_all()  # Сокеты в общем цикле (attach): задачи подписчиков доделает сам цикл
+        else:
+            try:
+                asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result(1)
+            except (TimeoutError, asyncio.TimeoutError):
+                pass
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(1)
+        self.servers = []
+        if self.owns_path:
+            self.owns_path = False
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+
+    async def shutdown(self):
+        self.close_all()
+        await asyncio.sleep(0.05)  # Задачи подписчиков успевают завершиться
+
+    def close_all(self):
+        """Закрыть серверы и отключить подписчиков"""
+        for server in self.servers:
+            server.close()
+        for subscriber in list(self.subscribers):
+            subscriber.closed = True
+            subscriber.wakeup.set()
+            subscriber.writer.transport.abort()  # Не ждать, пока зависший читатель разберёт буфер
+
+    # --- Поток pyglet ---
+
+    def publish(self, kind, **fields):
+        """Опубликовать событие; стоит микросекунды и не зависит от подписчиков"""
+        self.seq += 1
+        if not self.subscribers:
+            return
+        self.pending.append({'type': kind, 'seq': self.seq, 'ts': round(time.time(), 3), **fields})
+        # Пачка событий за кадр будит поток asyncio один раз
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.loop.call_soon_threadsafe(self.flush)
+
+    # --- Поток asyncio ---
+
+    def flush(self):
+        self.flush_scheduled = False
+        # Только уже накопленные: иначе при частой публикации писатели не получат хода
+        for _ in range(len(self.pending)):
+            self.fanout(self.pending.popleft())
+
+    def fanout(self, event):
+        """Сериализовать событие один раз и разложить по очередям подписчиков"""
+        data = json.dumps(event, ensure_ascii=False)
+        line = (data + "\n").encode()
+        sse = f"id: {event['seq']}\nevent: {event['type']}\ndata: {data}\n\n".encode()
+        for subscriber in self.subscribers:
+            subscriber.offer(event['type'], line, sse)
+
+    async def subscribe(self, writer, sse, options):
+        subscriber = Subscriber(writer, sse, *options)
+        self.subscribers.add(subscriber)
+        try:
+            await subscriber.run()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.subscribers.discard(subscriber)
+            writer.close()
+
+    async def handle_socket(self, reader, writer):
+        try:
+            line = await asyncio.wait_for(reader.readline(), HANDSHAKE_TIMEOUT)
+            settings = json.loads(line or b"{}")
+            options = subscription_options(settings.get('types'), settings.get('policy'), settings.get('queue'))
+        except (asyncio.TimeoutError, ValueError, TypeError, AttributeError) as e:
+            # TypeError - поле не того вида: {"queue": [1]}, {"types": 5}
+            writer.write((json.dumps({'type': 'error', 'message': str(e) or "нет строки настроек"},
+                                     ensure_ascii=False) + "\n").encode())
+            writer.close()
+            return
+        await self.subscribe(writer, False, options)
+
+    async def handle_http(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HANDSHAKE_TIMEOUT)
+            method, target, _ = request.split(b"\r\n", 1)[0].decode('latin-1').split(' ', 2)
+            url = urlsplit(target)
+            if method != 'GET' or url.path != '/events':
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                writer.close()
+                return
+            query = parse_qs(url.query)
+            types = query.get('types', [''])[0].split(',') if 'types' in query else None
+            options = subscription_options(types, query.get('policy', [None])[0], query.get('queue', [None])[0])
+        except (ValueError, TypeError) as e:
+            body = str(e).encode()
+            writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Type: text/plain; charset=utf-8\r\n"
+                         b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+            writer.close()
+            return
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        writer.write(SSE_HEADERS)
+        await self.subscribe(writer, True, options)
+
+
+def subscribe_socket(path=EVENTS_PATH, **settings):
+    """Подключиться к сокету событий; вернуть файл, из которого читать строки JSON"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(str(path))
+    sock.sendall((json.dumps(settings) + "\n").encode())
+    return sock.makefile('rb')
+
+
+def count_events(path, subscribers, last_seq, results):
+    """Процесс-читатель для бенчмарка: несколько подписок, счёт событий до last_seq"""
+    import selectors
+    selector = selectors.DefaultSelector()
+    for _ in range(subscribers):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        sock.sendall(b'{"queue": 4096}\n')
+        selector.register(sock, selectors.EVENT_READ, [b"", 0, 0])  # Хвост, событий, выброшено
+    done = 0
+    deadline = time.monotonic() + 120
+    while done < subscribers and time.monotonic() < deadline:
+        for key, _ in selector.select(1):
+            state = key.data
+            data = key.fileobj.recv(1 << 16)
+            lines = (state[0] + data).split(b"\n")
+            state[0] = lines.pop()
+            for line in lines:
+                event = json.loads(line)
+                if event['type'] == 'dropped':
+                    state[2] += event['count']
+                    continue
+                state[1] += 1
+                if event['seq'] >= last_seq:
+                    done += 1
+                    selector.unregister(key.fileobj)
+                    results.put((state[1], state[2]))
+                    break
+            if not data:
+                done += 1
+                selector.unregister(key.fileobj)
+
+
+if __name__ == "__main__":
+    # Бенчмарк: 200 подписчиков в 4 процессах, 1 зависший; публикация из главного потока
+    import multiprocessing
+    import tempfile
+
+    from stats import Histogram
+
+    directory = tempfile.mkdtemp()
+    bus = EventBus(Path(directory, "events.sock"), port=0)
+    assert bus.start()
+
+    # Второй запуск: живой сокет не удаляется, занятый порт SSE не роняет программу
+    second = EventBus(bus.path, port=bus.port)
+    assert not second.start(), "второй запуск открыл сокет или порт первого"
+    second.stop()
+    assert bus.path.is_socket(), "второй запуск удалил сокет первого"
+    assert sse_port("off") is None and sse_port("0") == 0 and sse_port("порт") == DEFAULT_SSE_PORT
+
+    # Неверные настройки: клиент получает строку error, и соединение закрывается
+    for settings in ({'queue': [1]}, {'types': 5}, {'policy': "никакая"}, [1]):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        probe.settimeout(5)
+        probe.connect(str(bus.path))
+        probe.sendall((json.dumps(settings) + "\n").encode())
+        reply = probe.makefile('rb')
+        assert json.loads(reply.readline())['type'] == 'error' and reply.readline() == b"", settings
+        reply.close()
+        probe.close()
+
+    EVENTS = 20000
+    results = multiprocessing.Queue()
+    readers = [multiprocessing.Process(target=count_events, args=(str(bus.path), 50, EVENTS, results))
+               for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    stuck = subscribe_socket(bus.path, queue=64)  # Подписан, но никогда не читает
+    while len(bus.subscribers) < 201:
+        time.sleep(0.01)
+
+    publish_time = Histogram((1e-6, 2e-6, 5e-6, 10e-6, 20e-6, 50e-6, 100e-6, 1e-3, 10e-3))
+    started = time.perf_counter()
+    for i in range(EVENTS):
+        moment = time.perf_counter()
+        bus.publish('fired', id=i, label="Подъём", time="07:30")
+        publish_time.record(time.perf_counter() - moment)
+        if i % 100 == 99:
+            time.sleep(0.2)  # Пачки по 100 событий, 500 в секунду - 100 тыс. доставок в секунду
+    publish_elapsed = time.perf_counter() - started
+
+    counts = [results.get(timeout=180) for _ in range(200)]
+    delivered = time.perf_counter() - started
+    for reader in readers:
+        reader.join()
+    print(f"Опубликовано {EVENTS} событий за {publish_elapsed:.2f} с, все 200 подписчиков дочитали за "
+          f"{delivered:.2f} с ({EVENTS * 200 / delivered:.0f} доставок в секунду)")
+    print(f"Получено подписчиком: мин {min(c for c, _ in counts)}, макс {max(c for c, _ in counts)}; "
+          f"выброшено: макс {max(d for _, d in counts)}")
+    subscriber = next(s for s in bus.subscribers if s.limit == 64)
+    print(f"Зависший подписчик: в очереди {len(subscriber.queue)}, выброшено {subscriber.dropped}")
+    print("Время publish():")
+    print(publish_time.format("с"))
+    bus.stop()
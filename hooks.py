@@ -0,0 +1,292 @@
+"""Действия при срабатывании будильника: команда, запись в файл, локальный вебхук
+
+У будильника может быть поле hooks - список действий:
+    {"type": "command", "run": ["notify-send", "$label"], "timeout": 10}
+    {"type": "file", "path": "res/fired.log", "text": "$fire_time $label\\n"}
+    {"type": "webhook", "url": "http://127.0.0.1:8080/alarm", "timeout": 5}
+В строках подставляются $id, $label, $time, $fire_time, $late и $repeat
+(string.Template). Команда - список аргументов или строка (делится как в
+оболочке, но сама оболочка не запускается). Вебхук отправляет POST с JSON
+срабатывания и только на localhost: это заглушка для локальных служб, а не
+выход в сеть. timeout - секунды, по умолчанию 10; команду по истечении
+убивают, запрос вебхука обрывают.
+
+Действия выполняет HookRunner на ограниченном пуле потоков. Срабатывание
+только ставит их в очередь, причём уже после запуска звука, так что
+медленные действия звонок не задерживают. Одновременно выполняется не больше
+HOOK_LIMITS действий каждого типа, остальные ждут в очереди типа длиной
+HOOK_BACKLOG; что в неё не влезло, отбрасывается с сообщением в журнале.
+Итоги действий забирает pump() в цикле окна (или планировщика) и публикует
+событием hook-done (events.py).
+
+python hooks.py - замер: задержка от срабатывания до звука без действий и с
+медленными действиями, таймауты и отказы при переполнении очереди.
+"""
+import json
+import queue
+import shlex
+import time
+from collections import deque
+from string import Template
+from urllib.parse import urlsplit
+
+from journal import log
+
+
+HOOK_TYPES = ('command', 'file', 'webhook')
+HOOK_LIMITS = {'command': 2, 'file': 1, 'webhook': 4}  # Одновременно выполняемых действий типа
+HOOK_BACKLOG = 100  # Ожидающих действий типа; лишние отбрасываются
+DEFAULT_TIMEOUT = 10.0  # Секунд на действие
+MAX_TIMEOUT = 300.0
+LOCAL_HOSTS = {'localhost', '127.0.0.1', '::1'}
+
+
+def parse_hooks(value):
+    """Проверенный список действий из поля hooks; ValueError с понятным текстом при ошибке
+
+    value - список словарей или его JSON-строка (так действия пишутся в CSV).
+    """
+    if value is None or value == '':
+        return []
+    if isinstance(value, str):
+        value = json.loads(value)
+    if isinstance(value, dict):
+        value = [value]
+    if not isinstance(value, list):
+        raise ValueError(f"Действия - список, а не {value!r}")
+    hooks = []
+    for item in value:
+        if not isinstance(item, dict):
+            raise ValueError(f"Неверное действие: {item!r}")
+        hook_type = item.get('type')
+        if hook_type not in HOOK_TYPES:
+            raise ValueError(f"Тип действия только {', '.join(HOOK_TYPES)}: {hook_type!r}")
+        hook = {'type': hook_type}
+        if hook_type == 'command':
+            run = item.get('run')
+            if isinstance(run, str):
+                run = shlex.split(run)
+            if not run or not isinstance(run, list):
+                raise ValueError("У команды не указано run")
+            hook['run'] = [str(arg) for arg in run]
+        elif hook_type == 'file':
+            if not item.get('path'):
+                raise ValueError("У записи в файл не указано path")
+            hook['path'] = str(item['path'])
+            hook['text'] = str(item.get('text', "$fire_time $id $label\n"))
+        else:
+            url = str(item.get('url') or '')
+            parts = urlsplit(url)
+            if parts.scheme not in ('http', 'https') or parts.hostname not in LOCAL_HOSTS:
+                raise ValueError(f"Вебхук только на localhost по http: {url!r}")
+            hook['url'] = url
+        timeout = float(item.get('timeout', DEFAULT_TIMEOUT))
+        if not 0 < timeout <= MAX_TIMEOUT:
+            raise ValueError(f"Таймаут действия от 0 до {MAX_TIMEOUT:g} с")
+        if timeout != DEFAULT_TIMEOUT:
+            hook['timeout'] = timeout
+        hooks.append(hook)
+    return hooks
+
+
+def run_hook(hook, fields):
+    """Выполнить действие в рабочем потоке; (успех, текст ошибки)"""
+    import subprocess  # Как и urllib.request ниже - не грузится при разборе файлов и в cli.py
+    timeout = hook.get('timeout', DEFAULT_TIMEOUT)
+    hook_type = hook['type']
+    try:
+        if hook_type == 'command':
+            args = [Template(arg).safe_substitute(fields) for arg in hook['run']]
+            result = subprocess.run(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.PIPE, timeout=timeout)
+            if result.returncode:
+                error = result.stderr.decode(errors='replace').strip().splitlines()
+                return False, f"код {result.returncode}" + (f": {error[-1]}" if error else "")
+        elif hook_type == 'file':
+            # Запись в файл не прервать, поэтому таймаут для неё не действует
+            with open(Template(hook['path']).safe_substitute(fields), 'a', encoding='utf-8') as f:
+                f.write(Template(hook['text']).safe_substitute(fields))
+        else:
+            import urllib.request
+            request = urllib.request.Request(
+                hook['url'], data=json.dumps(fields, ensure_ascii=False).encode('utf-8'),
+                headers={'Content-Type': 'application/json'}, method='POST')
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+    except subprocess.TimeoutExpired:
+        return False, f"не уложилось в {timeout:g} с"
+    except Exception as e:
+        return False, str(e) or type(e).__name__
+    return True, None
+
+
+class HookRunner:
+    """Очереди действий по типам и пул потоков, который их выполняет
+
+    submit() и pump() вызываются из одного потока (окна или планировщика);
+    рабочие потоки только выполняют действие и кладут итог в done.
+    """
+    def __init__(self, events=None, limits=None, backlog=HOOK_BACKLOG):
+        self.events = events  # EventBus для событий hook-done
+        self.limits = dict(limits or HOOK_LIMITS)
+        self.backlog = backlog
+        self.executor = None  # Пул создаётся при первом действии
+        self.active = dict.fromkeys(HOOK_TYPES, 0)  # Выполняются сейчас
+        self.waiting = {hook_type: deque() for hook_type in HOOK_TYPES}  # (действие, поля)
+        self.done = queue.SimpleQueue()  # Итоги из рабочих потоков
+        self.in_flight = 0  # Выполняются и ждут - пока 0, pump() ничего не делает
+        self.finished = 0
+        self.failed = 0
+        self.dropped = 0
+        self.unreported = {}  # Отброшенные с прошлого pump(): тип -> сколько
+
+    def submit(self, hooks, fields):
+        """Поставить действия будильника в очередь; не ждёт ни одного из них"""
+        for hook in hooks:
+            hook_type = hook['type']
+            if self.active[hook_type] < self.limits[hook_type]:
+                self.start(hook, fields)
+            elif len(self.waiting[hook_type]) < self.backlog:
+                self.waiting[hook_type].append((hook, fields))
+                self.in_flight += 1
+            else:
+                self.dropped += 1
+                self.unreported[hook_type] = self.unreported.get(hook_type, 0) + 1
+
+    def start(self, hook, fields):
+        if self.executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            # Потоков столько, сколько всего можно выполнять одновременно: пул сам ничего не копит
+            self.executor = ThreadPoolExecutor(max_workers=sum(self.limits.values()),
+                                               thread_name_prefix='hook')
+        self.active[hook['type']] += 1
+        self.in_flight += 1
+        self.executor.submit(self.work, hook, fields)
+
+    def work(self, hook, fields):
+        started = time.monotonic()
+        ok, error = run_hook(hook, fields)
+        self.done.put((hook, fields, ok, error, time.monotonic() - started))
+
+    def pump(self, dt=None):
+        """Забрать итоги действий и запустить ждущие; вызывается из цикла окна"""
+        if not self.in_flight:
+            return
+        if self.unreported:
+            # Одно сообщение на тип, а не на каждое действие: при переполнении их тысячи
+            for hook_type, count in self.unreported.items():
+                log.warning('hooks-dropped', "Очередь действий {hook} переполнена, пропущено действий: {count}",
+                            hook=hook_type, count=count)
+            self.unreported.clear()
+        while True:
+            try:
+                hook, fields, ok, error, seconds = self.done.get_nowait()
+            except queue.Empty:
+                break
+            hook_type = hook['type']
+            self.active[hook_type] -= 1
+            self.in_flight -= 1
+            self.finished += 1
+            if not ok:
+                self.failed += 1
+                log.warning('hook-failed', "Действие {hook} будильника {alarm_id}: {error}",
+                            alarm_id=fields['id'], hook=hook_type, error=error, seconds=round(seconds, 3))
+            if self.events is not None:
+                self.events.publish('hook-done', id=fields['id'], hook=hook_type, ok=ok,
+                                    seconds=round(seconds, 3), error=error)
+            waiting = self.waiting[hook_type]
+            if waiting:
+                self.in_flight -= 1  # start() снова посчитает его
+                self.start(*waiting.popleft())
+
+    def stop(self):
+        """Отбросить ждущие действия; начатые доработают не дольше своих таймаутов"""
+        for waiting in self.waiting.values():
+            self.in_flight -= len(waiting)
+            waiting.clear()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+if __name__ == "__main__":
+    # Замер: 100 будильников срабатывают разом, у каждого медленные команда, вебхук и запись в файл
+    import os
+    import tempfile
+    import threading
+    from datetime import datetime
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from scheduler import Scheduler
+
+    ALARMS = 100
+    ROUNDS = 20
+
+    class SlowHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            time.sleep(2)  # Дольше таймаута вебхука
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log_file = tempfile.NamedTemporaryFile(suffix='.log', delete=False)
+    log_file.close()
+
+    class Bench(Scheduler):
+        """Звук не играет: замеряется момент, когда его начали бы запускать"""
+        def start_ring(self, due):
+            self.sound_at = time.perf_counter()
+
+    def measure(with_hooks):
+        bench = Bench()
+        bench.hooks.backlog = 20
+        hooks = parse_hooks([{'type': 'command', 'run': ['sleep', '5'], 'timeout': 0.5},
+                 {'type': 'webhook', 'url': f"http://127.0.0.1:{server.server_port}/", 'timeout': 0.5},
+                 {'type': 'file', 'path': log_file.name}]) if with_hooks else []
+        bench.alarms.add_many([{'type': 'weekly', 'time': '07:00', 'weekdays': list(range(7)),
+                                'label': f"будильник {i}", 'enabled': True, 'hooks': hooks}
+                               for i in range(ALARMS)])
+        now = datetime.now()
+        due = [(alarm['id'], False, 0, now) for alarm in bench.alarms]
+        latencies = []
+        for _ in range(ROUNDS):
+            bench.ringing.clear()
+            started = time.perf_counter()
+            bench.trigger_alarms(due, now)
+            latencies.append((bench.sound_at - started) * 1000)
+            submitted = (time.perf_counter() - bench.sound_at) * 1000
+            bench.hooks.pump()
+            time.sleep(0.05)  # Срабатывания не идут подряд; начатые действия в это время ждут команду и ответ
+        started = time.perf_counter()
+        while bench.hooks.in_flight:
+            bench.hooks.pump()
+            time.sleep(0.01)
+        drained = time.perf_counter() - started
+        runner = bench.hooks
+        runner.stop()
+        latencies.sort()
+        print(f"{'с действиями' if with_hooks else 'без действий':<13} до звука: p50 "
+              f"{latencies[len(latencies) // 2]:.2f} мс, макс {latencies[-1]:.2f} мс; "
+              f"постановка в очередь после звука {submitted:.2f} мс; выполнено {runner.finished}, "
+              f"с ошибкой {runner.failed}, отброшено {runner.dropped}, очереди разобраны за {drained:.1f} с")
+        return latencies[-1]
+
+    import contextlib
+    import io
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        baseline = measure(False)
+        loaded = measure(True)
+        log.flush()  # Сообщения об отказах выводит поток журнала - дожидаемся их здесь
+    lines = output.getvalue().splitlines()
+    print("\n".join(line for line in lines if line.startswith(('с действиями', 'без действий'))))
+    print(f"Сообщений о таймаутах и отказах в консоли: "
+          f"{sum('не уложилось' in line or 'timed out' in line for line in lines)} / "
+          f"{sum('переполнена' in line for line in lines)}")
+    os.unlink(log_file.name)
+    server.shutdown()
@@ -0,0 +1,309 @@
+"""Журнал программы: записи JSON из фонового потока вместо print()
+
+    from journal import log
+    log.info('fired', "СРАБОТАЛО БУДИЛЬНИКОВ: {count}", alarm_ids=[3, 5], count=2)
+
+Вызов только кладёт кортеж в deque - без блокировок, форматирования и
+системных вызовов, так что медленная консоль (канал, journald) не задерживает
+срабатывание. Шаблон сообщения подставляется полями уже в потоке журнала:
+раз в FLUSH_INTERVAL он выводит тексты сообщений в консоль, как раньше
+print(), и, если открыт файл (open_file), дописывает туда по строке JSON:
+    {"ts": "2026-10-19T07:30:00.012+03:00", "seq": 17, "pid": 1234, "level": "info",
+     "event": "fired", "msg": "СРАБОТАЛО БУДИЛЬНИКОВ: 2", "alarm_ids": [3, 5], "count": 2}
+Файл ротируется по размеру: wakeup.log -> wakeup.log.1 -> ... -> wakeup.log.LOG_BACKUPS.
+Если поток журнала не успевает, очередь (LOG_BACKLOG записей) вытесняет
+старые записи, а в журнал попадает log-dropped с их числом.
+
+python journal.py - замер: цена вызова против print() в медленную консоль,
+ротация и учёт вытесненных записей.
+"""
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import date, datetime
+from itertools import count
+from pathlib import Path
+
+
+LOG_PATH = Path("res") / "logs" / "wakeup.log"
+LOG_MAX_BYTES = 5 * 1024 * 1024  # Размер файла, после которого он уходит в .1
+LOG_BACKUPS = 3  # Сколько старых файлов хранится
+LOG_BACKLOG = 100000  # Записей в очереди, пока поток журнала их не разобрал
+FLUSH_INTERVAL = 0.1  # Как часто поток журнала разбирает очередь, с
+
+
+def json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def format_message(message, fields):
+    """Текст сообщения: шаблон str.format с полями записи"""
+    if not fields:
+        return message
+    try:
+        return message.format(**fields)
+    except (KeyError, IndexError, ValueError):
+        return f"{message} {fields!r}"
+
+
+class Journal:
+    """Очередь записей и поток, который пишет их в консоль и файл"""
+    def __init__(self, backlog=LOG_BACKLOG, echo=True):
+        self.records = deque(maxlen=backlog)
+        self.counter = count(1)  # next() атомарен: номера не повторяются и из разных потоков
+        self.echo = echo  # Выводить ли тексты сообщений в консоль
+        self.path = None
+        self.max_bytes = LOG_MAX_BYTES
+        self.backups = LOG_BACKUPS
+        self.file = None  # Открывается и пишется только потоком журнала
+        self.size = 0
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.waiters = deque()  # threading.Event тех, кто ждёт flush()
+        self.stopping = False
+        self.registered = False
+        # Вытесненные записи считаются при добавлении: номера из разных потоков приходят
+        # в очередь не по порядку, и по пропускам в номерах их не сосчитать
+        self.drop_lock = threading.Lock()
+        self.dropped = 0  # Вытеснено из очереди
+        self.reported = 0  # Из них уже сообщено в log-dropped
+
+    def log(self, level, event, message, fields):
+        records = self.records
+        if len(records) == records.maxlen:
+            # Очередь полна: append вытеснит самую старую запись. Блокировка - только здесь,
+            # пока поток журнала не успевает, чтобы счёт из разных потоков не терялся
+            with self.drop_lock:
+                self.dropped += 1
+        records.append((next(self.counter), time.time(), level, event, message, fields))
+        if self.thread is None:
+            self.start()
+
+    def debug(self, event, message="", **fields):
+        self.log('debug', event, message, fields)
+
+    def info(self, event, message="", **fields):
+        self.log('info', event, message, fields)
+
+    def warning(self, event, message="", **fields):
+        self.log('warning', event, message, fields)
+
+    def error(self, event, message="", **fields):
+        self.log('error', event, message, fields)
+
+    def open_file(self, path=LOG_PATH, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+        """Писать записи JSON в файл; сам файл откроет поток журнала"""
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+    def start(self):
+        with self.start_lock:
+            if self.thread is not None:
+                return
+            self.stopping = False
+            self.thread = threading.Thread(target=self.run, name="journal", daemon=True)
+            self.thread.start()
+            if not self.registered:
+                atexit.register(self.close)  # Что осталось в очереди, пишется при выходе
+                self.registered = True
+
+    def flush(self, timeout=2.0):
+        """Дождаться, пока всё, что в очереди сейчас, будет записано"""
+        if self.thread is None:
+            return
+        done = threading.Event()
+        self.waiters.append(done)
+        self.wake.set()
+        done.wait(timeout)
+
+    def close(self):
+        """Записать очередь и остановить поток; следующая запись запустит его снова"""
+        thread = self.thread
+        if thread is None:
+            return
+        self.stopping = True
+        self.wake.set()
+        thread.join(2.0)
+        self.thread = None
+
+    # --- Поток журнала ---
+
+    def run(self):
+        while True:
+            self.wake.wait(FLUSH_INTERVAL)
+            self.wake.clear()
+            stopping = self.stopping
+            self.drain()
+            while self.waiters:
+                self.waiters.popleft().set()
+            if stopping:
+                break
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def drain(self):
+        records = self.records
+        texts = []
+        lines = []
+        while True:
+            try:
+                seq, moment, level, event, message, fields = records.popleft()
+            except IndexError:
+                break
+            text = format_message(message, fields)
+            texts.append(text)
+            if self.path is not None:
+                record = {'ts': datetime.fromtimestamp(moment).astimezone().isoformat(timespec='milliseconds'),
+                          'seq': seq, 'pid': os.getpid(), 'level': level, 'event': event, 'msg': text}
+                record.update(fields)
+                lines.append(json.dumps(record, ensure_ascii=False, default=json_default))
+        dropped = self.dropped - self.reported
+        if dropped:
+            text = f"Журнал не успевал: пропущено записей {dropped}"
+            texts.append(text)
+            if self.path is not None:
+                lines.append(json.dumps({'ts': datetime.now().astimezone().isoformat(timespec='milliseconds'),
+                                         'seq': None, 'pid': os.getpid(), 'level': 'warning',
+                                         'event': 'log-dropped', 'msg': text, 'count': dropped},
+                                        ensure_ascii=False))
+            self.reported += dropped
+        if texts and self.echo:
+            try:
+                sys.stdout.write("\n".join(texts) + "\n")
+                sys.stdout.flush()
+            except (OSError, ValueError):
+                pass  # Консоль закрыта - в файл всё равно пишем
+        if lines:
+            self.write_file(lines)
+
+    def write_file(self, lines):
+        try:
+            if self.file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self.file = open(self.path, 'ab')
+                self.size = self.file.tell()
+            chunk = []
+            for line in lines:
+                data = (line + "\n").encode('utf-8')
+                if self.size and self.size + len(data) > self.max_bytes:
+                    self.file.write(b"".join(chunk))
+                    chunk = []
+                    self.rotate()
+                chunk.append(data)
+                self.size += len(data)
+            self.file.write(b"".join(chunk))
+            self.file.flush()
+        except OSError as e:
+            if self.echo:
+                sys.stderr.write(f"Не удалось записать журнал {self.path}: {e}\n")
+
+    def rotate(self):
+        """wakeup.log -> wakeup.log.1, .1 -> .2, ...; самый старый удаляется"""
+        self.file.close()
+        self.file = None
+        for index in range(self.backups - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{index}")
+            if older.exists():
+                os.replace(older, self.path.with_name(f"{self.path.name}.{index + 1}"))
+        if self.backups:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        self.file = open(self.path, 'wb')
+        self.size = 0
+
+
+# Один журнал на процесс
+log = Journal()
+
+
+if __name__ == "__main__":
+    # Замер: запись о срабатывании через print() и через журнал, когда консоль медленная
+    import io
+    import statistics
+    import tempfile
+
+    CALLS = 300
+    CONSOLE_DELAY = 0.002  # Столько ждёт запись в консоль: канал, который не успевают читать
+
+    class SlowConsole(io.TextIOBase):
+        def write(self, text):
+            time.sleep(CONSOLE_DELAY)
+            return len(text)
+
+    def measure(title, call):
+        times = []
+        for index in range(CALLS):
+            started = time.perf_counter()
+            call(index)
+            times.append((time.perf_counter() - started) * 1e6)
+            time.sleep(0.0005)
+        times.sort()
+        print(f"{title:<8} p50 {statistics.median(times):8.1f} мкс, p99 {times[int(CALLS * 0.99)]:8.1f} мкс, "
+              f"макс {times[-1]:8.1f} мкс", file=sys.__stdout__)
+        return statistics.median(times)
+
+    directory = Path(tempfile.mkdtemp())
+    log.open_file(directory / "bench.log")
+    console = sys.stdout
+    sys.stdout = SlowConsole()
+    printed = measure("print()", lambda index: print(f"СРАБОТАЛО БУДИЛЬНИКОВ: 1, звонят: {index}"))
+    logged = measure("журнал", lambda index: log.info('fired', "СРАБОТАЛО БУДИЛЬНИКОВ: {count}, звонят: {ringing}",
+                                                      alarm_ids=[index], count=1, ringing=index))
+    log.flush(10)
+    sys.stdout = console
+
+    # Ротация: файлы не больше предела, ни одна запись не потерялась и не повторилась
+    rotating = Journal(echo=False)
+    rotating.open_file(directory / "rotate.log", max_bytes=64 * 1024, backups=50)
+    for index in range(5000):
+        rotating.info('tick', "запись {index}", alarm_id=index, index=index)
+    rotating.close()
+    files = sorted(directory.glob("rotate.log*"))
+    seqs = [json.loads(line)['seq'] for path in files for line in path.read_text(encoding='utf-8').splitlines()]
+    largest = max(path.stat().st_size for path in files)
+
+    # Вытеснение: поток журнала стоит, очередь на 100 записей, пишем 1000
+    dropping = Journal(backlog=100, echo=False)
+    dropping.open_file(directory / "drop.log")
+    dropping.start = lambda: None  # Поток не запускается - записи копятся
+    for index in range(1000):
+        dropping.info('tick', "запись {index}", index=index)
+    del dropping.start
+    dropping.start()
+    dropping.close()
+    records = [json.loads(line) for line in (directory / "drop.log").read_text(encoding='utf-8').splitlines()]
+    dropped = [record['count'] for record in records if record['event'] == 'log-dropped']
+
+    # Номера не по порядку - не пропуск: поток взял номер 1, а положил запись после того,
+    # как запись с номером 2 из другого потока уже разобрана
+    unordered = Journal(echo=False)
+    unordered.open_file(directory / "unordered.log")
+    unordered.start = lambda: None  # Очередь разбирается вручную
+    late = next(unordered.counter)
+    unordered.info('tick', "вторая")
+    unordered.drain()
+    unordered.records.append((late, time.time(), 'info', 'tick', "первая", {}))
+    unordered.drain()
+    unordered.info('tick', "третья")
+    unordered.drain()
+    unordered.file.close()
+    false_drops = [line for line in (directory / "unordered.log").read_text(encoding='utf-8').splitlines()
+                   if json.loads(line)['event'] == 'log-dropped']
+
+    print(f"Вызов при консоли с задержкой {CONSOLE_DELAY * 1000:.0f} мс: print() {printed:.0f} мкс, "
+          f"журнал {logged:.1f} мкс")
+    print(f"Ротация: {len(files)} файлов по <= {largest} байт (предел 65536), записей {len(seqs)}, "
+          f"все номера по разу: {sorted(seqs) == list(range(1, 5001))}")
+    print(f"Вытеснение: записано {len(records) - len(dropped)}, log-dropped сообщил о {sum(dropped)}; "
+          f"при номерах не по порядку - {len(false_drops)} ложных")
+    ok = (logged * 10 < printed and sorted(seqs) == list(range(1, 5001)) and largest <= 65536
+          and dropped == [900] and len(records) == 101 and not false_drops)
+    sys.exit(0 if ok else 1)
@@ -1,9 +1,40 @@
+from startup import timeline  # Первым: от этого импорта отсчитывается запуск
+import asyncio
+import gc
 import pyglet
 from datetime import datetime, timedelta
 from pyglet import shapes
 import os
+import sys
+import time
+from itertools import islice
 from pathlib import Path
 
+from alarm_store import parse_query
+from recurrence import describe_rule
+from control import ControlServer
+from alarm_io import FORMATS, alarm_to_json, export_alarms, import_alarms, write_store
+from allocs import AllocationMeter
+from perf import PerfMonitor
+from scheduler import Scheduler, SchedulerLink
+from shared_store import SHARED_PATH
+from journal import LOG_PATH, log
+from tracing import TRACE_PATH, Tracer
+
+
+def set_label(label, text, color=None):
+    """Сменить текст/цвет метки, только если они изменились (без лишней вёрстки)"""
+    if label.text != text:
+        label.text = text
+    if color is not None and tuple(label.color) != color:
+        label.color = color
+
+
+def set_sprite_color(sprite, color):
+    """Сменить цвет спрайта (RGB), только если он изменился"""
+    if tuple(sprite.color[:3]) != color:
+        sprite.color = color
+
 
 class Button:
     """Класс кнопки"""
@@ -35,12 +66,150 @@ class Button:
         self.rectangle.draw()
         self.label.draw()
 
+    def set_style(self, color, text):
+        """Сменить цвет и текст (для переиспользуемых кнопок)"""
+        if color != self.color:
+            self.color = color
+            self.rectangle.color = color
+        if text != self.text:
+            self.text = text
+            self.label.text = text
+
     def is_clicked(self, x, y):
         """Проверка, был ли клик по кнопке"""
         return (self.x <= x <= self.x + self.width and
                 self.y <= y <= self.y + self.height)
 
 
+class FontCache:
+    """Общий для всех окон кэш шрифтов с прогревом глифов при старте"""
+    # Символы, которые встречаются в надписях интерфейса
+    CHARSET = ("АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ"
+               "абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+               "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+               "0123456789 :.,-_+*!?()/'↑↓")
+    # Размеры шрифта, которые используют окна (22 - заголовок расписания, 11 - панель F3 из perf.py)
+    SIZES = (48, 24, 20, 36, 18, 16, 14, 12, 10, 28, 22, 11)
+    # Сколько символов растеризуется за один шаг прогрева
+    CHUNK = 16
+
+    def __init__(self, font_name):
+        self.font_name = font_name
+        self.fonts = {}  # Размер -> загруженный шрифт
+        self.pending = []  # Очередь шагов прогрева: (размер, символы)
+        self.warmup_time = 0.0
+
+    def get(self, font_size):
+        """Шрифт нужного размера (ищется в системе только один раз)"""
+        font = self.fonts.get(font_size)
+        if font is None:
+            font = pyglet.font.load(self.font_name, font_size)
+            self.fonts[font_size] = font
+        return font
+
+    def get_glyphs(self, text, font_size):
+        """Глифы для строки, растеризуются при первом обращении"""
+        glyphs = self.get(font_size).get_glyphs(text)
+        if isinstance(glyphs, tuple):  # pyglet 2.1 возвращает (глифы, позиции)
+            glyphs = glyphs[0]
+        return glyphs
+
+    def warm_up(self, sizes=SIZES):
+        """Запуск прогрева небольшими шагами в простое цикла событий"""
+        self.pending = [(size, self.CHARSET[i:i + self.CHUNK])
+                        for size in sizes
+                        for i in range(0, len(self.CHARSET), self.CHUNK)]
+        self.pending.reverse()  # Берём с конца - pop() без сдвига списка
+        self.warmup_time = 0.0
+        pyglet.clock.schedule_once(self.warm_up_step, 0)
+
+    def warm_up_step(self, dt):
+        """Растеризация очередной порции символов"""
+        if not self.pending:
+            return
+        start = time.perf_counter()
+        font_size, chars = self.pending.pop()
+        self.get_glyphs(chars, font_size)
+        self.warmup_time += time.perf_counter() - start
+
+        if self.pending:
+            pyglet.clock.schedule_once(self.warm_up_step, 0)
+        else:
+            log.info('fonts-warmed', "Прогрев шрифтов: {sizes} размеров за {ms:.1f} мс",
+                     sizes=len(self.fonts), ms=self.warmup_time * 1000)
+
+
+# Один кэш на все окна: текстуры глифов общие для контекстов pyglet
+font_cache = FontCache("Arial")
+
+
+class GlyphStrip:
+    """Заранее растеризованные глифы цифр и разделителей одного шрифта"""
+    def __init__(self, font_size, chars="0123456789:."):
+        font = font_cache.get(font_size)
+        self.glyphs = dict(zip(chars, font_cache.get_glyphs(chars, font_size)))
+        self.ascent = font.ascent
+        self.descent = font.descent
+        # Ширина ячейки одинакова для всех цифр - раскладка не "прыгает"
+        self.cell_width = max(self.glyphs[d].advance for d in "0123456789")
+
+
+class DigitClock:
+    """Строка цифр фиксированной ширины из спрайтов глифов (без вёрстки текста)"""
+    def __init__(self, strip, pattern, x, y, color, batch):
+        self.strip = strip
+        self.digit_glyphs = [strip.glyphs[str(d)] for d in range(10)]
+        self.slots = []  # (спрайт, левый край ячейки) для каждой цифры
+        self.values = []  # Показанные сейчас цифры
+
+        # Ширина всей строки для центрирования по x
+        total_width = 0
+        for char in pattern:
+            if char.isdigit():
+                total_width += strip.cell_width
+            else:
+                total_width += strip.glyphs[char].advance
+
+        # Базовая линия так же, как у Label с anchor_y="center"
+        baseline = y - (strip.ascent + strip.descent) // 2
+        self.baseline = baseline
+        cell_x = x - total_width // 2
+        self.separators = []
+
+        for char in pattern:
+            if char.isdigit():
+                glyph = self.digit_glyphs[int(char)]
+                sprite = pyglet.sprite.Sprite(glyph, batch=batch)
+                sprite.color = color
+                self.slots.append((sprite, cell_x))
+                self.values.append(None)
+                cell_x += strip.cell_width
+            else:
+                glyph = strip.glyphs[char]
+                sprite = pyglet.sprite.Sprite(
+                    glyph, x=cell_x + glyph.vertices[0],
+                    y=baseline + glyph.vertices[1], batch=batch
+                )
+                sprite.color = color
+                self.separators.append(sprite)
+                cell_x += glyph.advance
+
+        self.set_digits([int(char) for char in pattern if char.isdigit()])
+
+    def set_digits(self, digits):
+        """Обновить только изменившиеся цифры"""
+        for i, digit in enumerate(digits):
+            if self.values[i] == digit:
+                continue
+            self.values[i] = digit
+            sprite, cell_x = self.slots[i]
+            glyph = self.digit_glyphs[digit]
+            sprite.image = glyph
+            # Глиф центрируется внутри ячейки фиксированной ширины
+            sprite.position = (cell_x + (self.strip.cell_width - glyph.advance) // 2 + glyph.vertices[0],
+                               self.baseline + glyph.vertices[1], 0)
+
+
 class BaseWindow(pyglet.window.Window):
     """Базовый класс для всех окон"""
     def __init__(self, alarm_app, width, height, title):
@@ -61,7 +230,8 @@ class BaseWindow(pyglet.window.Window):
         pass
 
     def on_key_press(self, symbol, modifiers):
-        pass
+        if symbol == pyglet.window.key.F3:
+            self.app.perf.toggle_overlay()
 
     def on_close(self):
         self.close()
@@ -74,12 +244,26 @@ class BaseWindow(pyglet.window.Window):
 
 class MainWindow(BaseWindow):
     """Главное окно приложения"""
-    def __init__(self, alarm_app):
+    def __init__(self, alarm_app, lazy=False):
         super().__init__(alarm_app, width=800, height=600, title="Будильник")
+        timeline.mark("окно")
         self.background_image = None
         self.child_windows = []
-        self.load_background()
+        # При ленивом запуске первый кадр - только часы и кнопки, остальное - finish_setup после него
+        self.ready = False
         self.setup_ui()
+        timeline.mark("интерфейс")
+        if not lazy:
+            self.finish_setup()
+
+    def finish_setup(self):
+        """Фон и второстепенные надписи"""
+        self.load_background()
+        timeline.mark("фон")
+        self.setup_labels()
+        timeline.mark("надписи")
+        self.ready = True
+        self.update_next_alarm_info()
 
     def load_background(self):
         """Загрузка фона"""
@@ -99,7 +283,7 @@ class MainWindow(BaseWindow):
         # Кнопка установки будильника
         self.btn_set_alarm = self.create_button(
             x=center_x,
-            y=start_y + 20,
+            y=start_y + 30,
             color=(50, 180, 50),
             text="Установить будильник",
             font_size=18
@@ -108,7 +292,7 @@ class MainWindow(BaseWindow):
         # Кнопка настроек
         self.btn_settings = self.create_button(
             x=center_x,
-            y=start_y - 40,
+            y=start_y - 25,
             color=(50, 100, 200),
             text="Настройки",
             font_size=18
@@ -117,7 +301,7 @@ class MainWindow(BaseWindow):
         # Кнопка остановки будильника
         self.btn_stop = self.create_button(
             x=center_x,
-            y=start_y - 100,
+            y=start_y - 80,
             color=(200, 50, 50),
             text="Остановить",
             font_size=18
@@ -126,27 +310,40 @@ class MainWindow(BaseWindow):
         # Кнопка списка будильников
         self.btn_list = self.create_button(
             x=center_x,
-            y=start_y - 160,
+            y=start_y - 135,
             color=(180, 100, 50),
             text="Список будильников",
             font_size=18
         )
 
-        # Текстовые метки
-        self.time_label = pyglet.text.Label(
-            "", font_name="Arial", font_size=48,
+        # Кнопка расписания срабатываний
+        self.btn_agenda = self.create_button(
+            x=center_x,
+            y=start_y - 190,
+            color=(120, 80, 160),
+            text="Расписание",
+            font_size=18
+        )
+
+        # Запасной фон, если res/bg.jpg нет
+        self.background = shapes.Rectangle(0, 0, self.width, self.height, color=(40, 60, 100))
+
+        # Часы и дата из готовых глифов: каждую секунду меняются только спрайты цифр
+        self.clock_batch = pyglet.graphics.Batch()
+        self.time_clock = DigitClock(
+            GlyphStrip(48), "00:00:00",
             x=self.width//2, y=self.height*0.7,
-            anchor_x="center", anchor_y="center",
-            color=(255, 255, 255, 255)
+            color=(255, 255, 255), batch=self.clock_batch
         )
 
-        self.date_label = pyglet.text.Label(
-            "", font_name="Arial", font_size=24,
+        self.date_clock = DigitClock(
+            GlyphStrip(24), "00.00.0000",
             x=self.width//2, y=self.height*0.63,
-            anchor_x="center", anchor_y="center",
-            color=(220, 220, 220, 255)
+            color=(220, 220, 220), batch=self.clock_batch
         )
 
+    def setup_labels(self):
+        """Надпись о ближайшем будильнике и заголовок"""
         self.next_alarm_label = pyglet.text.Label(
             "Нет активных будильников",
             font_name="Arial", font_size=20,
@@ -162,97 +359,64 @@ class MainWindow(BaseWindow):
             color=(255, 255, 255, 255)
         )
 
+        # Строки списка будильников создаются один раз, кадр только рисует их
+        self.alarm_labels = [pyglet.text.Label(
+            "", font_name="Arial", font_size=24,
+            x=20, y=30 + i * 34,
+            anchor_x="left", anchor_y="center",
+            color=(200, 200, 255, 255)
+        ) for i in range(5)]
+        self.alarms_version = None
+
     def update_time(self):
         """Обновление времени"""
         now = datetime.now()
-        self.time_label.text = now.strftime("%H:%M:%S")
-        self.date_label.text = now.strftime("%d.%m.%Y")
+        self.time_clock.set_digits((
+            now.hour // 10, now.hour % 10,
+            now.minute // 10, now.minute % 10,
+            now.second // 10, now.second % 10
+        ))
+        year = now.year
+        self.date_clock.set_digits((
+            now.day // 10, now.day % 10,
+            now.month // 10, now.month % 10,
+            year // 1000, year // 100 % 10, year // 10 % 10, year % 10
+        ))
         self.update_next_alarm_info()
 
     def update_next_alarm_info(self):
         """Обновление информации о ближайшем будильнике"""
-        if not self.app.alarms:
-            self.next_alarm_label.text = "Нет активных будильников"
+        if not self.ready:
+            return
+        next_alarm, next_time = self.app.alarms.next_enabled()
+        if next_alarm is None:
+            set_label(self.next_alarm_label, "Нет активных будильников")
             return
 
-        now = datetime.now()
-        next_alarm = None
-        min_diff = None
-
-        for alarm in self.app.alarms:
-            if not alarm['enabled']:
-                continue
-
-            if alarm['type'] == 'date':
-                alarm_datetime = datetime.strptime(
-                    f"{alarm['date']} {alarm['time']}",
-                    "%Y-%m-%d %H:%M"
-                )
-                if alarm_datetime < now:
-                    continue
+        min_diff = next_time - datetime.now()
+        days = min_diff.days
+        hours = min_diff.seconds // 3600
+        minutes = (min_diff.seconds % 3600) // 60
 
-                diff = alarm_datetime - now
-                if min_diff is None or diff < min_diff:
-                    min_diff = diff
-                    next_alarm = alarm
-
-            elif alarm['type'] == 'weekly':
-                # Создаем время будильника
-                alarm_time = datetime.strptime(alarm['time'], "%H:%M").time()
-                current_weekday = now.weekday()
-
-                # Ищем ближайший выбранный день недели
-                min_days_diff = float('inf')
-
-                for weekday in alarm['weekdays']:
-                    days_ahead = (weekday - current_weekday) % 7
-                    if days_ahead == 0:  # Сегодня
-                        # Проверяем, не прошло ли уже время сегодня
-                        alarm_datetime_today = datetime.combine(now.date(), alarm_time)
-                        if alarm_datetime_today >= now:
-                            days_ahead = 0
-                        else:
-                            days_ahead = 7
-
-                    if days_ahead < min_days_diff:
-                        min_days_diff = days_ahead
-
-                # Вычисляем дату ближайшего срабатывания
-                next_date = now.date() + timedelta(days=min_days_diff)
-                alarm_datetime = datetime.combine(next_date, alarm_time)
-                diff = alarm_datetime - now
-
-                if diff.total_seconds() > 0:  # Только будущие будильники
-                    if min_diff is None or diff < min_diff:
-                        min_diff = diff
-                        next_alarm = alarm
-
-        if next_alarm and min_diff:
-            days = min_diff.days
-            hours = min_diff.seconds // 3600
-            minutes = (min_diff.seconds % 3600) // 60
-
-            if days > 0:
-                self.next_alarm_label.text = f"Следующий через: {days}д {hours:02d}:{minutes:02d}"
-            else:
-                self.next_alarm_label.text = f"Следующий через: {hours:02d}:{minutes:02d}"
+        if days > 0:
+            set_label(self.next_alarm_label, f"Следующий через: {days}д {hours:02d}:{minutes:02d}")
         else:
-            self.next_alarm_label.text = "Нет активных будильников"
+            set_label(self.next_alarm_label, f"Следующий через: {hours:02d}:{minutes:02d}")
 
-    def draw_alarms_list(self):
-        """Список будильников"""
-        if not self.app.alarms:
+    def sync_alarm_labels(self):
+        """Тексты строк списка, если будильники изменились с прошлого кадра"""
+        alarms = self.app.alarms
+        if alarms.version == self.alarms_version:
             return
+        self.alarms_version = alarms.version
 
-        start_x = 20
-        start_y = 30
-
-        for i, alarm in enumerate(self.app.alarms[:5]):
-            y_pos = start_y + i * 34
-
+        shown = list(islice(alarms, len(self.alarm_labels)))
+        for label, alarm in zip(self.alarm_labels, shown):
             if alarm['type'] == 'date':
                 day_month = f"{alarm['date'][8:10]}.{alarm['date'][5:7]}"
                 alarm_info = f"{day_month} {alarm['time']}"
+            elif alarm['type'] == 'rule':
+                alarm_info = f"{describe_rule(alarm['rule'])} {alarm['time']}"
             else:
                 weekdays_ru = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
                 if alarm['weekdays']:
@@ -262,14 +426,14 @@ class MainWindow(BaseWindow):
                     alarm_info = f"- {alarm['time']}"
 
             status = "Вкл" if alarm['enabled'] else "Выкл"
+            set_label(label, f"{alarm_info} {status}")
+        self.shown_alarms = len(shown)
 
-            pyglet.text.Label(
-                f"{alarm_info} {status}",
-                font_name="Arial", font_size=24,
-                x=start_x, y=y_pos,
-                anchor_x="left", anchor_y="center",
-                color=(200, 200, 255, 255)
-            ).draw()
+    def draw_alarms_list(self):
+        """Список будильников"""
+        self.sync_alarm_labels()
+        for label in islice(self.alarm_labels, self.shown_alarms):
+            label.draw()
 
     def on_draw(self):
         """Отрисовка главного окна"""
@@ -279,15 +443,14 @@ class MainWindow(BaseWindow):
         if self.background_image:
             self.background_image.blit(0, 0)
         else:
-            shapes.Rectangle(0, 0, self.width, self.height,
-                             color=(40, 60, 100)).draw()
+            self.background.draw()
 
         # Заголовок и текст
-        self.title_label.draw()
-        self.time_label.draw()
-        self.date_label.draw()
-        self.next_alarm_label.draw()
-        self.draw_alarms_list()
+        self.clock_batch.draw()
+        if self.ready:
+            self.title_label.draw()
+            self.next_alarm_label.draw()
+            self.draw_alarms_list()
 
         # Кнопки
         for button in self.buttons:
@@ -314,6 +477,9 @@ class MainWindow(BaseWindow):
         elif button == self.btn_list:
             pyglet.clock.schedule_once(lambda dt: self.open_list_window(), 0.1)
 
+        elif button == self.btn_agenda:
+            pyglet.clock.schedule_once(lambda dt: self.open_agenda_window(), 0.1)
+
     def open_alarm_window(self):
         """Открыть окно будильника"""
         main_x, main_y = self.get_location()
@@ -344,6 +510,16 @@ class MainWindow(BaseWindow):
 
         pyglet.clock.schedule_once(lambda dt: create_window(), 0.05)
 
+    def open_agenda_window(self):
+        """Открыть окно расписания"""
+        main_x, main_y = self.get_location()
+
+        def create_window():
+            agenda_window = AgendaWindow(self.app)
+            agenda_window.set_location(main_x + 200, main_y + 100)
+
+        pyglet.clock.schedule_once(lambda dt: create_window(), 0.05)
+
 
 class AlarmWindow(pyglet.window.Window):
     """Окно установки будильника"""
@@ -366,12 +542,15 @@ class AlarmWindow(pyglet.window.Window):
         # Дни недели (0-понедельник, 6-воскресенье)
         self.selected_weekdays = [now.weekday()]  # Выбранные дни недели
 
-        # Повтор через 5 минут
+        # Повтор (по умолчанию через 5 минут, клик по подписи меняет интервал)
         self.repeat_5min = False
+        self.snooze_minutes = 5
 
-        # Загрузка спрайтов
-        self.time_sprites = self.load_digit_sprites()
-        self.date_sprites = self.load_digit_sprites()
+        # Календарь праздников, дни которого будильник пропускает (None - не пропускать)
+        self.calendar_name = None
+
+        # Загрузка картинок: один раз, кадр только рисует готовые спрайты
+        self.digit_images = self.load_digit_images()
         self.weekday_sprites = self.load_weekday_sprites()
 
         # Спрайты для переключателей
@@ -380,6 +559,7 @@ class AlarmWindow(pyglet.window.Window):
             'weekly': None
         }
         self.repeat_sprite = None
+        self.check_images = {}  # Состояние чекбокса повтора -> картинка
         self.load_type_sprites()
 
         # Области кликов
@@ -391,39 +571,34 @@ class AlarmWindow(pyglet.window.Window):
 
         self.setup_ui()
         self.setup_click_areas()
+        self.view_dirty = True  # Состояние поменялось, спрайты и надписи обновит следующий кадр
+
+    def load_image(self, name):
+        """Картинка res/<name>.png или None, если её нет"""
+        try:
+            path = Path(f"res/{name}.png")
+            if path.exists():
+                return pyglet.image.load(str(path))
+        except:
+            pass
+        return None
 
-    def load_digit_sprites(self):
+    def load_digit_images(self):
         """Загрузка цифр"""
-        digit_sprites = []
-        for i in range(10):
-            try:
-                path = Path(f"res/{i}.png")
-                if path.exists():
-                    images = pyglet.image.load(str(path))
-                    sprite = pyglet.sprite.Sprite(images, x=0, y=0)
-                    sprite.scale = 0.7
-                    digit_sprites.append(sprite)
-                else:
-                    digit_sprites.append(None)
-            except:
-                digit_sprites.append(None)
-        return digit_sprites
+        return [self.load_image(str(i)) for i in range(10)]
 
     def load_weekday_sprites(self):
         """Загрузка спрайтов дней недели"""
         weekday_names = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
         sprites = []
-        for name in weekday_names:
-            try:
-                path = Path(f"res/{name}.png")
-                if path.exists():
-                    img = pyglet.image.load(str(path))
-                    sprite = pyglet.sprite.Sprite(img, x=0, y=0)
-                    sprite.scale = 0.7
-                    sprites.append(sprite)
-                else:
-                    sprites.append(None)
-            except:
+        date_y = self.height - 250
+        for i, name in enumerate(weekday_names):
+            img = self.load_image(name)
+            if img is not None:
+                sprite = pyglet.sprite.Sprite(img, x=100 + i * 70, y=date_y - 25)
+                sprite.scale = 0.7
+                sprites.append(sprite)
+            else:
                 sprites.append(None)
         return sprites
 
@@ -434,12 +609,13 @@ class AlarmWindow(pyglet.window.Window):
             path = Path("res/type_date.png")
             if path.exists():
                 img = pyglet.image.load(str(path))
-                self.type_sprites['date'] = pyglet.sprite.Sprite(img, x=0, y=0)
+                self.type_sprites['date'] = pyglet.sprite.Sprite(img, x=250, y=self.height - 100)
+                self.type_sprites['date'].scale = 0.8
             else:
                 # Если файла нет, создаем текстовую метку как запасной вариант
                 self.type_sprites['date'] = None
         except Exception as e:
-            print(f"Ошибка загрузки type_date.png: {e}")
+            log.error('image-error', "Ошибка загрузки {name}: {error}", name="type_date.png", error=str(e))
             self.type_sprites['date'] = None
 
         try:
@@ -447,23 +623,27 @@ class AlarmWindow(pyglet.window.Window):
             path = Path("res/type_weekly.png")
             if path.exists():
                 img = pyglet.image.load(str(path))
-                self.type_sprites['weekly'] = pyglet.sprite.Sprite(img, x=0, y=0)
+                self.type_sprites['weekly'] = pyglet.sprite.Sprite(img, x=350, y=self.height - 100)
+                self.type_sprites['weekly'].scale = 0.8
             else:
                 self.type_sprites['weekly'] = None
         except Exception as e:
-            print(f"Ошибка загрузки type_weekly.png: {e}")
+            log.error('image-error', "Ошибка загрузки {name}: {error}", name="type_weekly.png", error=str(e))
             self.type_sprites['weekly'] = None
 
         try:
-            # Загружаем спрайт для чекбокса повтора (выключенное состояние)
-            path = Path("res/check_off.png")
-            if path.exists():
-                img = pyglet.image.load(str(path))
-                self.repeat_sprite = pyglet.sprite.Sprite(img, x=0, y=0)
+            # Загружаем спрайт для чекбокса повтора (выключенное и включённое состояние)
+            for state, name in ((False, "check_off.png"), (True, "check_on.png")):
+                path = Path("res") / name
+                if path.exists():
+                    self.check_images[state] = pyglet.image.load(str(path))
+            if False in self.check_images:
+                self.repeat_sprite = pyglet.sprite.Sprite(self.check_images[False], x=320, y=self.height - 360)
+                self.repeat_sprite.scale = 0.7
             else:
                 self.repeat_sprite = None
         except Exception as e:
-            print(f"Ошибка загрузки check_off.png: {e}")
+            log.error('image-error', "Ошибка загрузки {name}: {error}", name="check_off.png", error=str(e))
             self.repeat_sprite = None
 
     def setup_ui(self):
@@ -479,6 +659,152 @@ class AlarmWindow(pyglet.window.Window):
             font_size=18
         )
 
+        # Фон и подписи
+        self.background = shapes.Rectangle(0, 0, self.width, self.height, color=(0, 0, 0))
+        self.title = pyglet.text.Label(
+            "Установка будильника", font_name="Arial", font_size=24,
+            x=self.width//2, y=self.height - 40,
+            anchor_x="center", anchor_y="center",
+            color=(255, 255, 255, 255)
+        )
+        self.type_label = pyglet.text.Label(
+            "Тип будильника:", font_name="Arial", font_size=18,
+            x=50, y=self.height - 80,
+            anchor_x="left", anchor_y="center",
+            color=(255, 255, 255, 255)
+        )
+        self.time_label = pyglet.text.Label(
+            "Время:", font_name="Arial", font_size=20,
+            x=50, y=self.height - 170,
+            anchor_x="left", anchor_y="center",
+            color=(255, 255, 255, 255)
+        )
+        self.date_label = pyglet.text.Label(
+            "Дата:", font_name="Arial", font_size=20,
+            x=50, y=self.height - 250,
+            anchor_x="left", anchor_y="center",
+            color=(255, 255, 255, 255)
+        )
+        self.weekday_label = pyglet.text.Label(
+            "Выбрать дени недели:", font_name="Arial", font_size=20,
+            x=50, y=self.height - 220,
+            anchor_x="left", anchor_y="center",
+            color=(255, 255, 255, 255)
+        )
+        self.repeat_label = pyglet.text.Label(
+            "", font_name="Arial", font_size=18,
+            x=50, y=self.height - 330,
+            anchor_x="left", anchor_y="center",
+            color=(255, 255, 255, 255)
+        )
+        self.calendar_label = pyglet.text.Label(
+            "", font_name="Arial", font_size=18,
+            x=50, y=self.height - 400,
+            anchor_x="left", anchor_y="center",
+            color=(255, 255, 255, 255)
+        )
+        self.help_label = pyglet.text.Label(
+            "Кликните на цифру/элемент чтобы изменить",
+            font_name="Arial", font_size=12,
+            x=self.width//2, y=15,
+            anchor_x="center", anchor_y="center",
+            color=(200, 200, 200, 255)
+        )
+
+        # Цифры времени ЧЧ:ММ и двоеточие
+        time_y = self.height - 170
+        self.time_cells = []
+        for i in range(4):
+            x_pos = 150 + i * 60
+            if i == 2:
+                x_pos += 30
+            elif i > 2:
+                x_pos += 20
+            self.time_cells.append(self.create_digit_cell(x_pos, time_y - 25, x_pos + 20, time_y, 36))
+        self.separators = {'time': [], 'date': []}
+        colon = self.load_image("dthc")
+        if colon is not None:
+            sprite = pyglet.sprite.Sprite(colon, x=150 + 2 * 50 + 5, y=time_y - 25)
+            sprite.scale = 0.7
+            self.separators['time'].append(sprite)
+
+        # Цифры даты ДД.ММ.ГГГГ и точки
+        date_y = self.height - 250
+        self.date_cells = []
+        offset = 0
+        for i in range(8):
+            x_pos = 150 + i * 40 + offset
+            if i == 2 or i == 4:
+                x_pos += 30
+                offset += 30
+            self.date_cells.append(self.create_digit_cell(x_pos, date_y - 20, x_pos + 12, date_y, 28))
+        dot = self.load_image("thc")
+        if dot is not None:
+            for pos in [2, 5]:
+                sprite = pyglet.sprite.Sprite(dot, x=150 + pos * 30 + 30, y=date_y - 20)
+                sprite.scale = 0.7
+                self.separators['date'].append(sprite)
+
+    def create_digit_cell(self, x, y, label_x, label_y, font_size):
+        """Место под цифру: спрайт из картинок res/N.png, надпись - для цифр без картинки"""
+        image = next((image for image in self.digit_images if image is not None), None)
+        sprite = None
+        if image is not None:
+            sprite = pyglet.sprite.Sprite(image, x=x, y=y)
+            sprite.scale = 0.7
+        label = None
+        if None in self.digit_images:
+            label = pyglet.text.Label(
+                "", font_name="Arial", font_size=font_size,
+                x=label_x, y=label_y,
+                anchor_x="center", anchor_y="center",
+                color=(255, 255, 255, 255)
+            )
+        return {'sprite': sprite, 'label': label, 'image': False}
+
+    def set_digit(self, cell, digit):
+        image = self.digit_images[digit]
+        cell['image'] = image is not None
+        if image is not None:
+            if cell['sprite'].image is not image:
+                cell['sprite'].image = image
+        else:
+            set_label(cell['label'], str(digit))
+
+    def draw_digit(self, cell):
+        if cell['image']:
+            cell['sprite'].draw()
+        else:
+            cell['label'].draw()
+
+    def update_view(self):
+        """Перенести состояние (тип, цифры, дни, повтор, календарь) в спрайты и надписи"""
+        for alarm_type, sprite in self.type_sprites.items():
+            if sprite:
+                set_sprite_color(sprite, (255, 255, 255) if self.alarm_type == alarm_type else (150, 150, 150))
+
+        for cell, digit in zip(self.time_cells, self.time_digits):
+            self.set_digit(cell, digit)
+        for cell, digit in zip(self.date_cells, self.date_digits):
+            self.set_digit(cell, digit)
+
+        for i, sprite in enumerate(self.weekday_sprites):
+            if sprite is not None:
+                set_sprite_color(sprite, (255, 255, 255) if i in self.selected_weekdays else (100, 100, 100))
+
+        set_label(self.repeat_label, f"Повтор через {self.snooze_minutes} минут:")
+        set_label(self.calendar_label,
+                  f"Пропускать: {self.calendar_name}" if self.calendar_name else "Пропускать: -")
+
+        if self.repeat_sprite:
+            image = self.check_images.get(self.repeat_5min)
+            if image is not None:
+                if self.repeat_sprite.image is not image:
+                    self.repeat_sprite.image = image
+            else:
+                # Если файла нет, используем запасной вариант
+                set_sprite_color(self.repeat_sprite, (100, 255, 100) if self.repeat_5min else (150, 150, 150))
+
     def setup_click_areas(self):
         """Настройка областей кликов"""
         # Области для переключения типа будильника
@@ -517,223 +843,69 @@ class AlarmWindow(pyglet.window.Window):
             x_pos = weekday_start_x + i * 70
             self.weekday_areas.append((x_pos, weekday_y - 25, 60, 50, i))
 
-        # Повтор через 5 минут
+        # Повтор через N минут: чекбокс и подпись с интервалом
         self.repeat_area = (300, self.height - 350, 150, 40)
+        self.snooze_area = (50, self.height - 345, 240, 30)
+
+        # Календарь пропускаемых дней: клик по подписи перебирает загруженные
+        self.calendar_area = (50, self.height - 415, 400, 30)
 
     def on_draw(self):
         """Отрисовка"""
         self.clear()
+        if self.view_dirty:
+            # Здесь, а не в обработчике клика: спрайты меняются, когда текущий контекст GL - этого окна
+            self.update_view()
+            self.view_dirty = False
 
-        # Фон
-        shapes.Rectangle(0, 0, self.width, self.height,
-                         color=(0, 0, 0)).draw()
-
-        # Заголовок
-        title = pyglet.text.Label(
-            "Установка будильника", font_name="Arial", font_size=24,
-            x=self.width//2, y=self.height - 40,
-            anchor_x="center", anchor_y="center",
-            color=(255, 255, 255, 255)
-        )
-        title.draw()
+        # Фон и заголовок
+        self.background.draw()
+        self.title.draw()
 
         # Тип будильника
-        type_label = pyglet.text.Label(
-            "Тип будильника:", font_name="Arial", font_size=18,
-            x=50, y=self.height - 80,
-            anchor_x="left", anchor_y="center",
-            color=(255, 255, 255, 255)
-        )
-        type_label.draw()
-
-        # Отрисовка переключателей типа
-        if self.type_sprites['date']:
-            sprite = self.type_sprites['date']
-            sprite.x = 250
-            sprite.y = self.height - 100
-            sprite.scale = 0.8
-            if self.alarm_type == 'date':
-                sprite.color = (255, 255, 255)
-            else:
-                sprite.color = (150, 150, 150)
-            sprite.draw()
+        self.type_label.draw()
+        for sprite in self.type_sprites.values():
+            if sprite:
+                sprite.draw()
 
-        if self.type_sprites['weekly']:
-            sprite = self.type_sprites['weekly']
-            sprite.x = 350
-            sprite.y = self.height - 100
-            sprite.scale = 0.8
-            if self.alarm_type == 'weekly':
-                sprite.color = (255, 255, 255)
-            else:
-                sprite.color = (150, 150, 150)
+        # Время
+        self.time_label.draw()
+        for sprite in self.separators['time']:
             sprite.draw()
-
-        # Подписи
-        time_label = pyglet.text.Label(
-            "Время:", font_name="Arial", font_size=20,
-            x=50, y=self.height - 170,
-            anchor_x="left", anchor_y="center",
-            color=(255, 255, 255, 255)
-        )
-        time_label.draw()
-
-        # Двоеточие
-        time_y = self.height - 170
-        colon_x = 150 + 2 * 50 + 5
-        try:
-            colon = pyglet.sprite.Sprite(pyglet.image.load("res/dthc.png"),
-                                         x=colon_x, y=time_y-25)
-            colon.scale = 0.7
-            colon.draw()
-        except:
-            pass
-
-        # Отрисовка времени
-        for i in range(4):
-            x_pos = 150 + i * 60
-            if i == 2:
-                x_pos += 30
-            elif i > 2:
-                x_pos += 20
-
-            digit = self.time_digits[i]
-            sprite = self.time_sprites[digit]
-            if sprite is not None:
-                sprite_copy = pyglet.sprite.Sprite(sprite.image, x=x_pos, y=time_y -25)
-                sprite_copy.scale = 0.7
-                sprite_copy.draw()
-            else:
-                label = pyglet.text.Label(
-                    str(digit), font_name="Arial", font_size=36,
-                    x=x_pos + 20, y=time_y,
-                    anchor_x="center", anchor_y="center",
-                    color=(255, 255, 255, 255)
-                )
-                label.draw()
+        for cell in self.time_cells:
+            self.draw_digit(cell)
 
         if self.alarm_type == 'date':
-            # Отрисовка даты
-            date_label = pyglet.text.Label(
-                "Дата:", font_name="Arial", font_size=20,
-                x=50, y=self.height - 250,
-                anchor_x="left", anchor_y="center",
-                color=(255, 255, 255, 255)
-            )
-            date_label.draw()
-
-            # Точки в дате
-            date_y = self.height - 250
-            offset = 0
-            for pos in [2, 5]:
-                dot_x = 150 + pos * 30 + 30
-                try:
-                    dot = pyglet.sprite.Sprite(pyglet.image.load("res/thc.png"))
-                    dot.x = dot_x
-                    dot.y = date_y - 20
-                    dot.scale = 0.7
-                    dot.draw()
-                except:
-                    pass
-
-            # Отрисовка даты
-            offset = 0
-            for i in range(8):
-                x_pos = 150 + i * 40 + offset
-                if i == 2 or i == 4:
-                    x_pos += 30
-                    offset += 30
-
-                digit = self.date_digits[i]
-                sprite = self.date_sprites[digit]
-                if sprite is not None:
-                    sprite_copy = pyglet.sprite.Sprite(sprite.image, x=x_pos, y=date_y - 20)
-                    sprite_copy.scale = 0.7
-                    sprite_copy.draw()
-                else:
-                    label = pyglet.text.Label(
-                        str(digit), font_name="Arial", font_size=28,
-                        x=x_pos + 12, y=date_y,
-                        anchor_x="center", anchor_y="center",
-                        color=(255, 255, 255, 255)
-                    )
-                    label.draw()
+            # Дата
+            self.date_label.draw()
+            for sprite in self.separators['date']:
+                sprite.draw()
+            for cell in self.date_cells:
+                self.draw_digit(cell)
         else:
-            # Отрисовка дней недели
-            weekday_label = pyglet.text.Label(
-                "Выбрать дени недели:", font_name="Arial", font_size=20,
-                x=50, y=self.height - 220,
-                anchor_x="left", anchor_y="center",
-                color=(255, 255, 255, 255)
-            )
-            weekday_label.draw()
-
-            # Отрисовка спрайтов дней недели
-            date_y = self.height - 250
-            for i in range(7):
-                x_pos = 100 + i * 70
-                sprite = self.weekday_sprites[i]
+            # Дни недели
+            self.weekday_label.draw()
+            for sprite in self.weekday_sprites:
                 if sprite is not None:
-                    sprite_copy = pyglet.sprite.Sprite(sprite.image, x=x_pos, y=date_y - 25)
-                    sprite_copy.scale = 0.7
-                    if i in self.selected_weekdays:
-                        sprite_copy.color = (255, 255, 255)
-                    else:
-                        sprite_copy.color = (100, 100, 100)
-                    sprite_copy.draw()
-
-        # Отрисовка переключателя повтора
-        repeat_label = pyglet.text.Label(
-            "Повтор через 5 минут:", font_name="Arial", font_size=18,
-            x=50, y=self.height - 330,
-            anchor_x="left", anchor_y="center",
-            color=(255, 255, 255, 255)
-        )
-        repeat_label.draw()
+                    sprite.draw()
 
+        # Повтор и календарь пропускаемых дней
+        self.repeat_label.draw()
+        self.calendar_label.draw()
         if self.repeat_sprite:
-            self.repeat_sprite.x = 320
-            self.repeat_sprite.y = self.height - 360
-            self.repeat_sprite.scale = 0.7
-
-            # Загружаем нужный спрайт в зависимости от состояния
-            try:
-                if self.repeat_5min:
-                    path = Path("res/check_on.png")
-                    if path.exists():
-                        img = pyglet.image.load(str(path))
-                        self.repeat_sprite.image = img
-                    else:
-                        # Если файла нет, используем запасной вариант
-                        self.repeat_sprite.color = (100, 255, 100)
-                else:
-                    path = Path("res/check_off.png")
-                    if path.exists():
-                        img = pyglet.image.load(str(path))
-                        self.repeat_sprite.image = img
-                    else:
-                        self.repeat_sprite.color = (150, 150, 150)
-            except Exception as e:
-                print(f"Ошибка загрузки спрайта чекбокса: {e}")
-
             self.repeat_sprite.draw()
 
-        # Кнопка
+        # Кнопка и подсказка
         self.btn_add.draw()
-
-        # Подсказка
-        help_label = pyglet.text.Label(
-            "Кликните на цифру/элемент чтобы изменить",
-            font_name="Arial", font_size=12,
-            x=self.width//2, y=15,
-            anchor_x="center", anchor_y="center",
-            color=(200, 200, 200, 255)
-        )
-        help_label.draw()
+        self.help_label.draw()
 
     def on_mouse_press(self, x, y, button, modifiers):
         """Обработка кликов"""
+        self.handle_click(x, y)
+        self.view_dirty = True
 
+    def handle_click(self, x, y):
+        """Клик меняет состояние окна; на экран его переносит update_view в следующем кадре"""
         # Кнопка добавления
         if self.btn_add.is_clicked(x, y):
             self.add_alarm()
@@ -776,6 +948,19 @@ class AlarmWindow(pyglet.window.Window):
                 self.repeat_5min = not self.repeat_5min
                 return
 
+        # Клик по подписи повтора меняет интервал
+        area_x, area_y, width, height = self.snooze_area
+        if area_x <= x <= area_x + width and area_y <= y <= area_y + height:
+            intervals = [5, 10, 15, 30]
+            self.snooze_minutes = intervals[(intervals.index(self.snooze_minutes) + 1) % len(intervals)]
+            return
+
+        # Клик по подписи календаря выбирает следующий календарь
+        area_x, area_y, width, height = self.calendar_area
+        if area_x <= x <= area_x + width and area_y <= y <= area_y + height:
+            names = [None] + sorted(self.main_window.app.alarms.calendars)
+            self.calendar_name = names[(names.index(self.calendar_name) + 1) % len(names)]
+            return
 
     def change_time_digit(self, idx):
         """Изменить цифру времени"""
@@ -812,18 +997,13 @@ class AlarmWindow(pyglet.window.Window):
 
     def add_alarm(self):
         """Добавить будильник"""
-        # Проверяем количество
-        if len(self.main_window.app.alarms) >= 5:
-            print("Максимум 5 будильников!")
-            return
-
         # Формируем время
         hours = self.time_digits[0] * 10 + self.time_digits[1]
         minutes = self.time_digits[2] * 10 + self.time_digits[3]
 
         # Проверяем время
         if hours > 23 or minutes > 59:
-            print("Некорректное время!")
+            log.warning('alarm-rejected', "Некорректное время!")
             return
 
         time_str = f"{hours:02d}:{minutes:02d}"
@@ -839,10 +1019,10 @@ class AlarmWindow(pyglet.window.Window):
             try:
                 alarm_date = datetime(year, month, day, hours, minutes)
                 if alarm_date < datetime.now():
-                    print("Нельзя установить на прошедшее время!")
+                    log.warning('alarm-rejected', "Нельзя установить на прошедшее время!")
                     return
             except:
-                print("Некорректная дата!")
+                log.warning('alarm-rejected', "Некорректная дата!")
                 return
 
             # Добавляем будильник
@@ -851,18 +1031,21 @@ class AlarmWindow(pyglet.window.Window):
                 'date': f"{year:04d}-{month:02d}-{day:02d}",
                 'time': time_str,
                 'repeat_5min': self.repeat_5min,
+                'snooze_minutes': self.snooze_minutes,
+                'snooze_count': 1,
+                'calendars': [self.calendar_name] if self.calendar_name else [],
                 'enabled': True,
-                'last_triggered': None,
-                'repeat_scheduled': None
+                'last_triggered': None
             }
 
-            self.main_window.app.alarms.append(new_alarm)
-            print(f"Будильник добавлен (по дате): {new_alarm['date']} {new_alarm['time']}")
+            self.main_window.app.alarms.add(new_alarm)
+            log.info('added', "Будильник добавлен (по дате): {date} {time}",
+                     alarm_id=new_alarm.get('id'), date=new_alarm['date'], time=new_alarm['time'])
 
         else:  # подразумеваем что weekly
             # Проверяем, что выбран хотя бы один день
             if not self.selected_weekdays:
-                print("Выберите хотя бы один день недели!")
+                log.warning('alarm-rejected', "Выберите хотя бы один день недели!")
                 return
 
             # Добавляем будильник
@@ -871,16 +1054,19 @@ class AlarmWindow(pyglet.window.Window):
                 'weekdays': self.selected_weekdays.copy(),
                 'time': time_str,
                 'repeat_5min': self.repeat_5min,
+                'snooze_minutes': self.snooze_minutes,
+                'snooze_count': 1,
+                'calendars': [self.calendar_name] if self.calendar_name else [],
                 'enabled': True,
-                'last_triggered': None,
-                'repeat_scheduled': None
+                'last_triggered': None
             }
 
             weekdays_ru = ["Понедельник", "Вторник", "Среда", "Четверг",
                            "Пятница", "Суббота", "Воскресенье"]
             selected_days = ",".join([weekdays_ru[day] for day in self.selected_weekdays])
-            self.main_window.app.alarms.append(new_alarm)
-            print(f"Будильник добавлен (еженедельный): {selected_days} {new_alarm['time']}")
+            self.main_window.app.alarms.add(new_alarm)
+            log.info('added', "Будильник добавлен (еженедельный): {days} {time}",
+                     alarm_id=new_alarm.get('id'), days=selected_days, time=new_alarm['time'])
 
         pyglet.clock.schedule_once(lambda dt: self.close(), 0.01)
 
@@ -888,7 +1074,7 @@ class AlarmWindow(pyglet.window.Window):
 class SettingsWindow(BaseWindow):
     """Окно настроек"""
     def __init__(self, app):
-        super().__init__(app, width=400, height=350, title="Настройки")
+        super().__init__(app, width=400, height=420, title="Настройки")
         self.size_button = 300  # Шире чем стандартная
         self.setup_ui()
 
@@ -927,6 +1113,39 @@ class SettingsWindow(BaseWindow):
             width=self.size_button
         )
 
+        # Сколько минут догонять будильники, пропущенные во время сна или зависания
+        self.btn_grace = self.create_button(
+            x=center_x - self.size_button//2,
+            y=start_y - 210,
+            color=(70, 100, 150),
+            text=self.grace_text(),
+            font_size=14,
+            width=self.size_button
+        )
+
+        # Импорт из res/import и экспорт в res/export (CSV, JSON Lines, iCalendar)
+        half = self.size_button // 2 - 5
+        self.btn_import = self.create_button(
+            x=center_x - self.size_button//2,
+            y=start_y - 280,
+            color=(70, 100, 150),
+            text="Импорт",
+            font_size=16,
+            width=half
+        )
+        self.btn_export = self.create_button(
+            x=center_x + 5,
+            y=start_y - 280,
+            color=(70, 100, 150),
+            text="Экспорт",
+            font_size=16,
+            width=half
+        )
+
+    def grace_text(self):
+        minutes = self.app.catchup_grace_minutes
+        return f"Догонять пропущенные: {minutes} мин" if minutes else "Пропущенные не догонять"
+
     def on_draw(self):
         """Отрисовка окна"""
         super().on_draw()
@@ -958,7 +1177,7 @@ class SettingsWindow(BaseWindow):
     def handle_button_click(self, button):
         """Обработка кликов по кнопкам"""
         if button == self.btn_bg:
-            print("Смена фона (тут пока ищу решение)")
+            log.info('background', "Смена фона (тут пока ищу решение)")
 
         elif button == self.btn_sound:
             # Открываем окно выбора мелодии
@@ -971,177 +1190,551 @@ class SettingsWindow(BaseWindow):
             pyglet.clock.schedule_once(lambda dt: open_sound_window(), 0.1)
 
         elif button == self.btn_reset:
-            pyglet.clock.schedule_once(lambda dt: self.app.alarms.clear(), 0.1)
-            print("Все будильники сброшены")
+            pyglet.clock.schedule_once(lambda dt: self.app.clear_alarms(), 0.1)
+            log.info('cleared', "Все будильники сброшены")
 
+        elif button == self.btn_grace:
+            # Циклический выбор окна догона
+            intervals = [0, 5, 10, 30, 60]
+            minutes = self.app.catchup_grace_minutes
+            self.app.catchup_grace_minutes = intervals[(intervals.index(minutes) + 1) % len(intervals)]
+            button.set_style(button.color, self.grace_text())
 
-class AlarmListWindow(BaseWindow):
-    """Окно списка будильников"""
-    def __init__(self, app):
-        super().__init__(app, width=500, height=400, title="Список будильников")
-        self.delete_buttons = []  # Кнопки удаления для каждого будильника
-        self.toggle_buttons = []  # Кнопки включения/выключения
+        elif button == self.btn_import:
+            pyglet.clock.schedule_once(lambda dt: self.app.import_alarms(), 0.1)
 
-    def on_draw(self):
-        """Отрисовка окна"""
-        super().on_draw()
+        elif button == self.btn_export:
+            pyglet.clock.schedule_once(lambda dt: self.app.export_alarms(), 0.1)
 
-        # Темный фон
-        shapes.Rectangle(0, 0, self.width, self.height,
-                         color=(0, 0, 0)).draw()
 
-        # Заголовок
-        title = pyglet.text.Label(
-            "Список будильников", font_name="Arial", font_size=24,
+class AlarmRow:
+    """Переиспользуемая строка списка будильников"""
+    def __init__(self, y_pos):
+        self.alarm = None
+        self.y = y_pos
+
+        self.type_label = pyglet.text.Label(
+            "", font_name="Arial", font_size=14,
+            x=50, y=y_pos,
+            anchor_x="left", anchor_y="center",
+            color=(200, 200, 255, 255)
+        )
+        self.date_label = pyglet.text.Label(
+            "", font_name="Arial", font_size=14,
+            x=120, y=y_pos,
+            anchor_x="left", anchor_y="center",
+            color=(200, 200, 255, 255)
+        )
+        self.time_label = pyglet.text.Label(
+            "", font_name="Arial", font_size=14,
+            x=220, y=y_pos,
+            anchor_x="left", anchor_y="center",
+            color=(200, 200, 255, 255)
+        )
+        self.status_label = pyglet.text.Label(
+            "", font_name="Arial", font_size=14,
+            x=290, y=y_pos,
+            anchor_x="center", anchor_y="center",
+            color=(100, 255, 100, 255)
+        )
+        self.repeat_label = pyglet.text.Label(
+            "", font_name="Arial", font_size=12,
+            x=330, y=y_pos,
+            anchor_x="center", anchor_y="center",
+            color=(255, 255, 100, 255)
+        )
+
+        # Кнопка включения/выключения
+        self.toggle_button = Button(
+            x=370,
+            y=y_pos - 10,
+            width=50,
+            height=25,
+            color=(100, 200, 100),
+            text="Выкл",
+            font_size=10
+        )
+
+        # Кнопка удаления
+        self.delete_button = Button(
+            x=430,
+            y=y_pos - 10,
+            width=60,
+            height=25,
+            color=(200, 80, 80),
+            text="Удалить",
+            font_size=10
+        )
+
+    def bind(self, alarm):
+        """Показать в строке другой будильник"""
+        self.alarm = alarm
+        if alarm is None:
+            return
+
+        # Тип будильника
+        if alarm['type'] == 'date':
+            type_text = "Дата"
+            # Форматирование даты из YYYY-MM-DD в DD.MM.YY
+            date_parts = alarm['date'].split('-')
+            date_text = f"{date_parts[2]}.{date_parts[1]}.{date_parts[0][2:]}"
+        elif alarm['type'] == 'rule':
+            type_text = "Правило"
+            date_text = describe_rule(alarm['rule'])
+        else:
+            type_text = "Неделя"
+            weekdays_ru = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+            weekday_idx = alarm['weekdays'][0] if alarm['weekdays'] else 0
+            date_text = weekdays_ru[weekday_idx]
+
+        set_label(self.type_label, type_text)
+        set_label(self.date_label, date_text)
+        set_label(self.time_label, alarm['time'])
+
+        # Статус
+        if alarm['enabled']:
+            set_label(self.status_label, "ВКЛ", (100, 255, 100, 255))
+            self.toggle_button.set_style((100, 200, 100), "Выкл")
+        else:
+            set_label(self.status_label, "ВЫКЛ", (255, 100, 100, 255))
+            self.toggle_button.set_style((200, 100, 100), "Вкл")
+
+        # Повтор через 5 мин
+        set_label(self.repeat_label, "Повт" if alarm.get('repeat_5min', False) else "")
+
+    def draw(self):
+        """Отрисовка строки"""
+        self.type_label.draw()
+        self.date_label.draw()
+        self.time_label.draw()
+        self.status_label.draw()
+        self.repeat_label.draw()
+        self.toggle_button.draw()
+        self.delete_button.draw()
+
+
+class AlarmListWindow(BaseWindow):
+    """Окно списка будильников"""
+    row_height = 30
+
+    def __init__(self, app):
+        super().__init__(app, width=500, height=400, title="Список будильников")
+        self.scroll_offset = 0
+        self.sort_key = None  # None - порядок добавления
+        self.sort_reverse = False
+        self.search_text = ""  # Строка поиска, например "пн 07:00-09:00 вкл"
+        self.bound_state = None  # С какими данными строки связаны сейчас
+        self.shown_count = 0  # Сколько будильников в списке с учётом поиска
+
+        # Строк создаётся столько, сколько помещается в окно, дальше они переиспользуются
+        self.rows_top = self.height - 120
+        visible_rows = (self.rows_top - 40) // self.row_height + 1
+        self.rows = [AlarmRow(self.rows_top - i * self.row_height) for i in range(visible_rows)]
+
+        self.setup_ui()
+
+    def setup_ui(self):
+        """Статичные элементы окна"""
+        # Темный фон
+        self.background = shapes.Rectangle(0, 0, self.width, self.height,
+                                           color=(0, 0, 0))
+
+        # Заголовок
+        self.title = pyglet.text.Label(
+            "Список будильников", font_name="Arial", font_size=24,
             x=self.width//2, y=self.height - 40,
             anchor_x="center", anchor_y="center",
             color=(255, 255, 255, 255)
         )
-        title.draw()
 
-        # Заголовок таблицы
-        header = pyglet.text.Label(
-            "Тип       Дата/День    Время      Статус",
-            font_name="Arial", font_size=16,
-            x=50, y=self.height - 90,
-            anchor_x="left", anchor_y="center",
+        # Заголовок таблицы: клик по колонке меняет сортировку
+        self.header_y = self.height - 90
+        self.columns = [
+            # (текст, x, правая граница области клика, ключ сортировки)
+            ("Тип", 50, 115, 'type'),
+            ("Дата/День", 120, 215, 'next'),
+            ("Время", 220, 262, 'next'),
+            ("Статус", 266, 345, 'enabled'),
+        ]
+        self.header_labels = []
+        for text, x, _, _ in self.columns:
+            self.header_labels.append(pyglet.text.Label(
+                text, font_name="Arial", font_size=14,
+                x=x, y=self.header_y,
+                anchor_x="left", anchor_y="center",
+                color=(200, 200, 100, 255)
+            ))
+        self.sort_marker = pyglet.text.Label(
+            "", font_name="Arial", font_size=14,
+            x=0, y=self.header_y,
+            anchor_x="right", anchor_y="center",
             color=(200, 200, 100, 255)
         )
-        header.draw()
+
+        self.no_alarms = pyglet.text.Label(
+            "Нет установленных будильников",
+            font_name="Arial", font_size=18,
+            x=self.width//2, y=self.height//2,
+            anchor_x="center", anchor_y="center",
+            color=(150, 150, 150, 255)
+        )
+
+        # Строка поиска
+        self.search_label = pyglet.text.Label(
+            "Поиск: _", font_name="Arial", font_size=12,
+            x=50, y=self.height - 68,
+            anchor_x="left", anchor_y="center",
+            color=(150, 200, 150, 255)
+        )
+
+        # Индикатор прокрутки
+        self.scroll_info = pyglet.text.Label(
+            "", font_name="Arial", font_size=12,
+            x=self.width - 60, y=15,
+            anchor_x="center", anchor_y="center",
+            color=(150, 150, 150, 255)
+        )
+
+    def sync_rows(self):
+        """Связать строки с будильниками, если данные, поиск, прокрутка или сортировка изменились"""
+        alarms = self.app.alarms
+        state = (alarms.version, self.search_text, self.scroll_offset, self.sort_key, self.sort_reverse)
+        if state == self.bound_state:
+            return
+
+        if self.search_text:
+            found = alarms.query(**parse_query(self.search_text))
+            count = len(found)
+        else:
+            count = len(alarms)
+
+        max_offset = max(0, count - len(self.rows))
+        self.scroll_offset = min(self.scroll_offset, max_offset)
+        self.shown_count = count
+        self.bound_state = (alarms.version, self.search_text, self.scroll_offset,
+                            self.sort_key, self.sort_reverse)
+
+        if self.search_text:
+            # Найденное по индексам показывается в выбранном порядке до нужной страницы
+            if self.sort_key is None and not self.sort_reverse:
+                ordered = iter(found)
+            else:
+                ordered = alarms.query_view(found, self.sort_key, self.sort_reverse)
+            page = islice(ordered, self.scroll_offset, self.scroll_offset + len(self.rows))
+            for row in self.rows:
+                row.bind(next(page, None))
+        else:
+            # Без поиска строка берётся из индекса по позиции за O(1)
+            view = alarms.sorted_view(self.sort_key)
+            for i, row in enumerate(self.rows):
+                position = self.scroll_offset + i
+                if position >= count:
+                    row.bind(None)
+                    continue
+                if self.sort_reverse:
+                    position = count - 1 - position
+                row.bind(alarms.view_item(view, position))
+
+        # Стрелка слева от колонки активной сортировки
+        for _, x, _, key in self.columns:
+            if key == self.sort_key:
+                self.sort_marker.x = x - 2
+                set_label(self.sort_marker, "↓" if self.sort_reverse else "↑")
+                break
+
+        end = min(self.scroll_offset + len(self.rows), count)
+        set_label(self.scroll_info, f"{self.scroll_offset + 1}-{end} из {count}")
+        set_label(self.search_label, f"Поиск: {self.search_text}_")
+
+    def on_draw(self):
+        """Отрисовка окна"""
+        super().on_draw()
+        self.background.draw()
+        self.title.draw()
+        for label in self.header_labels:
+            label.draw()
+        if self.sort_key is not None:
+            self.sort_marker.draw()
 
         # Список будильников
         if not self.app.alarms:
-            no_alarms = pyglet.text.Label(
-                "Нет установленных будильников",
-                font_name="Arial", font_size=18,
-                x=self.width//2, y=self.height//2,
-                anchor_x="center", anchor_y="center",
-                color=(150, 150, 150, 255)
+            self.no_alarms.draw()
+            return
+
+        self.sync_rows()
+        for row in self.rows:
+            if row.alarm is not None:
+                row.draw()
+
+        self.search_label.draw()
+        if self.shown_count > len(self.rows):
+            self.scroll_info.draw()
+
+    def toggle_sort(self, key):
+        """Сортировка: по возрастанию -> по убыванию -> порядок добавления"""
+        if self.sort_key != key:
+            self.sort_key = key
+            self.sort_reverse = False
+        elif not self.sort_reverse:
+            self.sort_reverse = True
+        else:
+            self.sort_key = None
+            self.sort_reverse = False
+        self.scroll_offset = 0
+
+    def scroll(self, rows):
+        """Прокрутка списка на заданное число строк"""
+        max_offset = max(0, self.shown_count - len(self.rows))
+        self.scroll_offset = max(0, min(self.scroll_offset + rows, max_offset))
+
+    def on_mouse_press(self, x, y, button, modifiers):
+        """Обработка кликов"""
+        # Клик по заголовку колонки
+        if abs(y - self.header_y) <= 12:
+            for _, x_start, x_end, key in self.columns:
+                if x_start <= x <= x_end:
+                    self.toggle_sort(key)
+                    return
+            return
+
+        # Строка под курсором вычисляется по геометрии, без перебора
+        slot = int((self.rows_top + self.row_height // 2 - y) // self.row_height)
+        if not 0 <= slot < len(self.rows):
+            return
+        row = self.rows[slot]
+        alarm = row.alarm
+        if alarm is None:
+            return
+
+        # Кнопка включения/выключения
+        if row.toggle_button.is_clicked(x, y):
+            self.app.alarms.set_enabled(alarm['id'], not alarm['enabled'])
+            log.info('toggled', "Будильник {alarm_id} переключен: {state}", alarm_id=alarm['id'],
+                     enabled=alarm['enabled'], state='ВКЛ' if alarm['enabled'] else 'ВЫКЛ')
+            return
+
+        # Кнопка удаления: по id, поэтому безопасно даже для звонящего будильника
+        if row.delete_button.is_clicked(x, y):
+            self.app.delete_alarm(alarm['id'])
+
+    def on_mouse_scroll(self, x, y, scroll_x, scroll_y):
+        """Прокрутка колесиком мыши"""
+        if scroll_y > 0:
+            self.scroll(-1)
+        elif scroll_y < 0:
+            self.scroll(1)
+
+    def on_text(self, text):
+        """Ввод строки поиска"""
+        if text.isprintable():
+            self.search_text += text
+            self.scroll_offset = 0
+
+    def on_key_press(self, symbol, modifiers):
+        """Прокрутка клавишами и редактирование поиска"""
+        super().on_key_press(symbol, modifiers)
+        key = pyglet.window.key
+        page = len(self.rows)
+        if symbol == key.BACKSPACE:
+            self.search_text = self.search_text[:-1]
+            self.scroll_offset = 0
+        elif symbol == key.ESCAPE:
+            self.search_text = ""
+            self.scroll_offset = 0
+        elif symbol == key.UP:
+            self.scroll(-1)
+        elif symbol == key.DOWN:
+            self.scroll(1)
+        elif symbol == key.PAGEUP:
+            self.scroll(-page)
+        elif symbol == key.PAGEDOWN:
+            self.scroll(page)
+        elif symbol == key.HOME:
+            self.scroll_offset = 0
+        elif symbol == key.END:
+            self.scroll(self.shown_count)
+
+
+class AgendaWindow(BaseWindow):
+    """Расписание: все срабатывания всех будильников на несколько дней вперёд
+
+    Срабатывания берутся из потока AlarmStore.occurrences и подгружаются
+    страницами по мере прокрутки, всё окно целиком не строится.
+    """
+    row_height = 26
+    ranges = [1, 7, 30, 90]  # На сколько дней вперёд показывать
+
+    def __init__(self, app):
+        super().__init__(app, width=500, height=450, title="Расписание")
+        self.days = 30
+        self.scroll_offset = 0
+        self.loaded = []  # Уже полученные из потока (момент, будильник)
+        self.stream = None
+        self.exhausted = False
+        self.stream_version = None  # Версия хранилища, по которой построен поток
+        self.bound_state = None
+
+        self.rows_top = self.height - 100
+        visible_rows = (self.rows_top - 50) // self.row_height + 1
+        self.rows = []
+        for i in range(visible_rows):
+            y_pos = self.rows_top - i * self.row_height
+            when_label = pyglet.text.Label(
+                "", font_name="Arial", font_size=14,
+                x=30, y=y_pos,
+                anchor_x="left", anchor_y="center",
+                color=(200, 200, 255, 255)
             )
-            no_alarms.draw()
+            text_label = pyglet.text.Label(
+                "", font_name="Arial", font_size=14,
+                x=210, y=y_pos,
+                anchor_x="left", anchor_y="center",
+                color=(255, 255, 255, 255)
+            )
+            self.rows.append((when_label, text_label))
+
+        self.setup_ui()
+
+    def setup_ui(self):
+        self.background = shapes.Rectangle(0, 0, self.width, self.height,
+                                           color=(0, 0, 0))
+        self.title = pyglet.text.Label(
+            "Расписание", font_name="Arial", font_size=22,
+            x=30, y=self.height - 40,
+            anchor_x="left", anchor_y="center",
+            color=(255, 255, 255, 255)
+        )
+        self.range_label = pyglet.text.Label(
+            "", font_name="Arial", font_size=12,
+            x=30, y=self.height - 72,
+            anchor_x="left", anchor_y="center",
+            color=(150, 150, 150, 255)
+        )
+        self.scroll_info = pyglet.text.Label(
+            "", font_name="Arial", font_size=12,
+            x=self.width // 2, y=20,
+            anchor_x="center", anchor_y="center",
+            color=(150, 150, 150, 255)
+        )
+
+        # Переключатель длины окна
+        self.btn_range = self.create_button(
+            x=self.width - 150, y=self.height - 60,
+            width=120, height=35,
+            color=(70, 100, 150), text=f"{self.days} дн", font_size=14
+        )
+
+    def restart_stream(self, now):
+        """Начать поток срабатываний заново (изменились будильники, время или окно)"""
+        alarms = self.app.alarms
+        self.stream = alarms.occurrences(now, now + timedelta(days=self.days))
+        self.stream_version = alarms.version
+        self.loaded = []
+        self.exhausted = False
+        self.bound_state = None
+
+    def fetch(self, count):
+        """Подгрузить из потока, чтобы было хотя бы count срабатываний"""
+        if len(self.loaded) < count and not self.exhausted:
+            self.loaded.extend(islice(self.stream, count - len(self.loaded)))
+            self.exhausted = len(self.loaded) < count
+
+    def sync_rows(self):
+        """Связать строки с нужной страницей расписания"""
+        now = datetime.now()
+        if (self.stream is None or self.stream_version != self.app.alarms.version
+                or (self.loaded and self.loaded[0][0] < now.replace(second=0, microsecond=0))):
+            self.restart_stream(now)
+
+        # Страница и ещё одна строка: по ней видно, есть ли что-то дальше
+        self.fetch(self.scroll_offset + len(self.rows) + 1)
+        self.scroll_offset = max(0, min(self.scroll_offset, len(self.loaded) - len(self.rows)))
+
+        state = (self.stream_version, id(self.stream), self.scroll_offset)
+        if state == self.bound_state:
+            return
+        self.bound_state = state
+
+        weekdays_ru = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+        page = self.loaded[self.scroll_offset:self.scroll_offset + len(self.rows)]
+        for i, (when_label, text_label) in enumerate(self.rows):
+            if i >= len(page):
+                set_label(when_label, "")
+                set_label(text_label, "")
+                continue
+            fire_time, alarm = page[i]
+            set_label(when_label, f"{weekdays_ru[fire_time.weekday()]} {fire_time:%d.%m %H:%M}")
+            text = alarm.get('label') or f"Будильник {alarm['id']}"
+            if alarm['type'] == 'rule':
+                text += f" ({describe_rule(alarm['rule'])})"
+            set_label(text_label, text)
+
+        if page:
+            set_label(self.range_label, f"с {page[0][0]:%d.%m.%Y}")
         else:
-            # Очищаем старые кнопки
-            self.delete_buttons.clear()
-            self.toggle_buttons.clear()
-
-            for i, alarm in enumerate(self.app.alarms):
-                y_pos = self.height - 120 - i * 30
-
-                # Тип будильника
-                if alarm['type'] == 'date':
-                    type_text = "Дата"
-                    # Форматирование даты из YYYY-MM-DD в DD.MM.YYYY
-                    date_parts = alarm['date'].split('-')
-                    date_text = f"{date_parts[2]}.{date_parts[1]}.{date_parts[0][2:]}"
-                else:
-                    type_text = "Неделя"
-                    weekdays_ru = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
-                    weekday_idx = alarm['weekdays'][0] if alarm['weekdays'] else 0
-                    date_text = weekdays_ru[weekday_idx]
-
-                # Статус
-                status_color = (100, 255, 100) if alarm['enabled'] else (255, 100, 100)
-                status_text = "ВКЛ" if alarm['enabled'] else "ВЫКЛ"
-
-                # Повтор через 5 мин
-                repeat_text = "Повт" if alarm.get('repeat_5min', False) else ""
-
-                # Тип
-                type_label = pyglet.text.Label(
-                    type_text, font_name="Arial", font_size=14,
-                    x=50, y=y_pos,
-                    anchor_x="left", anchor_y="center",
-                    color=(200, 200, 255, 255)
-                )
-                type_label.draw()
+            set_label(self.range_label, f"Нет срабатываний за {self.days} дн")
+        end = self.scroll_offset + len(page)
+        total = f"{len(self.loaded)}" if self.exhausted else f"{len(self.loaded)}+"
+        set_label(self.scroll_info, f"{self.scroll_offset + 1}-{end} из {total}" if page else "")
 
-                # Дата/День
-                date_label = pyglet.text.Label(
-                    date_text, font_name="Arial", font_size=14,
-                    x=120, y=y_pos,
-                    anchor_x="left", anchor_y="center",
-                    color=(200, 200, 255, 255)
-                )
-                date_label.draw()
+    def on_draw(self):
+        """Отрисовка расписания"""
+        self.clear()
+        self.background.draw()
+        self.sync_rows()
+        self.title.draw()
+        self.range_label.draw()
+        for when_label, text_label in self.rows:
+            when_label.draw()
+            text_label.draw()
+        self.scroll_info.draw()
+        for button in self.buttons:
+            button.draw()
 
-                # Время
-                time_label = pyglet.text.Label(
-                    alarm['time'], font_name="Arial", font_size=14,
-                    x=220, y=y_pos,
-                    anchor_x="left", anchor_y="center",
-                    color=(200, 200, 255, 255)
-                )
-                time_label.draw()
-
-                # Статус
-                status_label = pyglet.text.Label(
-                    status_text, font_name="Arial", font_size=14,
-                    x=290, y=y_pos,
-                    anchor_x="center", anchor_y="center",
-                    color=status_color + (255,)
-                )
-                status_label.draw()
-
-                # Повтор
-                repeat_label = pyglet.text.Label(
-                    repeat_text, font_name="Arial", font_size=12,
-                    x=330, y=y_pos,
-                    anchor_x="center", anchor_y="center",
-                    color=(255, 255, 100, 255)
-                )
-                repeat_label.draw()
-
-                # Кнопка включения/выключения
-                toggle_color = (100, 200, 100) if alarm['enabled'] else (200, 100, 100)
-                toggle_text = "Выкл" if alarm['enabled'] else "Вкл"
-                toggle_button = Button(
-                    x=370,
-                    y=y_pos - 10,
-                    width=50,
-                    height=25,
-                    color=toggle_color,
-                    text=toggle_text,
-                    font_size=10
-                )
-                toggle_button.draw()
-                self.toggle_buttons.append((toggle_button, i))
-
-                # Кнопка удаления
-                delete_button = Button(
-                    x=430,
-                    y=y_pos - 10,
-                    width=60,
-                    height=25,
-                    color=(200, 80, 80),
-                    text="Удалить",
-                    font_size=10
-                )
-                delete_button.draw()
-                self.delete_buttons.append((delete_button, i))
+    def scroll(self, delta):
+        # Вниз можно листать сколько угодно: недостающее подгрузится из потока
+        self.scroll_offset = max(0, self.scroll_offset + delta)
 
     def on_mouse_press(self, x, y, button, modifiers):
         """Обработка кликов"""
-        # Проверка кликов по кнопкам включения/выключения
-        for toggle_button, index in self.toggle_buttons:
-            if toggle_button.is_clicked(x, y):
-                if index < len(self.app.alarms):
-                    # Переключаем статус
-                    self.app.alarms[index]['enabled'] = not self.app.alarms[index]['enabled']
-                    print(f"Будильник {index+1} переключен: {'ВКЛ' if self.app.alarms[index]['enabled'] else 'ВЫКЛ'}")
-                    return
+        if self.btn_range.is_clicked(x, y):
+            self.days = self.ranges[(self.ranges.index(self.days) + 1) % len(self.ranges)]
+            self.btn_range.set_style(self.btn_range.color, f"{self.days} дн")
+            self.stream = None
+            self.scroll_offset = 0
+
+    def on_mouse_scroll(self, x, y, scroll_x, scroll_y):
+        """Прокрутка колесиком мыши"""
+        if scroll_y > 0:
+            self.scroll(-1)
+        elif scroll_y < 0:
+            self.scroll(1)
+
+    def on_key_press(self, symbol, modifiers):
+        """Прокрутка клавишами"""
+        super().on_key_press(symbol, modifiers)
+        key = pyglet.window.key
+        page = len(self.rows)
+        if symbol == key.UP:
+            self.scroll(-1)
+        elif symbol == key.DOWN:
+            self.scroll(1)
+        elif symbol == key.PAGEUP:
+            self.scroll(-page)
+        elif symbol == key.PAGEDOWN:
+            self.scroll(page)
+        elif symbol == key.HOME:
+            self.scroll_offset = 0
+
+
+def find_sounds(directory):
+    """Файлы .wav и .mp3 папки: [(имя, путь)], отсортированные по имени"""
+    if not directory.exists():
+        return []
+    found = [(path.name, str(path)) for ext in ("*.wav", "*.mp3") for path in directory.glob(ext)]
+    found.sort(key=lambda item: item[0].lower())
+    return found
 
-        # Проверка кликов по кнопкам удаления
-        for delete_button, index in self.delete_buttons:
-            if delete_button.is_clicked(x, y):
-                if index < len(self.app.alarms):
-                    # Удаляем будильник
-                    def delete_alarm(dt):
-                        if index < len(self.app.alarms):
-                            del self.app.alarms[index]
-                            print(f"Будильник {index+1} удален")
-
-                    pyglet.clock.schedule_once(delete_alarm, 0.01)
-                    return
 
 class SoundSelectWindow(BaseWindow):
     """Окно выбора мелодии будильника"""
@@ -1161,25 +1754,14 @@ class SoundSelectWindow(BaseWindow):
 
     def load_sound_files(self):
         """Загрузка списка звуковых файлов из папки res"""
-        # Создаем новый список вместо изменения существующего
-        new_sound_files = []
-        res_path = Path("res")
-
-        if res_path.exists():
-            # Ищем файлы .wav и .mp3
-            for ext in ["*.wav", "*.mp3"]:
-                for file_path in res_path.glob(ext):
-                    new_sound_files.append({
-                        'name': file_path.name,
-                        'path': str(file_path),
-                        'is_current': str(file_path) == self.app.current_sound_path
-                    })
-
-        # Сортируем по имени
-        new_sound_files.sort(key=lambda x: x['name'].lower())
+        # В режиме asyncio список уже собран в фоне (AlarmApp.scan_sounds)
+        library = self.app.sound_library
+        if library is None:
+            library = find_sounds(Path("res"))
 
         # Заменяем весь список целиком, а не изменяем его по частям
-        self.sound_files = new_sound_files
+        self.sound_files = [{'name': name, 'path': path, 'is_current': path == self.app.current_sound_path}
+                            for name, path in library]
 
     def setup_ui(self):
         """Настройка интерфейса окна выбора мелодии"""
@@ -1227,119 +1809,132 @@ class SoundSelectWindow(BaseWindow):
             font_size=10
         )
 
-    def on_draw(self):
-        """Отрисовка окна выбора мелодии"""
-        super().on_draw()
-
-        # Фон
-        shapes.Rectangle(0, 0, self.width, self.height,
-                         color=(0, 0, 0)).draw()
-
-        # Заголовок
-        title = pyglet.text.Label(
+        # Фон, заголовок и список: создаются один раз, кадр только рисует их
+        self.background = shapes.Rectangle(0, 0, self.width, self.height, color=(0, 0, 0))
+        self.title = pyglet.text.Label(
             "Выберите мелодию будильника",
             font_name="Arial", font_size=20,
             x=self.width // 2, y=self.height - 40,
             anchor_x="center", anchor_y="center",
             color=(255, 255, 255, 255)
         )
-        title.draw()
-
-        # Информация о текущей мелодии
-        current_info = pyglet.text.Label(
-            f"Текущая: {Path(self.app.current_sound_path).name}",
+        self.current_info = pyglet.text.Label(
+            "",
             font_name="Arial", font_size=14,
             x=20, y=self.height - 70,
             anchor_x="left", anchor_y="center",
             color=(200, 200, 100, 255)
         )
-        current_info.draw()
-
-        # Список файлов
-        if not self.sound_files:
-            no_files_label = pyglet.text.Label(
-                "В папке 'res' нет файлов .wav или .mp3",
-                font_name="Arial", font_size=16,
-                x=self.width // 2, y=self.height // 2,
-                anchor_x="center", anchor_y="center",
-                color=(200, 100, 100, 255)
-            )
-            no_files_label.draw()
-            return
+        self.no_files_label = pyglet.text.Label(
+            "В папке 'res' нет файлов .wav или .mp3",
+            font_name="Arial", font_size=16,
+            x=self.width // 2, y=self.height // 2,
+            anchor_x="center", anchor_y="center",
+            color=(200, 100, 100, 255)
+        )
 
         # Область списка
         list_start_y = self.height - 100
         list_height = 350
         item_height = 30
+        self.list_background = shapes.Rectangle(20, list_start_y - list_height + 20,
+                                                self.width - 80, list_height - 40,
+                                                color=(50, 60, 80))
+        self.rows = []
+        for i in range(self.max_visible_items):
+            y_pos = list_start_y - (i + 1) * item_height
+            self.rows.append({
+                'background': shapes.Rectangle(25, y_pos - 25, self.width - 90, item_height,
+                                               color=(60, 70, 90)),
+                'label': pyglet.text.Label(
+                    "",
+                    font_name="Arial", font_size=14,
+                    x=30, y=y_pos - 10,
+                    anchor_x="left", anchor_y="center",
+                    color=(200, 200, 200, 255)
+                ),
+            })
+        # Индикатор текущей мелодии
+        self.current_mark = pyglet.text.Label(
+            "*",
+            font_name="Arial", font_size=12,
+            x=self.width - 100, y=0,
+            anchor_x="right", anchor_y="center",
+            color=(100, 255, 100, 255)
+        )
+        # Индикатор прокрутки
+        self.scroll_info = pyglet.text.Label(
+            "",
+            font_name="Arial", font_size=12,
+            x=self.width - 40, y=list_start_y - list_height - 20,
+            anchor_x="center", anchor_y="center",
+            color=(150, 150, 150, 255)
+        )
+        self.shown_count = 0
+        self.current_row = None  # Строка текущей мелодии, у неё рисуется *
+        self.bound_state = None
+
+    def sync_rows(self):
+        """Связать строки со звуками, если прокрутка, выбор или текущая мелодия изменились"""
+        state = (self.scroll_offset, self.selected_index, self.app.current_sound_path, len(self.sound_files))
+        if state == self.bound_state:
+            return
+        self.bound_state = state
 
-        # Фон списка
-        shapes.Rectangle(20, list_start_y - list_height + 20,
-                         self.width - 80, list_height - 40,
-                         color=(50, 60, 80)).draw()
-
-        # Создаем копию данных для безопасной итерации
-        visible_files = []
+        set_label(self.current_info, f"Текущая: {Path(self.app.current_sound_path).name}")
         start_idx = self.scroll_offset
         end_idx = min(start_idx + self.max_visible_items, len(self.sound_files))
-
-        # Копируем только видимые элементы
-        for i in range(start_idx, end_idx):
-            if i < len(self.sound_files):
-                # Создаем копию каждого элемента
-                sound_file = dict(self.sound_files[i])
-                sound_file['original_index'] = i  # Сохраняем оригинальный индекс
-                visible_files.append(sound_file)
-
-        # Отрисовка видимых элементов
-        for i, sound_file in enumerate(visible_files):
-            y_pos = list_start_y - (i + 1) * item_height
-            original_idx = sound_file['original_index']
+        self.shown_count = end_idx - start_idx
+        self.current_row = None
+        for i, row in enumerate(self.rows[:self.shown_count]):
+            sound_file = self.sound_files[start_idx + i]
+            selected = start_idx + i == self.selected_index
 
             # Цвет фона в зависимости от выбора
-            if original_idx == self.selected_index:
+            if selected:
                 color = (80, 100, 150)  # Выбранный элемент
             elif sound_file['is_current']:
                 color = (70, 120, 70)   # Текущая мелодия
             else:
                 color = (60, 70, 90)    # Обычный элемент
-
-            # Фон элемента
-            shapes.Rectangle(25, y_pos - 25, self.width - 90, item_height,
-                             color=color).draw()
+            if tuple(row['background'].color[:3]) != color:
+                row['background'].color = color
 
             # Имя файла
-            text_color = (255, 255, 255) if original_idx == self.selected_index or sound_file['is_current'] else (200, 200, 200)
+            text_color = (255, 255, 255) if selected or sound_file['is_current'] else (200, 200, 200)
+            set_label(row['label'], sound_file['name'], text_color + (255,))
+            if sound_file['is_current']:
+                self.current_row = i
+                if self.current_mark.y != row['label'].y:
+                    self.current_mark.y = row['label'].y
+        set_label(self.scroll_info, f"{start_idx + 1}-{end_idx} из {len(self.sound_files)}")
 
-            file_label = pyglet.text.Label(
-                sound_file['name'],
-                font_name="Arial", font_size=14,
-                x=30, y=y_pos - 10,
-                anchor_x="left", anchor_y="center",
-                color=text_color + (255,)
-            )
-            file_label.draw()
+    def on_draw(self):
+        """Отрисовка окна выбора мелодии"""
+        super().on_draw()
 
-            # Индикатор текущей мелодии
-            if sound_file['is_current']:
-                current_mark = pyglet.text.Label(
-                    "*",
-                    font_name="Arial", font_size=12,
-                    x=self.width - 100, y=y_pos - 10,
-                    anchor_x="right", anchor_y="center",
-                    color=(100, 255, 100, 255)
-                )
-                current_mark.draw()
+        # Фон
+        self.background.draw()
+
+        # Заголовок и текущая мелодия
+        self.sync_rows()
+        self.title.draw()
+        self.current_info.draw()
+
+        # Список файлов
+        if not self.sound_files:
+            self.no_files_label.draw()
+            return
+
+        self.list_background.draw()
+        for row in islice(self.rows, self.shown_count):
+            row['background'].draw()
+            row['label'].draw()
+        if self.current_row is not None:
+            self.current_mark.draw()
 
-        # Индикатор прокрутки
         if len(self.sound_files) > self.max_visible_items:
-            scroll_info = pyglet.text.Label(
-                f"{start_idx+1}-{end_idx} из {len(self.sound_files)}",
-                font_name="Arial", font_size=12,
-                x=self.width - 40, y=list_start_y - list_height - 20,
-                anchor_x="center", anchor_y="center",
-                color=(150, 150, 150, 255)
-            )
-            scroll_info.draw()
+            self.scroll_info.draw()
 
         # Кнопки
         for button in self.buttons:
@@ -1352,7 +1947,8 @@ class SoundSelectWindow(BaseWindow):
             if 0 <= self.selected_index < len(self.sound_files):
                 # Берем данные напрямую без промежуточных переменных
                 self.app.current_sound_path = self.sound_files[self.selected_index]['path']
-                print(f"Выбрана мелодия: {self.sound_files[self.selected_index]['name']}")
+                log.info('sound-selected', "Выбрана мелодия: {name}", name=self.sound_files[self.selected_index]['name'],
+                         path=str(self.app.current_sound_path))
             return
 
         # Кнопка закрыть
@@ -1396,29 +1992,61 @@ class SoundSelectWindow(BaseWindow):
         elif scroll_y < 0 and self.scroll_offset < len(self.sound_files) - self.max_visible_items:  # Прокрутка вниз
             self.scroll_offset += 1
 
-class MessageWindow(BaseWindow):
-    """Окно с сообщением"""
-    def __init__(self, app, message):
-        super().__init__(app, width=400, height=250, title="Сообщение")  # Увеличил размеры
-        self.message = message
+
+class RingingWindow(BaseWindow):
+    """Одно окно на все звонящие будильники с подтверждением каждого"""
+    row_height = 30
+
+    def __init__(self, app):
+        super().__init__(app, width=400, height=350, title="Сообщение")
+        self.scroll_offset = 0
+        self.bound_state = None  # С каким состоянием звонков связаны строки
+
+        # Строк столько, сколько помещается, дальше они переиспользуются
+        self.rows_top = self.height - 90
+        visible_rows = (self.rows_top - 90) // self.row_height + 1
+        self.rows = []
+        for i in range(visible_rows):
+            y_pos = self.rows_top - i * self.row_height
+            label = pyglet.text.Label(
+                "", font_name="Arial", font_size=14,
+                x=30, y=y_pos,
+                anchor_x="left", anchor_y="center",
+                color=(255, 255, 255, 255)
+            )
+            ack_button = Button(
+                x=self.width - 90, y=y_pos - 12, width=60, height=25,
+                color=(80, 160, 80), text="ОК", font_size=10
+            )
+            self.rows.append([None, label, ack_button])  # [id будильника, подпись, кнопка]
+
         self.setup_ui()
 
     def setup_ui(self):
         center_x = self.width // 2
 
-        # Текст сообщения (динамический)
+        self.background = shapes.Rectangle(0, 0, self.width, self.height,
+                                           color=(0, 0, 0))
+
+        # Заголовок с количеством звонящих будильников
         self.message_label = pyglet.text.Label(
-            self.message,
-            font_name="Arial", font_size=18,
-            x=center_x, y=self.height * 0.6,
+            "", font_name="Arial", font_size=18,
+            x=center_x, y=self.height - 40,
             anchor_x="center", anchor_y="center",
             color=(255, 255, 255, 255)
         )
 
-        # Кнопка закрытия
+        self.scroll_info = pyglet.text.Label(
+            "", font_name="Arial", font_size=12,
+            x=center_x, y=75,
+            anchor_x="center", anchor_y="center",
+            color=(150, 150, 150, 255)
+        )
+
+        # Кнопка подтверждения всех сразу
         self.btn_close = self.create_button(
             x=center_x - 100,
-            y=50,
+            y=20,
             width=200,
             height=40,
             color=(200, 80, 80),
@@ -1426,227 +2054,431 @@ class MessageWindow(BaseWindow):
             font_size=18
         )
 
-    def on_draw(self):
-        """Отрисовка окна с сообщением"""
-        self.clear()
+    def sync_rows(self):
+        """Связать строки со звонящими будильниками, если что-то изменилось"""
+        ringing = self.app.ringing
+        max_offset = max(0, len(ringing) - len(self.rows))
+        self.scroll_offset = min(self.scroll_offset, max_offset)
 
-        # Фон
-        shapes.Rectangle(0, 0, self.width, self.height,
-                         color=(0, 0, 0)).draw()
+        state = (self.app.ring_version, self.scroll_offset)
+        if state == self.bound_state:
+            return
+        self.bound_state = state
 
-        # Заголовок и текст
+        page = islice(ringing.items(), self.scroll_offset, self.scroll_offset + len(self.rows))
+        for row in self.rows:
+            alarm_id, ring = next(page, (None, None))
+            row[0] = alarm_id
+            if alarm_id is None:
+                continue
+            alarm = self.app.alarms[alarm_id]
+            text = f"{alarm['time']} {alarm.get('label', '')}".strip()
+            if ring['is_repeat']:
+                text += " (повтор)"
+            if ring['late'] >= 60:
+                text += f" (опоздал на {int(ring['late'] // 60)} мин)"
+            set_label(row[1], text)
+
+        set_label(self.message_label, f"Сработало будильников: {len(ringing)}")
+        end = min(self.scroll_offset + len(self.rows), len(ringing))
+        set_label(self.scroll_info, f"{self.scroll_offset + 1}-{end} из {len(ringing)}")
 
+    def on_draw(self):
+        """Отрисовка окна звонящих будильников"""
+        self.clear()
+        self.background.draw()
+        self.sync_rows()
         self.message_label.draw()
 
-        # Кнопки
+        for alarm_id, label, ack_button in self.rows:
+            if alarm_id is not None:
+                label.draw()
+                ack_button.draw()
+
+        if len(self.app.ringing) > len(self.rows):
+            self.scroll_info.draw()
+
         for button in self.buttons:
             button.draw()
 
     def on_mouse_press(self, x, y, button, modifiers):
         """Обработка кликов"""
-        for btn in self.buttons:
-            if btn.is_clicked(x, y):
-                self.handle_button_click(btn)
-                return
+        if self.btn_close.is_clicked(x, y):
+            self.app.stop_alarm()
+            return
 
-    def handle_button_click(self, button):
-        """Обработка кликов по кнопкам"""
-        if button == self.btn_close:
-            self.close()
+        # Строка под курсором вычисляется по геометрии
+        slot = int((self.rows_top + self.row_height // 2 - y) // self.row_height)
+        if 0 <= slot < len(self.rows):
+            alarm_id, _, ack_button = self.rows[slot]
+            if alarm_id is not None and ack_button.is_clicked(x, y):
+                self.app.acknowledge(alarm_id)
+
+    def on_mouse_scroll(self, x, y, scroll_x, scroll_y):
+        """Прокрутка колесиком мыши"""
+        if scroll_y > 0:
+            self.scroll_offset = max(0, self.scroll_offset - 1)
+        elif scroll_y < 0:
+            self.scroll_offset += 1
 
-class AlarmApp:
-    """Основной класс приложения"""
-    def __init__(self):
-        self.alarms = []  # Список будильников
-        self.current_sound_path = "res/alarm.wav"
+    def on_close(self):
+        # Закрытие окна не останавливает звонок - для этого кнопки
+        self.app.ringing_window = None
+        return super().on_close()
+
+
+class AlarmApp(Scheduler):
+    """Основной класс приложения: окна и звук поверх планировщика
+
+    use_asyncio - цикл окон крутится внутри asyncio (event_loop.py), а
+    сохранение, поиск мелодий и сокеты управления и событий работают рядом
+    корутинами того же потока.
+    """
+    owns_events = True  # Сокет событий открывает это приложение, а не отдельный планировщик
+    store_flush_interval = 1.0  # Как часто корутина сохранения сверяет хранилище с файлом, с
+    flush_chunk = 2000  # Сколько будильников сериализуется между кадрами
+    sound_scan_interval = 5.0  # Как часто корутина ищет новые мелодии в res, с
+
+    def __init__(self, use_asyncio=False, shared_path=None, lazy=False):
+        super().__init__()
+        self.use_asyncio = use_asyncio
         self.alarm_player = None
-        self.alarm_start_time = None  # Время срабатывания будильника
-        self.current_alarm_index = None  # Индекс текущего будильника
-        self.is_repeat_alarm = False  # Проверка повтор ли это
-        self.waiting_for_repeat = False  # Ждём ли повтор после остановки основного
-        self.alarm_waiting_for_repeat = None  # Индекс будильника, для которого ждём повтор
+        self.ringing_window = None
+        self.sound_library = None  # [(имя, путь)] мелодий из фонового поиска (режим asyncio)
+        self.stopping = None  # asyncio.Event: пора завершать корутины
+
+        self.load_calendars()
+        if shared_path:
+            self.open_shared(shared_path)
+        self.load_alarms()
+        self.freeze_alarms()
+        if self.claims_fires:
+            self.open_status()  # В раздельном режиме состояние публикует планировщик
+        timeline.mark("будильники")
 
         # Создание главного окна
-        self.main_window = MainWindow(self)
+        self.main_window = MainWindow(self, lazy=lazy)
+        self.perf = PerfMonitor(self)  # Панель F3 и --metrics; пока выключен, ничего не стоит
+        self.tracer = Tracer()  # Включается --trace или запросом trace по сокету управления
+        self.allocs = AllocationMeter()  # Выделения памяти за кадр и тик, включается --allocs
+
+        self.start_scheduler()
+
+        # Управление из других процессов (control.py): запросы разбираются покадрово;
+        # в режиме asyncio сокет открывает run_async в общем цикле
+        self.control = ControlServer(self)
+
+        # Прогрев шрифтов (чтобы первое открытие окон не подтормаживало) и сокет управления;
+        # при ленивом запуске - по шагу на кадр после первого кадра, вместе с фоном и надписями
+        self.deferred = [font_cache.warm_up, self.start_control]
+        if lazy:
+            self.deferred.insert(0, self.main_window.finish_setup)
+        else:
+            while self.deferred:
+                self.deferred.pop(0)()
+        timeline.mark("службы")
+        self.main_window.push_handlers(on_refresh=self.first_frame)
+
+    def start_control(self):
+        if not self.use_asyncio and self.control.start():
+            pyglet.clock.schedule_interval(self.control.pump, 1 / 60)
+
+    def first_frame(self, dt):
+        """Главное окно нарисовано первый раз: отметка в хронологии и отложенная часть запуска"""
+        self.main_window.remove_handlers(on_refresh=self.first_frame)
+        timeline.mark("первый кадр")
+        self.finish_startup()
+
+    def finish_startup(self, dt=None):
+        if not self.deferred:
+            timeline.finish()
+            return
+        self.deferred.pop(0)()
+        pyglet.clock.schedule_once(self.finish_startup, 0)
 
-        # Запуск таймера обновления
+    def start_scheduler(self):
+        """Проверка сроков в цикле окна и рассылка событий подписчикам"""
+        if not self.use_asyncio:
+            self.events.start()
         pyglet.clock.schedule_interval(self.update, 1.0)
+        pyglet.clock.schedule_interval(self.hooks.pump, 0.1)  # Итоги действий будильников
+
+    @staticmethod
+    def freeze_alarms():
+        """Убрать загруженные будильники из-под полной сборки мусора
+
+        Будильники живут долго: без заморозки полная сборка обходит их все и на
+        100 тыс. будильников останавливает кадр на 0.3 с. Замораживается один
+        раз после загрузки и после импорта, а будильники из запросов add -
+        каждые control.FREEZE_ADDS штук, а не после каждого запроса.
+        """
+        gc.freeze()
+
+    def import_alarms(self):
+        """Импортировать все файлы .csv/.jsonl/.ics из res/import"""
+        directory = Path("res") / "import"
+        paths = sorted(path for path in directory.glob("*") if path.suffix.lower() in FORMATS)
+        if not paths:
+            log.warning('import-empty', "Нет файлов для импорта в {directory}", directory=str(directory))
+            return
+        for path in paths:
+            try:
+                report = import_alarms(self.alarms, path)
+            except (OSError, ValueError) as e:
+                log.error('import-error', "Не удалось прочитать {name}: {error}", name=path.name, error=str(e))
+                continue
+            log.info('imported', "{report}", path=str(path), report=report.format())
+        self.freeze_alarms()
+
+    def export_alarms(self):
+        """Выгрузить будильники в res/export во всех трёх форматах"""
+        directory = Path("res") / "export"
+        directory.mkdir(parents=True, exist_ok=True)
+        for fmt in ('csv', 'jsonl', 'ics'):
+            path = directory / f"alarms.{fmt}"
+            started = time.perf_counter()
+            count = export_alarms(self.alarms, path)
+            log.info('exported', "Экспорт: {count} будильников в {path} за {ms:.0f} мс",
+                     count=count, path=str(path), ms=(time.perf_counter() - started) * 1000)
 
     def update(self, dt):
         """Обновление состояния приложения"""
-        self.main_window.update_time()
+        if not self.use_asyncio or self.shared is not None:
+            self.sync_store()  # В режиме asyncio файл сохраняет корутина flush_store
         self.check_alarms()
+        self.main_window.update_time()
 
-    def trigger_alarm(self, alarm_index, is_repeat=False):
-        """Срабатывание будильника"""
-        # Проверяем, что индекс в пределах диапазона
-        if alarm_index < 0 or alarm_index >= len(self.alarms):
-            print(f"Ошибка: неверный индекс будильника {alarm_index}")
-            return
-
-        # Выводим сообщение
-        message_window = MessageWindow(self, message =(f"Будильник {alarm_index+1} сработал!"))
-        try:
-            main_x, main_y = self.main_window.get_location()
-            message_window.set_location(main_x+200, main_y+200)
-        except:
-            message_window.set_location(300,300)
-        print(f"БУДИЛЬНИК {alarm_index+1} СРАБОТАЛ! {'(ПОВТОР)' if is_repeat else ''}")
+    def show_ringing_window(self):
+        """Выводим одно сообщение на все будильники (или обновляем уже открытое)"""
+        if self.ringing_window is None:
+            self.ringing_window = RingingWindow(self)
+            try:
+                main_x, main_y = self.main_window.get_location()
+                self.ringing_window.set_location(main_x+200, main_y+200)
+            except:
+                self.ringing_window.set_location(300,300)
 
-        self.current_alarm_index = alarm_index
-        self.is_repeat_alarm = is_repeat
-        self.alarm_start_time = datetime.now()
-        self.waiting_for_repeat = False  # Сбрасываем флаг ожидания
+    def start_ring(self, due):
+        self.show_ringing_window()
 
-        try:
-            if os.path.exists(self.current_sound_path):
-                self.alarm_player = pyglet.media.Player()
-                sound = pyglet.media.load(self.current_sound_path)
-                self.alarm_player.queue(sound)
-                self.alarm_player.play()
-                self.alarm_player.loop = True
-            else:
-                print(f"Звуковой файл не найден: {self.current_sound_path}")
-        except Exception as e:
-            print(f"Ошибка воспроизведения звука: {e}")
+        # Звук запускается один раз, новые будильники присоединяются к нему
+        if self.alarm_player is None:
+            try:
+                if os.path.exists(self.current_sound_path):
+                    self.alarm_player = pyglet.media.Player()
+                    sound = pyglet.media.load(self.current_sound_path)
+                    self.alarm_player.queue(sound)
+                    self.alarm_player.play()
+                    self.alarm_player.loop = True
+                else:
+                    log.error('sound-missing', "Звуковой файл не найден: {path}", path=str(self.current_sound_path))
+            except Exception as e:
+                log.error('sound-error', "Ошибка воспроизведения звука: {error}", error=str(e))
 
-    def stop_alarm(self):
-        """Остановка будильника"""
+    def stop_sound(self):
+        """Звонить больше некому: выключить звук и закрыть окно"""
         if self.alarm_player:
             self.alarm_player.pause()
             self.alarm_player = None
+        if self.ringing_window is not None:
+            self.ringing_window.close()
+            self.ringing_window = None
 
-            # Проверяем, что current_alarm_index в пределах диапазона
-            if (self.current_alarm_index is not None and
-                    self.current_alarm_index < len(self.alarms)):
+    def run(self):
+        """Запуск приложения"""
+        try:
+            if self.use_asyncio:
+                asyncio.run(self.run_async())
+            else:
+                pyglet.app.run()
+        finally:
+            self.tracer.finish()  # Трасса пишется и тогда, когда цикл упал
+            self.allocs.finish()
+        self.shutdown()
+
+    def shutdown(self):
+        self.control.stop()
+        self.close_status()
+        self.hooks.stop()
+        self.events.stop()
+        self.save_alarms()
+        log.info('latency', "Задержка срабатывания будильников:\n{report}",
+                 report=self.fire_latency.format(), count=self.fire_latency.count)
+
+    async def run_async(self):
+        """Цикл окон в asyncio, рядом - сокеты и корутины сохранения и поиска мелодий"""
+        from event_loop import run_pyglet  # Нужен только в режиме asyncio
+        self.stopping = asyncio.Event()
+        if await self.control.attach():
+            pyglet.clock.schedule_interval(self.control.pump, 1 / 60)
+        if self.owns_events:
+            await self.events.attach()
+        tasks = [asyncio.create_task(self.flush_store()), asyncio.create_task(self.scan_sounds())]
+        try:
+            await run_pyglet()
+        finally:
+            self.stopping.set()
+            await asyncio.gather(*tasks)  # Начатая запись файла дописывается до конца
+            self.control.stop()
+            self.events.stop()
+
+    async def pause(self, seconds):
+        """Подождать; False, если за это время приложение начало закрываться"""
+        try:
+            await asyncio.wait_for(self.stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            return True
+        return False
+
+    async def flush_store(self):
+        """Сохранение в режиме asyncio: JSON готовится кусками между кадрами, файл пишет поток"""
+        while self.shared is None and await self.pause(self.store_flush_interval):
+            if self.file_stamp() != self.store_stamp:
+                self.load_alarms()
+                log.info('store-reloaded', "Будильники перечитаны из {path}", path=str(self.store_path))
+                continue
+            version = self.alarms.version
+            if version == self.saved_version:
+                continue
+            lines = []
+            for alarm in self.alarms:
+                lines.append(alarm_to_json(alarm))
+                if len(lines) % self.flush_chunk == 0:
+                    await asyncio.sleep(0)
+                    if self.alarms.version != version:
+                        break  # Будильники изменились - сохраним новую версию на следующем шаге
+            else:
+                try:
+                    await asyncio.to_thread(write_store, lines, self.store_path)
+                except OSError as e:
+                    log.error('save-error', "Не удалось сохранить будильники: {error}", error=str(e))
+                    continue
+                self.saved_version = version
+                self.store_stamp = self.file_stamp()
+                self.store_saved()
+
+    def store_saved(self):
+        """Свои изменения записаны в файл"""
+
+    async def scan_sounds(self):
+        """Поиск мелодий в режиме asyncio: окно выбора открывается без обращения к диску"""
+        while True:
+            self.sound_library = await asyncio.to_thread(find_sounds, Path("res"))
+            if not await self.pause(self.sound_scan_interval):
+                return
 
-                # Логика для основного будильника
-                if not self.is_repeat_alarm:
-                    alarm = self.alarms[self.current_alarm_index]
 
-                    if alarm.get('repeat_5min'):
-                        # Если включен повтор и нажали стоп - ждём повтора
-                        self.waiting_for_repeat = True
-                        self.alarm_waiting_for_repeat = self.current_alarm_index
-                        alarm['repeat_scheduled'] = datetime.now() + timedelta(minutes=5)
-                        print("Будильник остановлен, ждём повтор через 5 минут")
-                    else:
-                        # Если повтор не включен - просто останавливаем
-                        print("Будильник остановлен")
-                        self.waiting_for_repeat = False
-                        self.alarm_waiting_for_repeat = None
-
-                # Логика для повторного будильника
-                elif self.is_repeat_alarm:
-                    alarm = self.alarms[self.current_alarm_index]
-
-                    if alarm['type'] == 'date':
-                        # Для будильника по дате - отключаем полностью
-                        alarm['enabled'] = False
-                        print(f"Будильник {self.current_alarm_index+1} (по дате) отключен после повтора")
-                    else:
-                        # Для еженедельного - оставляем активным
-                        print(f"Будильник {self.current_alarm_index+1} (еженедельный) остановлен, остаётся активным")
+class SplitAlarmApp(AlarmApp):
+    """Раздельный режим: здесь только окна, сроки и звук - в процессе scheduler.py
 
-                    self.waiting_for_repeat = False
-                    self.alarm_waiting_for_repeat = None
+    Файл будильников пишет только окно: свои правки оно сохраняет и присылает
+    планировщику reload, а его изменения (alarms) применяет и сохраняет вместе
+    со своими. Подтверждения и остановка - командами; звонящие будильники
+    окно берёт из снимка.
+    """
+    owns_events = False
+    claims_fires = False  # Звонит планировщик
 
-            self.current_alarm_index = None
-            self.alarm_start_time = None
-            self.is_repeat_alarm = False
+    def start_scheduler(self):
+        self.link = SchedulerLink(self.store_path, self.shared and self.shared.path)
+        self.sent_settings = None  # Последние отправленные планировщику настройки
+        pyglet.clock.schedule_interval(self.poll_scheduler, 1 / 20)
+        pyglet.clock.schedule_interval(self.update, 1.0)
 
-    def check_alarms(self):
-        """Проверка срабатывания будильников"""
-        now = datetime.now()
-        current_date = now.strftime("%Y-%m-%d")
-        current_time = now.strftime("%H:%M")
-        current_weekday = now.weekday()
-
-        # Автостоп основного будильника через 1 минуту
-        if (self.alarm_player and
-                self.alarm_start_time and
-                not self.is_repeat_alarm and
-                now - self.alarm_start_time >= timedelta(minutes=1)):
-
-            print("Основной будильник остановлен (автостоп через 1 минуту)")
-
-            # Проверяем, нужно ли ждать повтора
-            if (self.current_alarm_index is not None and
-                    self.current_alarm_index < len(self.alarms) and
-                    self.alarms[self.current_alarm_index].get('repeat_5min')):
-
-                self.waiting_for_repeat = True
-                self.alarm_waiting_for_repeat = self.current_alarm_index
-                self.alarms[self.current_alarm_index]['repeat_scheduled'] = now + timedelta(minutes=5)
-                print("Ждём повтор через 5 минут")
-
-            # Останавливаем звук
-            if self.alarm_player:
-                self.alarm_player.pause()
-                self.alarm_player = None
-
-            self.current_alarm_index = None
-            self.alarm_start_time = None
-            self.is_repeat_alarm = False
-            return
+    def update(self, dt):
+        self.main_window.update_time()
 
-        # Используем копию списка для итерации, чтобы избежать изменения во время итерации
-        alarms_to_check = list(enumerate(self.alarms))
+    def poll_scheduler(self, dt):
+        """Отдать планировщику правки и настройки, забрать его события и снимок"""
+        if (not self.use_asyncio or self.shared is not None) and self.sync_store():
+            self.store_saved()
+        settings = {'catchup_grace_minutes': self.catchup_grace_minutes, 'sound': self.current_sound_path}
+        if settings != self.sent_settings and self.link.send('settings', **settings):
+            self.sent_settings = settings
+
+        fired = self.handle_events(self.link.events())
+        state = self.link.state()
+        if state is not None:
+            # Будильника, которого окно ещё не перечитало из файла, пока не показываем
+            self.ringing = {
+                alarm_id: {'is_repeat': is_repeat, 'repeats_left': repeats_left,
+                           'start_time': datetime.fromtimestamp(start_time), 'late': late}
+                for alarm_id, is_repeat, repeats_left, start_time, late in state['ringing']
+                if alarm_id in self.alarms
+            }
+            self.ring_version += 1
+        if fired and self.ringing:
+            self.show_ringing_window()
+        elif not self.ringing and self.ringing_window is not None:
+            self.stop_sound()
+
+    def handle_events(self, events):
+        """Применить изменения будильников от планировщика; True, если среди событий был звонок"""
+        fired = False
+        for event in events:
+            if event['type'] == 'fired':
+                fired = True
+            elif event['type'] == 'alarms':
+                self.apply_changes(event['changes'])
+        return fired
+
+    def apply_changes(self, changes):
+        """last_triggered и выключение от планировщика; сохранятся со следующей записью файла"""
+        for change in changes:
+            alarm = self.alarms.get(change['id'])
+            if alarm is None:
+                continue  # Окно его уже удалило
+            if change.get('enabled') is False and alarm['enabled']:
+                self.alarms.set_enabled(alarm['id'], False)
+            if change.get('last_triggered'):
+                moment = datetime.fromisoformat(change['last_triggered'])
+                if alarm['last_triggered'] is None or alarm['last_triggered'] < moment:
+                    self.alarms.set_last_triggered(alarm['id'], moment)
+
+    def store_saved(self):
+        self.link.send('reload')
+
+    def acknowledge(self, alarm_id):
+        self.link.send('ack', id=alarm_id)
 
-        for i, alarm in alarms_to_check:
-            if not alarm['enabled']:
-                continue
+    def stop_alarm(self):
+        self.link.send('stop')
 
-            # Проверка основного срабатывания (только если не ждём повтор для этого будильника)
-            should_check_main = True
-            if (self.waiting_for_repeat and
-                    self.alarm_waiting_for_repeat is not None and
-                    i == self.alarm_waiting_for_repeat):
-                should_check_main = False
-
-            if should_check_main:
-                if alarm['type'] == 'date':
-                    if alarm['date'] == current_date and alarm['time'] == current_time:
-                        # Проверяем, не срабатывал ли уже сегодня
-                        last_triggered = alarm.get('last_triggered')
-                        if last_triggered and last_triggered.date() == now.date():
-                            continue
-
-                        self.trigger_alarm(i, is_repeat=False)
-                        alarm['last_triggered'] = now
-                        return
-
-                elif alarm['type'] == 'weekly':
-                    if current_weekday in alarm['weekdays'] and alarm['time'] == current_time:
-                        last_triggered = alarm.get('last_triggered')
-                        if last_triggered and last_triggered.date() == now.date():
-                            continue
-
-                        self.trigger_alarm(i, is_repeat=False)
-                        alarm['last_triggered'] = now
-                        return
-
-            # Проверка повтора через 5 минут
-            if (alarm.get('repeat_5min') and
-                    alarm.get('repeat_scheduled') and
-                    now >= alarm['repeat_scheduled']):
-
-                self.trigger_alarm(i, is_repeat=True)
-                # Сбрасываем расписание повтора
-                alarm['repeat_scheduled'] = None
-                self.waiting_for_repeat = False
-                self.alarm_waiting_for_repeat = None
-                return
+    def shutdown(self):
+        self.control.stop()
+        self.handle_events(self.link.stop())  # Изменения, которые планировщик прислал напоследок
+        self.save_alarms()
 
-    def run(self):
-        """Запуск приложения"""
-        pyglet.app.run()
+
+timeline.mark("импорт")  # Модуль загружен, вместе с pyglet.window и pyglet.text для классов окон
 
 
 if __name__ == "__main__":
     # Создание папки ресурсов если её нет
     Path("res").mkdir(exist_ok=True)
-
-    # Запуск приложения
-    app = AlarmApp()
+    log.open_file(LOG_PATH)  # Журнал событий в JSON, res/logs/wakeup.log (journal.py)
+
+    # Запуск приложения; с --split сроки и звук проверяет отдельный процесс
+    # с --asyncio цикл окон работает внутри asyncio
+    # с --shared [путь] будильники общие с другими экземплярами (shared_store.py)
+    # с --metrics путь счётчики производительности пишутся в файл (perf.py)
+    # с --eager фон, надписи и прогрев шрифтов готовятся до первого кадра, а не после (startup.py)
+    # с --trace [путь] вызовы часов и обработчики окон трассируются, трасса пишется при выходе (tracing.py)
+    # с --allocs выделения памяти за кадр и тик считаются по классам окон, отчёт в журнал при выходе (allocs.py)
+    args = sys.argv[1:]
+    shared_path = None
+    if "--shared" in args:
+        position = args.index("--shared") + 1
+        shared_path = args[position] if position < len(args) and not args[position].startswith("--") else SHARED_PATH
+    app_class = SplitAlarmApp if "--split" in args else AlarmApp
+    app = app_class(use_asyncio="--asyncio" in args, shared_path=shared_path, lazy="--eager" not in args)
+    if "--metrics" in args and args.index("--metrics") + 1 < len(args):
+        app.perf.start_export(args[args.index("--metrics") + 1])
+    if "--trace" in args:
+        position = args.index("--trace") + 1
+        app.tracer.path = Path(args[position] if position < len(args) and not args[position].startswith("--")
+                               else TRACE_PATH)
+        app.tracer.start()
+    if "--allocs" in args:
+        app.allocs.start()
     app.run()
\ No newline at end of file
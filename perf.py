@@ -0,0 +1,328 @@
+"""Счётчики производительности окон: панель поверх главного окна и выгрузка в файл
+
+F3 в любом окне программы показывает и прячет панель: время кадра и кадры в
+секунду, длительность check_alarms и поиска ближайшего будильника, число
+окон, память текстур и проигрыватели звука. python main.py --metrics
+res/metrics.prom (или .json) раз в METRICS_INTERVAL секунд пишет те же
+счётчики в файл: textfile для node_exporter Prometheus или снимок JSON.
+
+Пока панель скрыта и выгрузка не включена, PerfMonitor ничего не
+перехватывает: обработчики окон, обёртки замеряемых функций и учёт текстур
+ставятся при включении и снимаются при выключении, так что в рабочей сборке
+он не стоит ничего.
+
+python perf.py - замер: время кадра главного окна без монитора, после его
+включения и выключения и с открытой панелью.
+"""
+import gc
+import json
+import os
+import time
+import weakref
+from collections import deque
+from pathlib import Path
+
+import pyglet
+from pyglet import shapes
+
+from journal import log
+from stats import Histogram
+
+
+FRAME_SAMPLES = 120  # Кадров в скользящем окне для времени кадра и FPS
+OVERLAY_REFRESH = 0.5  # Как часто обновляется текст панели, с
+METRICS_INTERVAL = 15.0  # Как часто счётчики пишутся в файл, с
+# Границы корзин длительностей в секундах
+DURATION_BOUNDS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 1.0)
+METRIC_PREFIX = "wakeup_"
+
+
+class PerfMonitor:
+    """Замеры окон и планировщика; включается панелью (F3) или выгрузкой в файл"""
+    def __init__(self, app):
+        self.app = app
+        self.overlay = False
+        self.export_path = None
+        self.installed = False  # Стоят ли обработчики и обёртки
+        self.wrapped = []  # (класс, атрибут, прежнее значение в классе или None) под обёртками
+        self.handlers = weakref.WeakKeyDictionary()  # окно -> (on_draw, on_refresh)
+        self.textures = weakref.WeakSet()
+        self.original_create = None  # Texture.create до подмены
+        self.frame_starts = deque(maxlen=FRAME_SAMPLES)  # Начала кадров главного окна
+        self.frame_times = deque(maxlen=FRAME_SAMPLES)  # Сколько рисовались все окна за проход
+        self.pass_time = 0.0
+        self.draw_started = None
+        self.timings = {}  # имя -> Histogram длительностей
+        self.last = {}  # имя -> последняя длительность
+        self.panel = None  # (подложка, текст), создаются при первом показе
+
+    def toggle_overlay(self):
+        self.overlay = not self.overlay
+        if self.overlay:
+            self.install()
+        elif self.export_path is None:
+            self.uninstall()
+        log.info('perf-overlay', "Панель производительности: {state}", enabled=self.overlay,
+                 state='вкл' if self.overlay else 'выкл')
+
+    def start_export(self, path, interval=METRICS_INTERVAL):
+        """Писать счётчики в файл: .json - снимок JSON, иначе textfile Prometheus"""
+        self.export_path = Path(path)
+        self.install()
+        pyglet.clock.schedule_interval(self.export, interval)
+
+    def install(self):
+        if self.installed:
+            return
+        self.installed = True
+        # Обёртки ставятся в класс: замена хранилища или окна не сбивает замер
+        for name, owner_class, attribute in self.timed_functions():
+            self.wrapped.append((owner_class, attribute, owner_class.__dict__.get(attribute)))
+            setattr(owner_class, attribute, self.timed(name, getattr(owner_class, attribute)))
+        self.track_textures()
+        pyglet.clock.schedule_interval(self.refresh, OVERLAY_REFRESH)
+        self.refresh()
+
+    def uninstall(self):
+        """Снять всё, что поставил install: дальше монитор ничего не стоит"""
+        if not self.installed:
+            return
+        self.installed = False
+        for owner_class, attribute, original in reversed(self.wrapped):
+            if original is None:
+                delattr(owner_class, attribute)  # Снова виден метод базового класса
+            else:
+                setattr(owner_class, attribute, original)
+        self.wrapped.clear()
+        for window, (on_draw, on_refresh) in list(self.handlers.items()):
+            window.remove_handlers(on_draw=on_draw, on_refresh=on_refresh)
+        self.handlers.clear()
+        if self.original_create is not None:
+            pyglet.image.Texture.create = self.original_create
+            self.original_create = None
+        self.textures = weakref.WeakSet()
+        pyglet.clock.unschedule(self.refresh)
+        self.frame_starts.clear()
+        self.frame_times.clear()
+        self.draw_started = None
+
+    @property
+    def checks_here(self):
+        """Проверяет ли сроки сам процесс окна; в раздельном режиме это делает планировщик"""
+        return getattr(self.app, 'claims_fires', True)
+
+    def timed_functions(self):
+        """(имя замера, класс, метод) функций, длительность которых замеряется"""
+        functions = [('next_alarm', type(self.app.alarms), 'next_enabled')]
+        if self.checks_here:
+            functions.insert(0, ('check_alarms', type(self.app), 'check_alarms'))
+        return functions
+
+    def timed(self, name, function):
+        histogram = self.timings.setdefault(name, Histogram(DURATION_BOUNDS))
+        last = self.last
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - started
+                histogram.record(seconds)
+                last[name] = seconds
+        return timed
+
+    def track_textures(self):
+        """Учёт текстур: уже созданные находятся один раз через gc, новые - при создании"""
+        texture_class = pyglet.image.Texture
+        region_class = pyglet.image.TextureRegion
+        self.textures = weakref.WeakSet(item for item in gc.get_objects()
+                                        if isinstance(item, texture_class) and not isinstance(item, region_class))
+        original = texture_class.__dict__['create']
+        textures = self.textures
+
+        def create(cls, *args, **kwargs):
+            texture = original.__func__(cls, *args, **kwargs)
+            textures.add(texture)
+            return texture
+        texture_class.create = classmethod(create)
+        self.original_create = original
+
+    def attach(self, window):
+        """Обработчики замера кадра поверх обработчиков окна"""
+        is_main = window is self.app.main_window
+
+        def on_draw():
+            now = time.perf_counter()
+            if is_main:
+                # Кадр главного окна начинает новый проход: время прошлого уже набрано
+                if self.frame_starts:
+                    self.frame_times.append(self.pass_time)
+                self.frame_starts.append(now)
+                self.pass_time = 0.0
+            self.draw_started = now
+
+        def on_refresh(dt):
+            if self.draw_started is not None:
+                self.pass_time += time.perf_counter() - self.draw_started
+                self.draw_started = None
+            if is_main and self.overlay:
+                self.draw_panel()
+
+        window.push_handlers(on_draw=on_draw, on_refresh=on_refresh)
+        self.handlers[window] = (on_draw, on_refresh)
+
+    def refresh(self, dt=None):
+        """Подключить новые окна и обновить текст панели"""
+        for window in list(pyglet.app.windows):
+            if window not in self.handlers:
+                self.attach(window)
+        if self.overlay and self.panel is not None:
+            self.panel[1].text = self.format()
+
+    def draw_panel(self):
+        if self.panel is None:
+            background = shapes.Rectangle(8, 0, 330, 150, color=(0, 0, 0, 170))
+            label = pyglet.text.Label(self.format(), font_name="Arial", font_size=11, x=16, y=0,
+                                      width=320, multiline=True, anchor_y="bottom", color=(120, 255, 120, 255))
+            self.panel = (background, label)
+        background, label = self.panel
+        window = self.app.main_window
+        # Панель в левом верхнем углу главного окна
+        background.y = window.height - background.height - 8
+        label.y = background.y + 6
+        background.draw()
+        label.draw()
+
+    def snapshot(self):
+        """Текущие значения счётчиков"""
+        starts = self.frame_starts
+        frames = list(self.frame_times)
+        fps = (len(starts) - 1) / (starts[-1] - starts[0]) if len(starts) > 1 and starts[-1] > starts[0] else 0.0
+        textures = [texture for texture in list(self.textures) if texture.id]
+        state = {
+            'fps': round(fps, 2),
+            'frame_seconds': sum(frames) / len(frames) if frames else 0.0,
+            'frame_seconds_max': max(frames) if frames else 0.0,
+            'windows': len(pyglet.app.windows),
+            'textures': len(textures),
+            'texture_bytes': sum(texture.width * texture.height * 4 for texture in textures),  # RGBA8
+            'audio_players': int(getattr(self.app, 'alarm_player', None) is not None),
+        }
+        for name, histogram in self.timings.items():
+            state[f'{name}_seconds'] = self.last.get(name, 0.0)
+            state[f'{name}_seconds_max'] = histogram.max
+        return state
+
+    def format(self):
+        state = self.snapshot()
+        lines = [f"FPS {state['fps']:.1f}, кадр {state['frame_seconds'] * 1000:.1f} мс "
+                 f"(макс {state['frame_seconds_max'] * 1000:.1f})"]
+        for name, title in (('check_alarms', "check_alarms"), ('next_alarm', "ближайший")):
+            if name == 'check_alarms' and not self.checks_here:
+                lines.append(f"{title}: в процессе планировщика")
+            elif self.last.get(name) is None:
+                lines.append(f"{title}: не вызывался")
+            else:
+                lines.append(f"{title} {state[f'{name}_seconds'] * 1000:.2f} мс "
+                             f"(макс {state[f'{name}_seconds_max'] * 1000:.2f})")
+        lines.append(f"окон {state['windows']}, текстур {state['textures']} "
+                     f"({state['texture_bytes'] / 1048576:.1f} МБ)")
+        lines.append(f"проигрывателей звука {state['audio_players']}")
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """Счётчики в текстовом формате Prometheus (textfile для node_exporter)"""
+        lines = []
+        for name, value in self.snapshot().items():
+            if name.endswith('_seconds') and name[:-len('_seconds')] in self.timings:
+                continue  # Длительности ниже - гистограммами
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} gauge")
+            lines.append(f"{METRIC_PREFIX}{name} {value}")
+        for name, histogram in self.timings.items():
+            metric = f"{METRIC_PREFIX}{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            seen = 0
+            for bound, count in histogram.buckets():
+                seen += count
+                lines.append(f'{metric}_bucket{{le="{"+Inf" if bound == float("inf") else bound}"}} {seen}')
+            lines.append(f"{metric}_sum {histogram.total}")
+            lines.append(f"{metric}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, dt=None):
+        """Записать счётчики в файл; файл подменяется целиком, читатель не увидит его наполовину"""
+        path = self.export_path
+        if path.suffix.lower() == '.json':
+            text = json.dumps(dict(self.snapshot(), time=time.time()), ensure_ascii=False)
+        else:
+            text = self.prometheus()
+        temporary = path.with_name(path.name + ".tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temporary.write_text(text, encoding="utf-8")
+            os.replace(temporary, path)
+        except OSError as e:
+            log.error('metrics-error', "Не удалось записать счётчики в {path}: {error}", path=str(path), error=str(e))
+
+
+if __name__ == "__main__":
+    # Замер: кадры главного окна без монитора, после включения и выключения, с панелью
+    import statistics
+    import sys
+    import tempfile
+
+    if "--display" not in sys.argv:
+        pyglet.options['headless'] = True
+    import scheduler
+    import status
+    # Не трогаем res/alarms.jsonl и res/status.bin: настоящие будильники не зазвонят,
+    # а запись состояния запущенной программы не перепишется
+    directory = Path(tempfile.mkdtemp())
+    scheduler.STORE_PATH = directory / "alarms.jsonl"
+    status.STATUS_PATH = directory / "status.bin"
+    import main
+
+    FRAMES = 1000
+
+    app = main.AlarmApp()
+    window = app.main_window
+    pyglet.window.Window._enable_event_queue = False  # Вне pyglet.app.run события окна иначе копятся в очереди
+
+    def measure(title):
+        times = []
+        for _ in range(FRAMES):
+            started = time.perf_counter()
+            window.draw(1 / 60)
+            times.append((time.perf_counter() - started) * 1000)
+        times.sort()
+        print(f"{title:<28} кадр: медиана {statistics.median(times):6.2f} мс, p90 {times[int(FRAMES * 0.9)]:6.2f} мс")
+        return statistics.median(times)
+
+    measure("прогрев")
+    baseline = measure("монитор не включался")
+    started = time.perf_counter()
+    app.perf.toggle_overlay()
+    enabled_ms = (time.perf_counter() - started) * 1000
+    overlay = measure("с панелью")
+    app.check_alarms()
+    type(app.alarms)().next_enabled()  # Обёртка в классе: замеряется и хранилище, созданное после включения
+    app.perf.refresh()
+    timed = 'check_alarms' in app.perf.last and 'next_alarm' in app.perf.last
+    print(app.perf.format())
+    app.perf.toggle_overlay()
+    after = measure("после выключения")
+    hooks_left = (len(app.perf.handlers), 'check_alarms' in type(app).__dict__,
+                  type(app.alarms).next_enabled.__qualname__ != 'AlarmStore.next_enabled',
+                  'create' in pyglet.image.Texture.__dict__ and pyglet.image.Texture.create.__func__.__name__ == 'create'
+                  and pyglet.image.Texture.__dict__['create'].__func__.__qualname__.startswith('PerfMonitor'))
+    print(f"Включение (учёт уже созданных текстур через gc): {enabled_ms:.1f} мс")
+    print(f"Панель: {overlay - baseline:+.2f} мс на кадр; после выключения: {after - baseline:+.2f} мс; "
+          f"осталось обработчиков/обёрток: {sum(map(int, hooks_left))}")
+    split_app = main.SplitAlarmApp.__new__(main.SplitAlarmApp)  # Только для подписи, без планировщика
+    split_label = "check_alarms: в процессе планировщика" in PerfMonitor(split_app).format()
+    if not timed or not split_label:
+        print(f"Замеры после включения: {'есть' if timed else 'нет'}; подпись раздельного режима: "
+              f"{'есть' if split_label else 'нет'}")
+    app.shutdown()
+    sys.exit(1 if any(hooks_left) or not timed or not split_label else 0)
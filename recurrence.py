@@ -0,0 +1,409 @@
+"""Правила повторения будильников: разбор, компиляция и поиск следующего срабатывания
+
+Правило - словарь в духе RRULE, который хранится в будильнике как есть:
+    {'freq': 'hourly'|'daily'|'weekly'|'monthly'|'once',
+     'interval': N,                  # каждые N часов/дней/недель/месяцев
+     'start': 'ГГГГ-ММ-ДД',          # от какого дня отсчитывается интервал
+     'until': 'ГГГГ-ММ-ДД',          # последний день (включительно)
+     'weekdays': [0..6],             # для weekly
+     'monthdays': [15, -1],          # для monthly: числа месяца, -1 - последнее
+     'nth_weekdays': [[4, -1]],      # для monthly: [день недели, номер], -1 - последний
+     'exdates': ['ГГГГ-ММ-ДД', 'ГГГГ-ММ-ДДTЧЧ:ММ']}  # исключённые дни и моменты
+Будильники 'date' и 'weekly' компилируются в те же правила. Поле будильника
+'calendars' - имена календарей исключений (см. calendars.py), их дни тоже пропускаются.
+
+Все моменты считаются в абсолютных минутах (номер дня * 1440 + минута суток),
+поэтому следующее срабатывание ищется арифметикой по периоду и бинарным
+поиском по таблице смещений внутри периода, а не перебором дней.
+"""
+import bisect
+from datetime import date, datetime, time as dt_time, timedelta
+
+from calendars import Calendar
+
+
+MINUTES_PER_DAY = 24 * 60
+FREQS = ('once', 'hourly', 'daily', 'weekly', 'monthly')
+DEFAULT_START = date(2000, 1, 3)  # Понедельник: от него отсчитываются интервалы без start
+
+WEEKDAYS_SHORT = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+
+# Григорианский календарь повторяется каждые 400 лет: 4800 месяцев, 146097 дней.
+# Для каждого месяца цикла - смещение его первого дня от начала цикла
+CYCLE_MONTHS = 4800
+CYCLE_DAYS = 146097
+MONTH_STARTS = [date(1 + i // 12, 1 + i % 12, 1).toordinal() - 1 for i in range(CYCLE_MONTHS)]
+MONTH_STARTS.append(CYCLE_DAYS)
+
+
+def to_minutes(moment):
+    """Абсолютная минута момента (секунды отбрасываются)"""
+    return moment.toordinal() * MINUTES_PER_DAY + moment.hour * 60 + moment.minute
+
+
+def from_minutes(minutes):
+    """Момент по абсолютной минуте"""
+    day, minute = divmod(minutes, MINUTES_PER_DAY)
+    return datetime.combine(date.fromordinal(day), dt_time(minute // 60, minute % 60))
+
+
+def month_info(month_index):
+    """Номер первого дня, длина и день недели первого числа месяца
+
+    month_index - (год - 1) * 12 + (месяц - 1); берётся из таблицы цикла за O(1).
+    """
+    cycle, position = divmod(month_index, CYCLE_MONTHS)
+    first = cycle * CYCLE_DAYS + MONTH_STARTS[position] + 1
+    return first, MONTH_STARTS[position + 1] - MONTH_STARTS[position], (first - 1) % 7
+
+
+def rule_of(alarm):
+    """Правило будильника (для 'date' и 'weekly' - построенное по их полям)"""
+    if alarm['type'] == 'date':
+        rule = {'freq': 'once', 'start': alarm['date']}
+    elif alarm['type'] == 'weekly':
+        rule = {'freq': 'weekly', 'weekdays': alarm['weekdays']}
+    else:
+        return alarm['rule']
+    if alarm.get('exdates'):
+        rule['exdates'] = alarm['exdates']
+    return rule
+
+
+def compile_alarm(alarm, calendars=None):
+    """Скомпилированное правило будильника
+
+    calendars - {имя: Calendar}; календари, которых нет среди загруженных, не учитываются.
+    """
+    names = alarm.get('calendars') or ()
+    skips = [calendars[name] for name in names if calendars and name in calendars]
+    return compile_rule(rule_of(alarm), alarm['time'], skips)
+
+
+def compile_rule(rule, time_str, calendars=()):
+    """Скомпилировать правило для времени ЧЧ:ММ; ValueError при ошибке в правиле"""
+    freq = rule.get('freq')
+    if freq not in FREQS:
+        raise ValueError(f"Неизвестная частота повторения: {freq}")
+    if freq == 'monthly':
+        return MonthlyRule(rule, time_str, calendars)
+    return PeriodicRule(rule, time_str, calendars)
+
+
+def describe_rule(rule):
+    """Короткое описание правила для списка будильников"""
+    freq = rule['freq']
+    interval = rule.get('interval', 1)
+    if freq == 'once':
+        return ".".join(reversed(rule['start'].split('-')))
+    if freq == 'hourly':
+        return f"кажд. {interval} ч"
+    if freq == 'daily':
+        return "ежедневно" if interval == 1 else f"кажд. {interval} дн"
+    if freq == 'weekly':
+        days = ",".join(WEEKDAYS_SHORT[day] for day in sorted(rule.get('weekdays', ())))
+        return days if interval == 1 else f"{interval} нед: {days}"
+
+    parts = []
+    for day in rule.get('monthdays', ()):
+        parts.append("посл. число" if day == -1 else f"{day} числа")
+    for weekday, nth in rule.get('nth_weekdays', ()):
+        parts.append(f"{'посл.' if nth == -1 else f'{nth}-й'} {WEEKDAYS_SHORT[weekday]}")
+    text = ", ".join(parts)
+    return text if interval == 1 else f"{interval} мес: {text}"
+
+
+class Recurrence:
+    """Общая часть скомпилированных правил: границы и исключения
+
+    Наследники реализуют raw_next(m) - первое срабатывание в минуту >= m
+    без учёта исключений.
+    """
+    def __init__(self, rule, time_str, calendars=()):
+        self.rule = rule
+        self.minute = int(time_str[:2]) * 60 + int(time_str[3:5])
+        if not 0 <= self.minute < MINUTES_PER_DAY:
+            raise ValueError(f"Неверное время: {time_str}")
+        self.interval = int(rule.get('interval', 1))
+        if self.interval < 1:
+            raise ValueError(f"Интервал должен быть положительным: {self.interval}")
+
+        start = date.fromisoformat(rule['start']) if rule.get('start') else DEFAULT_START
+        self.start_day = start.toordinal()
+        self.first_minute = self.start_day * MINUTES_PER_DAY  # Раньше start не звонит
+        until = rule.get('until')
+        self.last_minute = ((date.fromisoformat(until).toordinal() + 1) * MINUTES_PER_DAY - 1
+                            if until else None)
+
+        # Исключённые дни собираются в такой же календарь, как праздничные:
+        # серия подряд идущих дней перепрыгивается за один бинарный поиск
+        days = []
+        self.excluded_minutes = set()
+        for item in rule.get('exdates', ()):
+            if len(item) > 10:
+                self.excluded_minutes.add(to_minutes(datetime.fromisoformat(item)))
+            else:
+                days.append(date.fromisoformat(item).toordinal())
+        self.skips = ([Calendar('exdates', days)] if days else []) + list(calendars)
+
+    def next_minute(self, minutes):
+        """Первое срабатывание в абсолютную минуту >= minutes (или None)"""
+        while True:
+            candidate = self.raw_next(max(minutes, self.first_minute))
+            if candidate is None or (self.last_minute is not None and candidate > self.last_minute):
+                return None
+            day = candidate // MINUTES_PER_DAY
+            for calendar in self.skips:
+                skipped = calendar.skipped_until(day)
+                if skipped is not None:
+                    minutes = (skipped + 1) * MINUTES_PER_DAY
+                    break
+            else:
+                if candidate not in self.excluded_minutes:
+                    return candidate
+                minutes = candidate + 1
+
+    def next_after(self, moment):
+        """Ближайшее срабатывание строго после moment (или None)"""
+        found = self.next_minute(to_minutes(moment) + 1)
+        return None if found is None else from_minutes(found)
+
+    def iter_after(self, moment):
+        """Срабатывания строго после moment по порядку"""
+        found = self.next_minute(to_minutes(moment) + 1)
+        while found is not None:
+            yield from_minutes(found)
+            found = self.next_minute(found + 1)
+
+    def between(self, start, end):
+        """Срабатывания в минутах отрезка [start, end]"""
+        fires = []
+        last = to_minutes(end)
+        found = self.next_minute(to_minutes(start))
+        while found is not None and found <= last:
+            fires.append(from_minutes(found))
+            found = self.next_minute(found + 1)
+        return fires
+
+
+class PeriodicRule(Recurrence):
+    """Правило с постоянным периодом: раз, каждые N часов, дней или недель
+
+    Срабатывания - якорь + k * период + смещение из отсортированной таблицы
+    смещений внутри периода (для недель - по одному на выбранный день).
+    """
+    def __init__(self, rule, time_str, calendars=()):
+        super().__init__(rule, time_str, calendars)
+        freq = rule['freq']
+        self.anchor = self.start_day * MINUTES_PER_DAY + self.minute
+        self.offsets = (0,)
+        if freq == 'once':
+            self.period = None
+        elif freq == 'hourly':
+            self.period = self.interval * 60
+        elif freq == 'daily':
+            self.period = self.interval * MINUTES_PER_DAY
+        else:
+            weekdays = sorted(set(rule.get('weekdays', ())))
+            if any(not 0 <= day < 7 for day in weekdays):
+                raise ValueError(f"Неверные дни недели: {weekdays}")
+            # Период начинается с понедельника недели, в которую попал start
+            monday = self.start_day - (self.start_day - 1) % 7
+            self.anchor = monday * MINUTES_PER_DAY + self.minute
+            self.period = self.interval * 7 * MINUTES_PER_DAY
+            self.offsets = tuple(day * MINUTES_PER_DAY for day in weekdays)
+
+        if freq in ('once', 'weekly') and not self.offsets:
+            self.weekdays = ()
+        elif freq == 'once' or (self.period % (7 * MINUTES_PER_DAY) == 0 and freq != 'weekly'):
+            self.weekdays = ((self.anchor // MINUTES_PER_DAY - 1) % 7,)
+        elif freq == 'weekly':
+            self.weekdays = tuple(offset // MINUTES_PER_DAY for offset in self.offsets)
+        else:
+            self.weekdays = tuple(range(7))
+
+    def raw_next(self, minutes):
+        if not self.offsets:
+            return None
+        if self.period is None:
+            return self.anchor if self.anchor >= minutes else None
+        if minutes <= self.anchor:
+            return self.anchor + self.offsets[0]
+        periods, rest = divmod(minutes - self.anchor, self.period)
+        position = bisect.bisect_left(self.offsets, rest)
+        if position == len(self.offsets):
+            periods += 1
+            position = 0
+        return self.anchor + periods * self.period + self.offsets[position]
+
+
+class MonthlyRule(Recurrence):
+    """Правило по месяцам: числа месяца и "N-й/последний день недели"
+
+    Длина месяца и день недели первого числа берутся из таблицы 400-летнего
+    цикла, поэтому поиск идёт по месяцам (обычно 1-3 шага), а не по дням.
+    """
+    def __init__(self, rule, time_str, calendars=()):
+        super().__init__(rule, time_str, calendars)
+        self.monthdays = tuple(rule.get('monthdays', ()))
+        self.nth_weekdays = tuple((int(weekday), int(nth)) for weekday, nth in rule.get('nth_weekdays', ()))
+        if any(not 1 <= abs(day) <= 31 for day in self.monthdays):
+            raise ValueError(f"Неверные числа месяца: {list(self.monthdays)}")
+        if any(not 0 <= weekday < 7 or not 1 <= abs(nth) <= 5 for weekday, nth in self.nth_weekdays):
+            raise ValueError(f"Неверные дни недели месяца: {list(self.nth_weekdays)}")
+        start = date.fromordinal(self.start_day)
+        self.anchor_month = (start.year - 1) * 12 + start.month - 1
+        if self.monthdays or not self.nth_weekdays:
+            self.weekdays = tuple(range(7))
+        else:
+            self.weekdays = tuple(sorted({weekday for weekday, _ in self.nth_weekdays}))
+
+    def month_days(self, month_index):
+        """Отсортированные дни срабатывания (номера дней) в месяце"""
+        first, length, first_weekday = month_info(month_index)
+        days = set()
+        for day in self.monthdays:
+            if day < 0:
+                day += length + 1
+            if 1 <= day <= length:
+                days.add(first + day - 1)
+        for weekday, nth in self.nth_weekdays:
+            first_match = 1 + (weekday - first_weekday) % 7
+            if nth > 0:
+                day = first_match + 7 * (nth - 1)
+            else:
+                day = first_match + 7 * ((length - first_match) // 7) + 7 * (nth + 1)
+            if 1 <= day <= length:
+                days.add(first + day - 1)
+        return sorted(days)
+
+    def raw_next(self, minutes):
+        day = minutes // MINUTES_PER_DAY
+        moment = date.fromordinal(day)
+        month_index = (moment.year - 1) * 12 + moment.month - 1
+        behind = month_index - self.anchor_month
+        if behind < 0:
+            month_index = self.anchor_month
+        elif behind % self.interval:
+            month_index += self.interval - behind % self.interval
+
+        # За полный цикл календаря подходящий месяц находится всегда, если он вообще есть
+        for _ in range(CYCLE_MONTHS // self.interval + 1):
+            for fire_day in self.month_days(month_index):
+                candidate = fire_day * MINUTES_PER_DAY + self.minute
+                if candidate >= minutes:
+                    return candidate
+            month_index += self.interval
+        return None
+
+
+def naive_next(rule, time_str, moment, horizon_days=800):
+    """Перебор по дням - медленная проверка для бенчмарка"""
+    step = 60 if rule['freq'] == 'hourly' else MINUTES_PER_DAY
+    time_minute = int(time_str[:2]) * 60 + int(time_str[3:5])
+    minutes = to_minutes(moment) + 1
+    day = minutes // MINUTES_PER_DAY
+    for current in range(day, day + horizon_days):
+        for minute in range(current * MINUTES_PER_DAY + time_minute % step,
+                            (current + 1) * MINUTES_PER_DAY, step):
+            if minute >= minutes and naive_match(rule, time_minute, minute):
+                return from_minutes(minute)
+    return None
+
+
+def naive_match(rule, time_minute, minutes):
+    """Срабатывает ли правило ровно в эту минуту - проверка прямо по определению"""
+    day, minute = divmod(minutes, MINUTES_PER_DAY)
+    moment = date.fromordinal(day)
+    start = date.fromisoformat(rule['start']) if rule.get('start') else DEFAULT_START
+    interval = rule.get('interval', 1)
+    exdates = rule.get('exdates', ())
+    if day < start.toordinal() or moment.isoformat() in exdates \
+            or from_minutes(minutes).isoformat(timespec='minutes') in exdates:
+        return False
+    if rule.get('until') and moment > date.fromisoformat(rule['until']):
+        return False
+
+    freq = rule['freq']
+    if freq == 'hourly':
+        anchor = start.toordinal() * MINUTES_PER_DAY + time_minute
+        return minutes >= anchor and (minutes - anchor) % (interval * 60) == 0
+    if minute != time_minute:
+        return False
+    if freq == 'once':
+        return moment == start
+    if freq == 'daily':
+        return (day - start.toordinal()) % interval == 0
+    if freq == 'weekly':
+        monday = start.toordinal() - start.weekday()
+        return moment.weekday() in rule['weekdays'] and (day - monday) // 7 % interval == 0
+
+    months = (moment.year - start.year) * 12 + moment.month - start.month
+    if months % interval:
+        return False
+    length = (date(moment.year + moment.month // 12, moment.month % 12 + 1, 1) - timedelta(days=1)).day
+    for monthday in rule.get('monthdays', ()):
+        if moment.day == (monthday if monthday > 0 else length + 1 + monthday):
+            return True
+    nth = (moment.day - 1) // 7 + 1
+    nth_from_end = -((length - moment.day) // 7 + 1)
+    for weekday, wanted in rule.get('nth_weekdays', ()):
+        if moment.weekday() == weekday and wanted in (nth, nth_from_end):
+            return True
+    return False
+
+
+if __name__ == "__main__":
+    # Бенчмарк: следующее срабатывание для 100 000 разнородных правил
+    import random
+    import time
+
+    random.seed(1)
+
+    def random_rule():
+        freq = random.choice(FREQS)
+        rule = {'freq': freq}
+        if freq != 'once':
+            rule['interval'] = random.choice((1, 1, 2, 3, 7))
+        rule['start'] = (date(2024, 1, 1) + timedelta(days=random.randrange(1500))).isoformat()
+        if freq == 'weekly':
+            rule['weekdays'] = random.sample(range(7), random.randint(1, 7))
+        elif freq == 'monthly':
+            if random.random() < 0.5:
+                rule['monthdays'] = random.sample([1, 10, 15, 28, 29, 30, 31, -1], random.randint(1, 2))
+            else:
+                rule['nth_weekdays'] = [[random.randrange(7), random.choice((1, 2, 3, 4, 5, -1))]]
+        if random.random() < 0.2:
+            first = date(2026, 1, 1) + timedelta(days=random.randrange(365))
+            rule['exdates'] = [(first + timedelta(days=i)).isoformat() for i in range(random.randint(1, 30))]
+        return rule
+
+    count = 100000
+    rules = [(random_rule(), f"{random.randrange(24):02d}:{random.randrange(60):02d}") for _ in range(count)]
+
+    started = time.perf_counter()
+    compiled = [compile_rule(rule, time_str) for rule, time_str in rules]
+    compile_time = time.perf_counter() - started
+
+    now = datetime(2026, 10, 19, 12, 30, 15)
+    started = time.perf_counter()
+    found = [recurrence.next_after(now) for recurrence in compiled]
+    next_time = time.perf_counter() - started
+
+    print(f"Правил: {count}")
+    print(f"Компиляция: {compile_time * 1000:.0f} мс ({compile_time / count * 1e6:.1f} мкс на правило)")
+    print(f"Следующее срабатывание: {next_time * 1000:.0f} мс ({next_time / count * 1e6:.1f} мкс на правило)")
+    print(f"Без срабатываний: {found.count(None)}")
+
+    # Сверка с перебором по дням на выборке
+    sample = random.sample(range(count), 300)
+    started = time.perf_counter()
+    errors = 0
+    for i in sample:
+        rule, time_str = rules[i]
+        expected = naive_next(rule, time_str, now)
+        if expected is not None and expected != found[i]:
+            errors += 1
+            print("Расхождение:", rule, time_str, found[i], expected)
+    naive_time = time.perf_counter() - started
+    print(f"Перебор по дням: {naive_time / len(sample) * 1e6:.0f} мкс на правило, расхождений: {errors}")
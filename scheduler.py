@@ -0,0 +1,905 @@
+"""Планировщик будильников без окон и режим с планировщиком в отдельном процессе
+
+Scheduler - проверка сроков, повторы, догон пропущенных и звонящие будильники.
+pyglet он не импортирует: окна и звук добавляет наследник (AlarmApp в main.py)
+через start_ring и stop_sound.
+
+В раздельном режиме (python main.py --split) планировщик работает в дочернем
+процессе SchedulerProcess и сам запускает звук, поэтому долгое создание окна,
+загрузка картинки или подвисание интерфейса не задерживают срабатывания.
+Окно узнаёт состояние из двух каналов:
+    снимок  - файл в общей памяти (mmap) с версией по схеме seqlock: планировщик
+              переписывает его при изменении звонков, окно читает без блокировок;
+    события - датаграммы JSON через socketpair: fired/stopped от планировщика,
+              ack/stop/reload/settings/quit от окна.
+Будильники оба процесса берут из res/alarms.jsonl, но пишет файл только окно:
+оно сохраняет правки и присылает reload, а планировщик присылает ему свои
+изменения (alarms: last_triggered и выключение отзвонивших будильников по дате).
+
+python scheduler.py - проверка: окно (этот процесс) блокируется, а задержка
+срабатываний в дочернем процессе остаётся в пределах секунды.
+"""
+import argparse
+import json
+import mmap
+import os
+import select
+import signal
+import socket
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from alarm_io import STORE_PATH, alarm_from_record, load_store, save_store
+from alarm_store import AlarmStore
+from calendars import load_calendars
+from events import EventBus
+from hooks import HookRunner
+from journal import LOG_PATH, log
+from stats import Histogram
+from timing_wheel import TimingWheel
+
+
+SNAPSHOT_SIZE = 1 << 20  # Байт под снимок; столько звонящих будильников не бывает
+SNAPSHOT_ROWS = 5000  # Больше строк звонящих в снимок не пишется
+OUTBOX_LIMIT = 1000  # Неотправленных событий, пока окно не читает
+CHANGES_PER_MESSAGE = 500  # Изменённых будильников в одной датаграмме alarms
+DATAGRAM_SIZE = 65536
+
+
+class Scheduler:
+    """Будильники, их сроки и звонки - всё, кроме окон и звука"""
+    claims_fires = True  # Сам звонит и с общей базой забирает звонки пропавших экземпляров
+    def __init__(self):
+        self.alarms = AlarmStore()  # Будильники по id с индексами сортировки и поиска
+        self.current_sound_path = "res/alarm.wav"
+        # Звонящие сейчас будильники: id -> {'is_repeat', 'repeats_left', 'start_time'}
+        self.ringing = {}
+        self.ring_version = 0  # Меняется при изменении ringing, окно по нему обновляется
+        # Отложенные повторы всех будильников: id -> оставшиеся после него повторы
+        self.snoozes = TimingWheel(datetime.now().timestamp())
+
+        # Догон пропущенных срабатываний после зависаний, сна и перевода часов
+        self.catchup_grace_minutes = 10  # Опоздавшие больше - не звонят, только сообщаются
+        self.missed_lookback = timedelta(days=7)  # Дальше в прошлое не заглядываем
+        self.last_tick = None  # (стенное время, монотонное время) прошлой проверки
+        self.fire_latency = Histogram()  # Насколько позже назначенного звонили будильники
+        # Подписчики на срабатывания и остановки (events.py); пока шина не запущена
+        # или подписчиков нет, публикация ничего не стоит
+        self.events = EventBus()
+        # Действия будильников (hooks.py) на пуле потоков; итоги забирает hooks.pump()
+        self.hooks = HookRunner(self.events)
+
+        # Будильники сохраняются в файл; его же меняет командная строка cli.py
+        self.store_path = STORE_PATH
+        self.store_stamp = None  # (время изменения, размер) файла при последнем чтении или записи
+        self.saved_version = None  # Версия хранилища, записанная в файл
+        self.shared = None  # Общая база нескольких экземпляров (shared_store.py) вместо файла
+        self.status = None  # Запись состояния для виджетов в mmap (status.py)
+        self.status_key = None  # (версия хранилища, ring_version) последней записи состояния
+
+    def load_calendars(self):
+        """Загрузить календари праздников и отпусков из res/calendars"""
+        started = time.perf_counter()
+        calendars, errors = load_calendars(Path("res") / "calendars")
+        self.alarms.set_calendars(calendars)
+        for error in errors:
+            log.warning('calendar-error', "Ошибка в календаре: {error}", error=str(error))
+        if calendars:
+            days = sum(len(calendar) for calendar in calendars.values())
+            log.info('calendars-loaded', "Календари: {names} ({days} дней) за {ms:.1f} мс",
+                     names=', '.join(calendars), days=days, ms=(time.perf_counter() - started) * 1000)
+
+    def file_stamp(self):
+        try:
+            stat = os.stat(self.store_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def open_shared(self, path, lease_seconds=None):
+        """Работать с общей базой будильников вместо файла; пустая база заполняется из файла"""
+        from shared_store import LEASE_SECONDS, SharedStore
+        self.shared = SharedStore(path, lease_seconds or LEASE_SECONDS)
+        if self.shared.is_empty() and Path(self.store_path).exists():
+            store = AlarmStore()
+            load_store(store, self.store_path)
+            if len(store) and self.shared.seed(store):
+                log.info('shared-seeded', "Общая база {path} заполнена из {source}: {count}",
+                         path=str(path), source=str(self.store_path), count=len(store))
+
+    def open_status(self, path=None):
+        """Публиковать состояние в res/status.bin - делает процесс, который звонит"""
+        from status import STATUS_PATH, StatusWriter
+        try:
+            self.status = StatusWriter(path or STATUS_PATH)
+        except OSError as e:
+            log.error('status-error', "Не удалось открыть файл состояния: {error}", error=str(e))
+            return
+        self.publish_status()
+
+    def publish_status(self):
+        """Переписать запись состояния, если будильники или звонки изменились"""
+        if self.status is None:
+            return
+        key = (self.alarms.version, self.ring_version)
+        if key == self.status_key:
+            return
+        self.status_key = key
+        alarm, next_time = self.alarms.next_enabled()
+        self.status.update(next_time, alarm and alarm['id'], alarm.get('label', '') if alarm else '',
+                           len(self.ringing), self.alarms.enabled_bits.to_int().bit_count(), len(self.alarms))
+
+    def close_status(self):
+        if self.status is not None:
+            self.status.close()
+            self.status = None
+
+    def load_alarms(self):
+        """(Пере)загрузить будильники из файла или общей базы"""
+        # Когда будильник звонил, в файле может ещё не быть: иначе он зазвонит второй раз
+        last_triggered = {alarm['id']: alarm['last_triggered'] for alarm in self.alarms
+                          if alarm.get('last_triggered')}
+        self.alarms.clear()
+        if self.shared is not None:
+            self.shared.load(self.alarms)
+        else:
+            report = load_store(self.alarms, self.store_path)
+            if report.error_count:
+                log.warning('store-errors', "{report}", report=report.format(), errors=report.error_count)
+        for alarm_id, moment in last_triggered.items():
+            alarm = self.alarms.get(alarm_id)
+            if alarm is not None and (alarm['last_triggered'] is None or alarm['last_triggered'] < moment):
+                alarm['last_triggered'] = moment
+        self.saved_version = self.alarms.version
+        self.store_stamp = self.file_stamp()
+        self.forget_missing()
+
+    def forget_missing(self):
+        """Звонки и повторы будильников, которых в файле больше нет, не ждём"""
+        for alarm_id in list(self.snoozes.cell_of):
+            if alarm_id not in self.alarms:
+                self.snoozes.cancel(alarm_id)
+        gone = [alarm_id for alarm_id in self.ringing if alarm_id not in self.alarms]
+        for alarm_id in gone:
+            del self.ringing[alarm_id]
+        if gone:
+            self.ring_version += 1
+            if not self.ringing:
+                self.stop_sound()
+
+    def save_alarms(self):
+        """Записать будильники в файл (или свои правки в общую базу)"""
+        if self.shared is not None:
+            try:
+                self.shared.sync(self.alarms, self.alarms.version != self.saved_version)
+            except sqlite3.Error as e:
+                log.error('shared-error', "Общая база недоступна: {error}", error=str(e))
+                return
+            self.saved_version = self.alarms.version
+            return
+        try:
+            save_store(self.alarms, self.store_path)
+        except OSError as e:
+            log.error('save-error', "Не удалось сохранить будильники: {error}", error=str(e))
+            return
+        self.saved_version = self.alarms.version
+        self.store_stamp = self.file_stamp()
+
+    def sync_store(self):
+        """Подхватить изменения файла из командной строки или сохранить свои
+
+        Возвращает True, если свои изменения записаны в файл.
+        """
+        if self.shared is not None:
+            return self.sync_shared()
+        if self.file_stamp() != self.store_stamp:
+            self.load_alarms()
+            log.info('store-reloaded', "Будильники перечитаны из {path}", path=str(self.store_path))
+        elif self.alarms.version != self.saved_version:
+            self.save_alarms()
+            return True
+        return False
+
+    def sync_shared(self):
+        """Обменяться правками с другими экземплярами, продлить аренду своих звонков
+        и забрать звонки пропавших экземпляров"""
+        wrote = self.alarms.version != self.saved_version
+        try:
+            changed = self.shared.sync(self.alarms, wrote)
+            orphans = []
+            if self.claims_fires:
+                orphans = self.shared.renew(datetime.now() - timedelta(minutes=self.catchup_grace_minutes))
+        except sqlite3.Error as e:
+            log.error('shared-error', "Общая база недоступна: {error}", error=str(e))
+            return False
+        self.saved_version = self.alarms.version
+        if changed:
+            log.info('shared-changed', "Будильники изменены другими экземплярами: {count}",
+                     alarm_ids=list(changed), count=len(changed))
+            self.forget_missing()
+        orphans = [item for item in orphans if item[0] in self.alarms and item[0] not in self.ringing]
+        if orphans:
+            log.warning('shared-orphans', "Забираем звонки пропавших экземпляров: {count}",
+                        alarm_ids=[item[0] for item in orphans], count=len(orphans))
+            self.trigger_alarms(orphans, datetime.now())
+        return wrote
+
+    def delete_alarm(self, alarm_id):
+        """Удаление будильника по id"""
+        alarm = self.alarms.remove(alarm_id)
+        if alarm is None:
+            return
+        log.info('deleted', "Будильник {alarm_id} удален", alarm_id=alarm_id)
+
+        # Удалили звонящий или ожидающий повтора будильник - дальше его не ждём
+        self.snoozes.cancel(alarm_id)
+        if self.ringing.pop(alarm_id, None) is not None:
+            self.ring_version += 1
+            if not self.ringing:
+                self.stop_sound()
+
+    def clear_alarms(self):
+        """Удаление всех будильников вместе с ожидающими повторами"""
+        self.stop_alarm()
+        self.snoozes.clear()
+        self.alarms.clear()
+
+    def schedule_repeat(self, alarm_id, repeats_left, now):
+        """Поставить повтор будильника в колесо таймеров"""
+        alarm = self.alarms[alarm_id]
+        minutes = alarm.get('snooze_minutes', 5)
+        at = now + timedelta(minutes=minutes)
+        self.snoozes.schedule(alarm_id, at.timestamp(), repeats_left)
+        self.events.publish('repeat-scheduled', id=alarm_id, at=at.isoformat(timespec='seconds'),
+                            repeats_left=repeats_left)
+
+    def trigger_alarm(self, alarm_id, is_repeat=False, repeats_left=None):
+        """Срабатывание одного будильника"""
+        now = datetime.now()
+        self.trigger_alarms([(alarm_id, is_repeat, repeats_left, now)], now)
+
+    def trigger_alarms(self, due, now):
+        """Срабатывание пачки будильников: одно окно и один звук на всех
+
+        due - [(id, повтор ли, оставшиеся повторы или None, назначенный момент)].
+        Действия будильников ставятся в очередь только после запуска звука.
+        С общей базой звонят только срабатывания, аренду которых получил этот экземпляр.
+        """
+        if self.shared is not None:
+            try:
+                due = self.shared.claim(due)
+            except sqlite3.Error as e:
+                log.error('shared-error', "Общая база недоступна, звоним без аренды: {error}", error=str(e))
+            if not due:
+                return
+        actions = []
+        for alarm_id, is_repeat, repeats_left, fire_time in due:
+            alarm = self.alarms.get(alarm_id)
+            if alarm is None:
+                continue
+            if repeats_left is None:
+                repeats_left = alarm.get('snooze_count', 1) if alarm.get('repeat_5min') else 0
+            late = max(0.0, (now - fire_time).total_seconds())
+            self.fire_latency.record(late)
+            self.ringing[alarm_id] = {
+                'is_repeat': is_repeat,
+                'repeats_left': repeats_left,
+                'start_time': now,
+                'late': late,
+                'fire_time': fire_time
+            }
+            self.events.publish('repeat-fired' if is_repeat else 'fired', id=alarm_id,
+                                label=alarm.get('label', ''), time=alarm['time'],
+                                fire_time=fire_time.isoformat(timespec='minutes'),
+                                late=round(late, 1), repeats_left=repeats_left)
+            if alarm.get('hooks'):
+                actions.append((alarm, is_repeat, fire_time, late))
+        self.ring_version += 1
+        log.info('fired', "СРАБОТАЛО БУДИЛЬНИКОВ: {count}, звонят: {ringing}",
+                 alarm_ids=[item[0] for item in due], fire_times=[item[3] for item in due],
+                 count=len(due), ringing=len(self.ringing))
+        self.start_ring(due)
+        for alarm, is_repeat, fire_time, late in actions:
+            self.hooks.submit(alarm['hooks'], {
+                'id': alarm['id'], 'label': alarm.get('label', ''), 'time': alarm['time'],
+                'fire_time': fire_time.isoformat(timespec='minutes'),
+                'late': round(late, 1), 'repeat': int(is_repeat)})
+
+    def start_ring(self, due):
+        """Показать звонок и включить звук - дело наследника"""
+
+    def finish_ring(self, alarm_id, now, event='stopped'):
+        """Звонок будильника закончен: поставить следующий повтор или завершить будильник
+
+        event - 'stopped' (остановил пользователь) или 'auto-stopped' (автостоп).
+        """
+        ring = self.ringing.pop(alarm_id, None)
+        if ring is None:
+            return
+        self.ring_version += 1
+        self.events.publish(event, id=alarm_id)
+        if self.shared is not None and 'fire_time' in ring:
+            try:
+                self.shared.release(alarm_id, ring['fire_time'])
+            except sqlite3.Error as e:
+                log.error('shared-error', "Общая база недоступна: {error}", alarm_id=alarm_id, error=str(e))
+
+        alarm = self.alarms.get(alarm_id)
+        if alarm is not None:
+            if ring['repeats_left'] > 0:
+                # Повторы ещё остались - ждём следующий
+                self.schedule_repeat(alarm_id, ring['repeats_left'] - 1, now)
+            elif ring['is_repeat'] and alarm['type'] == 'date':
+                # Для будильника по дате после последнего повтора - отключаем полностью
+                self.disable_alarm(alarm_id)
+
+        if not self.ringing:
+            self.stop_sound()
+        self.publish_status()
+
+    def disable_alarm(self, alarm_id):
+        """Будильник по дате отзвонил все повторы и больше не нужен"""
+        self.alarms.set_enabled(alarm_id, False)
+
+    def mark_triggered(self, alarm, moment):
+        """Запомнить срабатывание, чтобы оно не зазвонило второй раз"""
+        alarm['last_triggered'] = moment
+
+    def stop_sound(self):
+        """Звонить больше некому: выключить звук и закрыть окно - дело наследника"""
+
+    def acknowledge(self, alarm_id):
+        """Подтверждение одного звонящего будильника"""
+        log.info('stopped', "Будильник {alarm_id} остановлен", alarm_id=alarm_id)
+        self.finish_ring(alarm_id, datetime.now())
+
+    def stop_alarm(self):
+        """Остановка всех звонящих будильников"""
+        if self.ringing:
+            log.info('stopped-all', "Будильники остановлены: {count}",
+                     alarm_ids=list(self.ringing), count=len(self.ringing))
+            now = datetime.now()
+            for alarm_id in list(self.ringing):
+                self.finish_ring(alarm_id, now)
+        self.stop_sound()
+
+    def collect_due(self, fired, now, covered=None):
+        """Будильники, срок которых наступил с прошлой проверки
+
+        fired - [(момент, будильник)] из AlarmStore.refresh: индекс ближайших
+        срабатываний отдаёт только наступившие, полный список не перебирается.
+        Срабатывания из отрезка covered (начало, конец) уже разобрал collect_missed.
+        """
+        due = []
+        for fire_time, alarm in fired:
+            if covered and covered[0] <= fire_time < covered[1]:
+                continue
+            alarm_id = alarm['id']
+            # Не трогаем будильники, которые звонят или ждут повтора
+            if alarm_id in self.ringing or alarm_id in self.snoozes:
+                continue
+
+            # Это срабатывание уже звонило (например, будильник выключили и включили)
+            last_triggered = alarm.get('last_triggered')
+            if last_triggered and last_triggered >= fire_time:
+                continue
+
+            self.mark_triggered(alarm, now)
+            due.append((alarm_id, False, None, fire_time))
+
+        return due
+
+    def collect_repeats(self, now):
+        """Повторы, срок которых подошёл: колесо таймеров отдаёт только их"""
+        due = []
+        grace = self.catchup_grace_minutes * 60
+        for alarm_id, repeats_left, deadline in self.snoozes.advance(now.timestamp()):
+            if alarm_id not in self.alarms:
+                continue
+            if now.timestamp() - deadline > max(grace, 60):
+                log.warning('repeat-missed', "Пропущен повтор будильника {alarm_id} ({time})",
+                            alarm_id=alarm_id, time=self.alarms[alarm_id]['time'], deadline=deadline)
+                continue
+            due.append((alarm_id, True, repeats_left, datetime.fromtimestamp(deadline)))
+        return due
+
+    def check_clock(self, now):
+        """Сравнить шаг стенных и монотонных часов с прошлой проверки
+
+        Возвращает момент прошлой проверки, если с тех пор прошли целые минуты
+        (зависание, сон, перевод часов вперёд), иначе None.
+        """
+        mono = time.monotonic()
+        last_tick, self.last_tick = self.last_tick, (now, mono)
+        if last_tick is None:
+            return None
+        last_wall, last_mono = last_tick
+        wall_step = (now - last_wall).total_seconds()
+        mono_step = mono - last_mono
+
+        if wall_step < -5:
+            # Часы перевели назад: отложенные повторы отсчитываются от нового времени
+            log.warning('clock-back', "Часы переведены назад на {seconds:.0f} с", seconds=-wall_step)
+            self.snoozes.rebase(now.timestamp(), wall_step)
+            return None
+        if wall_step - mono_step > 5:
+            log.warning('clock-jump', "Часы ушли вперёд на {seconds:.0f} с (сон или перевод часов)",
+                        seconds=wall_step - mono_step)
+        elif mono_step > 5:
+            log.warning('check-stalled', "Проверка будильников стояла {seconds:.0f} с", seconds=mono_step)
+
+        if (now.replace(second=0, microsecond=0) - last_wall.replace(second=0, microsecond=0)
+                > timedelta(minutes=1)):
+            return last_wall
+        return None
+
+    def collect_missed(self, first, last, now):
+        """Будильники, чьи минуты [first, last] целиком пришлись на разрыв между проверками
+
+        Опоздавшие не больше чем на catchup_grace_minutes звонят одной пачкой,
+        остальные только перечисляются в консоли.
+        """
+        grace = timedelta(minutes=self.catchup_grace_minutes)
+
+        due = {}
+        missed = []
+        for fire_time, alarm in self.alarms.fires_between(first, last):
+            alarm_id = alarm['id']
+            if alarm_id in self.ringing or alarm_id in self.snoozes:
+                continue
+            last_triggered = alarm.get('last_triggered')
+            if last_triggered and last_triggered >= fire_time:
+                continue
+            # Отмечаем момент пропущенного срабатывания, а не текущий
+            self.mark_triggered(alarm, fire_time)
+            if now - fire_time <= grace:
+                due[alarm_id] = (alarm_id, False, None, fire_time)
+            else:
+                missed.append((fire_time, alarm))
+
+        if missed:
+            lines = [f"  {fire_time:%d.%m.%Y %H:%M} {alarm.get('label', '')}".rstrip()
+                     for fire_time, alarm in missed[:20]]
+            if len(missed) > 20:
+                lines.append(f"  ... и ещё {len(missed) - 20}")
+            log.warning('missed', "Пропущено будильников: {count}\n{lines}", count=len(missed),
+                        alarm_ids=[alarm['id'] for _, alarm in missed], lines="\n".join(lines))
+        if due:
+            log.info('catch-up', "Догоняем пропущенные будильники: {count}",
+                     alarm_ids=list(due), count=len(due))
+        return list(due.values())
+
+    def check_alarms(self):
+        """Проверка срабатывания будильников"""
+        now = datetime.now()
+
+        # Автостоп основных звонков через 1 минуту (повторы звонят до остановки)
+        # ringing упорядочен по start_time, поэтому проход останавливается на первом свежем
+        auto_stopped = []
+        for alarm_id, ring in self.ringing.items():
+            if now - ring['start_time'] < timedelta(minutes=1):
+                break
+            if not ring['is_repeat']:
+                auto_stopped.append(alarm_id)
+        if auto_stopped:
+            log.info('auto-stopped', "Основные будильники остановлены (автостоп через 1 минуту): {count}",
+                     alarm_ids=auto_stopped, count=len(auto_stopped))
+            for alarm_id in auto_stopped:
+                self.finish_ring(alarm_id, now, 'auto-stopped')
+
+        # Сначала повторы: будильник, ждущий повтора, не считается пропущенным
+        last_wall = self.check_clock(now)
+        fired = self.alarms.refresh(now)
+        due = self.collect_repeats(now)
+        covered = None
+        if last_wall:
+            first = last_wall.replace(second=0, microsecond=0) + timedelta(minutes=1)
+            first = max(first, now - self.missed_lookback)
+            current_minute = now.replace(second=0, microsecond=0)
+            due += self.collect_missed(first, current_minute - timedelta(minutes=1), now)
+            covered = (first, current_minute)
+        due += self.collect_due(fired, now, covered)
+        if due:
+            self.trigger_alarms(due, now)
+        self.publish_status()
+
+
+class Snapshot:
+    """Снимок состояния в разделяемом mmap с версией по схеме seqlock
+
+    Заголовок - (версия, длина), дальше JSON. Писатель делает версию нечётной,
+    пишет данные и делает её чётной; читатель повторяет чтение, если версия
+    нечётная или изменилась, пока он копировал данные. Блокировок нет, и
+    подвисший читатель писателя не задерживает.
+    """
+    HEADER = struct.Struct('<QI')
+    SEQ = struct.Struct('<Q')
+    LENGTH = struct.Struct('<I')
+
+    def __init__(self, fileno, size=SNAPSHOT_SIZE):
+        self.map = mmap.mmap(fileno, size)
+        self.size = size
+        self.seq = self.HEADER.unpack_from(self.map, 0)[0]
+
+    def write(self, state):
+        payload = json.dumps(state, ensure_ascii=False, separators=(',', ':')).encode()
+        if self.HEADER.size + len(payload) > self.size:
+            raise ValueError(f"снимок {len(payload)} байт не помещается в {self.size}")
+        self.write_seq(self.seq + 1)
+        self.map[self.HEADER.size:self.HEADER.size + len(payload)] = payload
+        self.LENGTH.pack_into(self.map, self.SEQ.size, len(payload))
+        self.seq += 2
+        self.write_seq(self.seq)
+
+    def write_seq(self, seq):
+        # pack_into сперва обнуляет свои байты и пишет по байту: посреди записи читатель
+        # застал бы чётную версию с нулевой длиной. Срез mmap копируется одним memcpy
+        self.map[0:self.SEQ.size] = self.SEQ.pack(seq)
+
+    def read(self, known_seq=None, attempts=100):
+        """(версия, состояние); состояние None, если версия равна known_seq или снимка ещё нет"""
+        for _ in range(attempts):
+            seq, length = self.HEADER.unpack_from(self.map, 0)
+            if seq & 1:
+                continue
+            if seq == known_seq or seq == 0:
+                return seq, None
+            payload = self.map[self.HEADER.size:self.HEADER.size + length]
+            if self.HEADER.unpack_from(self.map, 0)[0] == seq:
+                return seq, json.loads(payload)
+        return known_seq, None
+
+    def close(self):
+        self.map.close()
+
+
+def send_message(sock, message):
+    """Отправить событие датаграммой; False, если буфер полон (читатель занят)"""
+    try:
+        sock.send(json.dumps(message, ensure_ascii=False).encode())
+    except BlockingIOError:
+        return False
+    return True
+
+
+def receive_messages(sock):
+    """Все накопившиеся датаграммы без ожидания"""
+    messages = []
+    while True:
+        try:
+            data = sock.recv(DATAGRAM_SIZE)
+        except BlockingIOError:
+            return messages
+        messages.append(json.loads(data))
+
+
+class SchedulerProcess(Scheduler):
+    """Планировщик в дочернем процессе: проверяет сроки и сам запускает звук
+
+    Файл будильников он только читает: свои изменения отправляет окну, а то
+    записывает их вместе со своими правками. Два писателя одного файла стирали
+    бы несохранённые изменения друг друга при перечитывании.
+    """
+    def __init__(self, sock, snapshot, store_path, parent_pid, shared_path=None):
+        super().__init__()
+        self.sock = sock
+        self.snapshot = snapshot
+        self.store_path = Path(store_path)
+        if shared_path:
+            self.open_shared(shared_path)
+        self.parent_pid = parent_pid
+        self.outbox = deque(maxlen=OUTBOX_LIMIT)  # События, которые окно ещё не смогло принять
+        self.changes = {}  # id -> изменённые поля будильника, ещё не отправленные окну
+        self.fires = 0  # Сколько раз начинался звонок; по нему окно узнаёт о новых
+        self.published = None  # ring_version последнего снимка
+        self.player = None
+        self.sound = None  # (путь, заранее декодированный звук)
+        self.running = True
+
+        self.events.start()
+        self.load_calendars()
+        self.load_alarms()
+        self.open_status()
+        self.publish_state()
+
+    def load_sound(self):
+        """Декодировать звук заранее, чтобы при срабатывании только запустить его"""
+        if self.sound and self.sound[0] == self.current_sound_path:
+            return self.sound[1]
+        self.sound = (self.current_sound_path, None)
+        if not os.path.exists(self.current_sound_path):
+            log.error('sound-missing', "Звуковой файл не найден: {path}", path=self.current_sound_path)
+            return None
+        try:
+            import pyglet
+            pyglet.options['shadow_window'] = False  # Окон у планировщика нет
+            import pyglet.media
+            self.sound = (self.current_sound_path, pyglet.media.load(self.current_sound_path, streaming=False))
+        except Exception as e:
+            log.error('sound-error', "Ошибка загрузки звука: {error}", error=str(e))
+        return self.sound[1]
+
+    def start_ring(self, due):
+        if self.player is None:
+            sound = self.load_sound()
+            if sound is not None:
+                try:
+                    import pyglet.media
+                    self.player = pyglet.media.Player()
+                    self.player.queue(sound)
+                    self.player.loop = True
+                    self.player.play()
+                except Exception as e:
+                    log.error('sound-error', "Ошибка воспроизведения звука: {error}", error=str(e))
+        self.fires += 1
+        self.publish_state()
+        self.send('fired', ids=[alarm_id for alarm_id, *_ in due])
+
+    def stop_sound(self):
+        if self.player is not None:
+            self.player.pause()
+            self.player = None
+        self.publish_state()
+        self.send('stopped')
+
+    def disable_alarm(self, alarm_id):
+        super().disable_alarm(alarm_id)
+        if self.shared is None:
+            self.changes.setdefault(alarm_id, {})['enabled'] = False
+
+    def mark_triggered(self, alarm, moment):
+        super().mark_triggered(alarm, moment)
+        if self.shared is None:
+            self.changes.setdefault(alarm['id'], {})['last_triggered'] = moment.isoformat()
+
+    def save_alarms(self):
+        """С общей базой - как у всех экземпляров, иначе файл пишет окно: ему - изменения"""
+        if self.shared is not None:
+            super().save_alarms()
+            return
+        self.send_changes()
+        self.saved_version = self.alarms.version
+
+    def send_changes(self):
+        if not self.changes:
+            return
+        changes = [dict(fields, id=alarm_id) for alarm_id, fields in self.changes.items()]
+        self.changes.clear()
+        for position in range(0, len(changes), CHANGES_PER_MESSAGE):
+            self.send('alarms', changes=changes[position:position + CHANGES_PER_MESSAGE])
+
+    def send(self, event, **fields):
+        """Событие окну; пока окно не читает, события ждут в outbox"""
+        self.outbox.append(dict(fields, type=event))
+        self.send_pending()
+
+    def publish_state(self):
+        """Переписать снимок, если звонки изменились"""
+        if self.published == (self.ring_version, self.fires):
+            return
+        self.published = (self.ring_version, self.fires)
+        rows = [[alarm_id, ring['is_repeat'], ring['repeats_left'], ring['start_time'].timestamp(),
+                 round(ring['late'], 3)]
+                for alarm_id, ring in list(self.ringing.items())[:SNAPSHOT_ROWS]]
+        self.snapshot.write({'ring_version': self.ring_version, 'fires': self.fires,
+                             'ringing': rows, 'snoozes': len(self.snoozes)})
+
+    def handle(self, message):
+        command = message.get('type')
+        if command == 'ack':
+            self.acknowledge(message['id'])
+        elif command == 'stop':
+            self.stop_alarm()
+        elif command == 'reload':
+            self.sync_store()
+        elif command == 'settings':
+            self.catchup_grace_minutes = message['catchup_grace_minutes']
+            self.current_sound_path = message['sound']
+            self.load_sound()
+        elif command == 'quit':
+            self.running = False
+
+    def serve(self):
+        """Проверка сроков в начале каждой секунды, между ними - команды окна"""
+        next_check = time.time()
+        while self.running:
+            timeout = next_check - time.time()
+            if timeout > 0:
+                ready, _, _ = select.select([self.sock], [], [], timeout)
+                if ready:
+                    for message in receive_messages(self.sock):
+                        self.handle(message)
+            if time.time() >= next_check:
+                self.sync_store()
+                self.check_alarms()
+                next_check = int(time.time()) + 1
+                if os.getppid() != self.parent_pid:
+                    log.warning('orphaned', "Окно программы закрылось - планировщик завершается")
+                    self.running = False
+            if self.player is not None:
+                # Сообщения проигрывателя (повтор звука по кругу) идут через цикл событий pyglet
+                import pyglet.app
+                pyglet.app.platform_event_loop.dispatch_posted_events()
+            self.hooks.pump()
+            self.send_changes()
+            self.send_pending()
+            self.publish_state()
+
+        self.stop_sound()
+        self.sync_store()
+        self.close_status()
+        self.hooks.stop()
+        self.events.stop()
+        if self.fire_latency.count:
+            log.info('latency', "Задержка срабатывания будильников (планировщик):\n{report}",
+                     report=self.fire_latency.format(), count=self.fire_latency.count)
+
+    def send_pending(self):
+        while self.outbox and send_message(self.sock, self.outbox[0]):
+            self.outbox.popleft()
+
+
+class SchedulerLink:
+    """Сторона окна: запуск процесса планировщика, его снимок и события"""
+    def __init__(self, store_path, shared_path=None):
+        self.sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.file = tempfile.TemporaryFile()
+        self.file.truncate(SNAPSHOT_SIZE)
+        self.snapshot = Snapshot(self.file.fileno())
+        self.seq = None
+        self.process = subprocess.Popen(
+            [sys.executable, str(Path(__file__).resolve()), "--serve",
+             "--socket", str(child_sock.fileno()), "--snapshot", str(self.file.fileno()),
+             "--store", str(store_path), "--parent", str(os.getpid())]
+            + (["--shared", str(shared_path)] if shared_path else []),
+            pass_fds=(child_sock.fileno(), self.file.fileno()))
+        child_sock.close()
+
+    def state(self):
+        """Новое состояние планировщика или None, если снимок не менялся"""
+        self.seq, state = self.snapshot.read(self.seq)
+        return state
+
+    def events(self):
+        return receive_messages(self.sock)
+
+    def send(self, command, **fields):
+        try:
+            sent = send_message(self.sock, dict(fields, type=command))
+        except OSError as e:
+            sent = False
+            log.error('scheduler-error', "Планировщик не отвечает: {error}", error=str(e))
+        return sent
+
+    def stop(self, timeout=5):
+        """Завершить планировщик; возвращает события, присланные им напоследок"""
+        self.send('quit')
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            log.error('scheduler-killed', "Планировщик не завершился - остановлен принудительно")
+            self.process.kill()
+        events = self.events()
+        self.sock.close()
+        self.snapshot.close()
+        self.file.close()
+        return events
+
+
+def serve_main(args):
+    """Точка входа дочернего процесса"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C получает окно и присылает quit
+    sock = socket.socket(fileno=args.socket)
+    sock.setblocking(False)
+    log.open_file(LOG_PATH.with_name("scheduler.log"))  # Свой файл: ротацию ведёт один процесс
+    SchedulerProcess(sock, Snapshot(args.snapshot), args.store, args.parent, args.shared).serve()
+
+
+LATENCY_BOUND = 1.0  # Допустимая задержка срабатывания в раздельном режиме, с
+CHECK_ALARMS = 200  # Будильников на каждую из двух проверяемых минут
+BLOCK_AFTER = 5  # Сколько секунд после срабатывания окно ещё заблокировано
+
+
+def block_window(how, until):
+    """Изображаем зависшее окно: спит (ждёт диск, декодер) или занимает процессор"""
+    if how == 'sleep':
+        time.sleep(max(0.0, until - time.time()))
+        return
+    while time.time() < until:
+        sum(range(10000))
+
+
+def latency_check():
+    """Окно блокируется вокруг срабатывания; задержка планировщика не должна вырасти
+
+    Заодно проверяется, что файл будильников планировщик не пишет, а
+    last_triggered сработавших присылает окну.
+    """
+    directory = Path(tempfile.mkdtemp())
+    store_path = directory / "alarms.jsonl"
+    start = datetime.now().replace(second=0, microsecond=0) + timedelta(minutes=1)
+    minutes = [start, start + timedelta(minutes=1)]
+    store = AlarmStore()
+    for minute in minutes:
+        for i in range(CHECK_ALARMS):
+            store.add(alarm_from_record({'time': f"{minute:%H:%M}", 'weekdays': "0,1,2,3,4,5,6",
+                                         'label': f"проверка {i}"}))
+    save_store(store, store_path)
+    stamp = store_path.stat().st_mtime_ns
+
+    # Так же работает одиночный режим: проверка идёт в цикле окна
+    inline = Scheduler()
+    inline.store_path = store_path
+    inline.load_alarms()
+    inline.check_alarms()
+
+    link = SchedulerLink(store_path)
+    link.send('settings', catchup_grace_minutes=10, sound=str(Path(__file__).resolve().parent / "res" / "tututu.wav"))
+    deadline = time.time() + 10
+    while link.state() is None and time.time() < deadline:
+        time.sleep(0.01)
+    print(f"Будильников: {len(store)}, срабатывания в {minutes[0]:%H:%M} и {minutes[1]:%H:%M}")
+
+    failed = False
+    triggered = set()  # id, чьё срабатывание планировщик прислал окну
+
+    def collect_changes(events):
+        for event in events:
+            if event['type'] == 'alarms':
+                triggered.update(change['id'] for change in event['changes'] if change.get('last_triggered'))
+        return events
+
+    for minute, how in zip(minutes, ('sleep', 'busy')):
+        until = minute.timestamp() + BLOCK_AFTER
+        print(f"Окно заблокировано ({how}) до {datetime.fromtimestamp(until):%H:%M:%S}")
+        block_window(how, until)
+
+        inline.check_alarms()
+        inline_late = max(ring['late'] for ring in inline.ringing.values())
+        inline.stop_alarm()
+
+        events = collect_changes(link.events())
+        state = link.state()
+        late = [row[4] for row in state['ringing']] if state else []
+        fired = [event for event in events if event['type'] == 'fired']
+        split_late = max(late) if late else float('inf')
+        print(f"  в одном процессе: {inline_late:.2f} с; "
+              f"отдельный планировщик: {len(late)} звонят, задержка макс {split_late * 1000:.0f} мс, "
+              f"событий fired: {len(fired)}")
+        failed = failed or len(late) != CHECK_ALARMS or split_late > LATENCY_BOUND
+        link.send('stop')
+        time.sleep(0.2)
+        collect_changes(link.events())
+
+    collect_changes(link.stop())
+    written = store_path.stat().st_mtime_ns != stamp
+    store_path.unlink()
+    directory.rmdir()
+    print(f"Срабатываний прислано окну: {len(triggered)} из {len(store)}; "
+          f"файл будильников планировщик {'переписал' if written else 'не трогал'}")
+    print("ОК: задержка не зависит от окна" if not failed else
+          f"ОШИБКА: задержка больше {LATENCY_BOUND} с или сработали не все")
+    return 1 if failed or written or len(triggered) != len(store) else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Планировщик будильников в отдельном процессе")
+    parser.add_argument("--serve", action="store_true", help="работать планировщиком для окна main.py --split")
+    parser.add_argument("--socket", type=int, help="дескриптор сокета событий")
+    parser.add_argument("--snapshot", type=int, help="дескриптор файла снимка")
+    parser.add_argument("--store", default=str(STORE_PATH))
+    parser.add_argument("--parent", type=int, default=0)
+    parser.add_argument("--shared", help="общая база будильников (shared_store.py)")
+    args = parser.parse_args()
+    if args.serve:
+        serve_main(args)
+    else:
+        sys.exit(latency_check())
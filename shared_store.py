@@ -0,0 +1,485 @@
+"""Общие будильники нескольких экземпляров программы: SQLite в режиме WAL
+
+python main.py --shared [res/shared.db] - экземпляры (например, несколько
+киосков в одной комнате) работают с одной базой вместо res/alarms.jsonl:
+    alarms  - будильники по id, JSON как в res/alarms.jsonl, но без
+              last_triggered: его каждый экземпляр ведёт сам;
+    changes - журнал изменений (номер, id будильника). Экземпляр записывает
+              только отличия своих будильников от базы; остальные узнают о
+              записи по PRAGMA data_version (счётчик в общей памяти WAL, файл
+              базы при этом не читается) и перечитывают только изменённые;
+    fires   - аренда срабатываний: звонит экземпляр, первым записавший
+              (будильник, момент) в fires. Пока будильник звонит, владелец
+              продлевает аренду, после остановки срабатывание помечается done.
+              Если владелец пропал (аренда истекла, а done нет), срабатывание
+              забирает другой экземпляр, если опоздание в пределах окна догона.
+Правят будильники одновременно - побеждает записавший последним; новый
+будильник, чей id успел занять другой экземпляр, получает следующий свободный.
+Пустая база при первом открытии заполняется из res/alarms.jsonl.
+
+python shared_store.py - проверка: процессы делят срабатывания без повторов,
+видят правки друг друга и подхватывают звонки упавшего владельца.
+"""
+import json
+import os
+import socket
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from alarm_io import alarm_from_record, alarm_to_dict
+from journal import log
+
+
+SHARED_PATH = Path("res") / "shared.db"
+LEASE_SECONDS = 30.0  # Аренда срабатывания; владелец продлевает её каждую треть срока
+BUSY_TIMEOUT = 10.0  # Сколько ждать, пока другой экземпляр пишет в базу, с
+CHANGES_KEPT = 10000  # Записей журнала; отставший сильнее перечитывает базу целиком
+FIRES_KEPT = 2 * 86400  # Сколько секунд хранятся закрытые срабатывания
+QUERY_CHUNK = 500  # id в одном запросе IN (...)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alarms (id INTEGER PRIMARY KEY, record TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, alarm_id INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS fires (
+    alarm_id INTEGER NOT NULL,
+    fire_time TEXT NOT NULL,
+    is_repeat INTEGER NOT NULL,
+    repeats_left INTEGER,
+    owner TEXT NOT NULL,
+    lease_until REAL NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (alarm_id, fire_time)
+);
+CREATE INDEX IF NOT EXISTS fires_open ON fires (done, lease_until);
+"""
+
+# Новая запись - аренда наша; существующая - только если её владелец пропал
+CLAIM = """
+INSERT INTO fires (alarm_id, fire_time, is_repeat, repeats_left, owner, lease_until)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (alarm_id, fire_time) DO UPDATE
+SET owner = excluded.owner, lease_until = excluded.lease_until
+WHERE fires.done = 0 AND fires.lease_until < ?
+"""
+
+
+def shared_record(alarm, alarm_id=None):
+    """Строка базы: будильник без last_triggered"""
+    record = alarm_to_dict(alarm)
+    record.pop('last_triggered', None)
+    if alarm_id is not None:
+        record['id'] = alarm_id
+    return json.dumps(record, ensure_ascii=False, sort_keys=True)
+
+
+def fire_key(fire_time):
+    return fire_time.isoformat(timespec='seconds')
+
+
+def chunks(items, size=QUERY_CHUNK):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SharedStore:
+    """Соединение экземпляра с общей базой: обмен правками и аренда срабатываний"""
+    def __init__(self, path=SHARED_PATH, lease_seconds=LEASE_SECONDS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{os.urandom(4).hex()}"
+        # Транзакции открываются явно: BEGIN IMMEDIATE сразу берёт блокировку записи
+        self.db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")  # В WAL без fsync на каждую транзакцию
+        self.db.executescript(SCHEMA)
+        self.seq = 0  # Последняя прочитанная запись журнала
+        self.data_version = None
+        self.hashes = {}  # id -> hash(строки базы), какой её видел этот экземпляр
+        self.renewed = 0.0  # time.time() последнего продления аренды
+
+    @contextmanager
+    def transaction(self, write=True):
+        self.db.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def close(self):
+        self.db.close()
+
+    def is_empty(self):
+        return self.db.execute("SELECT 1 FROM alarms LIMIT 1").fetchone() is None
+
+    def seed(self, alarms):
+        """Заполнить пустую базу будильниками (первый запуск); False, если база не пуста"""
+        with self.transaction():
+            if not self.is_empty():  # Другой экземпляр успел первым
+                return False
+            self.db.executemany("INSERT INTO alarms (id, record) VALUES (?, ?)",
+                                ((alarm['id'], shared_record(alarm)) for alarm in alarms))
+        return True
+
+    def load(self, store):
+        """Все будильники базы в store (store уже пуст)"""
+        with self.transaction(write=False):
+            self.seq = self.db.execute("SELECT coalesce(max(seq), 0) FROM changes").fetchone()[0]
+            rows = self.db.execute("SELECT id, record FROM alarms").fetchall()
+        self.data_version = self.db.execute("PRAGMA data_version").fetchone()[0]
+        self.hashes = {alarm_id: hash(record) for alarm_id, record in rows}
+        alarms = []
+        for alarm_id, record in rows:
+            try:
+                alarms.append(alarm_from_record(json.loads(record), keep_id=True))
+            except (ValueError, KeyError) as e:
+                log.warning('shared-skipped', "Будильник {alarm_id} в общей базе пропущен: {error}",
+                            alarm_id=alarm_id, error=str(e))
+        for position, message in store.add_many(alarms):
+            log.warning('shared-skipped', "Будильник {alarm_id} в общей базе пропущен: {error}",
+                        alarm_id=alarms[position]['id'], error=message)
+        store.take_touched()  # store совпадает с базой; дальше пишутся только изменённые будильники
+
+    def changed(self):
+        """Писал ли в базу другой экземпляр с прошлой проверки"""
+        version = self.db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self.data_version:
+            return False
+        self.data_version = version
+        return True
+
+    def sync(self, store, write):
+        """Обменяться правками с базой, вернуть id будильников, изменённых другими
+
+        write - в store есть свои правки: их отличия от базы записываются.
+        Свои новые будильники, чей id занял другой экземпляр, переименовываются
+        в store (их id попадает в результат вместе со старым).
+        """
+        if not self.changed() and not write:
+            return set()
+        with self.transaction(write):
+            first = self.db.execute("SELECT min(seq) FROM changes").fetchone()[0]
+            if first is not None and first > self.seq + 1:
+                # Журнал уже подрезан: сверяем все будильники
+                remote = set(self.hashes) | {row[0] for row in self.db.execute("SELECT id FROM alarms")}
+                self.seq = self.db.execute("SELECT max(seq) FROM changes").fetchone()[0]
+            else:
+                rows = self.db.execute("SELECT seq, alarm_id FROM changes WHERE seq > ? ORDER BY seq",
+                                       (self.seq,)).fetchall()
+                remote = {alarm_id for _, alarm_id in rows}
+                if rows:
+                    self.seq = rows[-1][0]
+
+            renamed = {}
+            if write:
+                remote -= self.write_local(store, remote, renamed, store.take_touched())
+            records = dict.fromkeys(remote)
+            for part in chunks(remote):
+                marks = ",".join("?" * len(part))
+                records.update(self.db.execute(f"SELECT id, record FROM alarms WHERE id IN ({marks})", part))
+
+        for old_id, new_id in renamed.items():
+            alarm = store.remove(old_id)
+            alarm['id'] = new_id
+            store.add(alarm)
+        for alarm_id, record in records.items():
+            old = store.remove(alarm_id)
+            if record is None:
+                self.hashes.pop(alarm_id, None)
+                continue
+            self.hashes[alarm_id] = hash(record)
+            try:
+                alarm = alarm_from_record(json.loads(record), keep_id=True)
+                if old is not None:
+                    alarm['last_triggered'] = old.get('last_triggered')
+                store.add(alarm)
+            except (ValueError, KeyError) as e:
+                log.warning('shared-skipped', "Будильник {alarm_id} в общей базе пропущен: {error}",
+                            alarm_id=alarm_id, error=str(e))
+        if records or renamed:
+            store.take_touched()  # Принятые из базы будильники записывать обратно не нужно
+        return set(records) | set(renamed)
+
+    def write_local(self, store, remote, renamed, touched=None):
+        """Записать отличия store от базы (транзакция уже открыта), вернуть переписанные id
+
+        remote - id, которые другие экземпляры изменили после нашего прошлого
+        чтения: если будильник правили и мы, остаётся наша версия.
+        touched - id будильников, изменённых в store (AlarmStore.take_touched):
+        сверяются только они; None - сверяются все.
+        """
+        if touched is None:
+            touched = set(self.hashes) | set(store.records)
+        puts = []
+        overridden = set()
+        deletes = []
+        next_id = None
+        for alarm_id in touched:
+            alarm = store.get(alarm_id)
+            if alarm is None:
+                if alarm_id in self.hashes:
+                    deletes.append(alarm_id)
+                continue
+            record = shared_record(alarm)
+            known = self.hashes.get(alarm_id)
+            if known is None and alarm_id in remote:
+                # Наш новый будильник и чужой получили один id - наш уступает
+                if next_id is None:
+                    next_id = max(self.db.execute("SELECT coalesce(max(id), 0) FROM alarms").fetchone()[0],
+                                  store.next_id - 1) + 1
+                renamed[alarm_id] = next_id
+                puts.append((next_id, shared_record(alarm, next_id)))
+                next_id += 1
+            elif known != hash(record):
+                puts.append((alarm_id, record))
+                overridden.add(alarm_id)
+        overridden.update(deletes)
+        if not puts and not deletes:
+            return overridden
+
+        self.db.executemany("INSERT OR REPLACE INTO alarms (id, record) VALUES (?, ?)", puts)
+        for part in chunks(deletes):
+            self.db.execute(f"DELETE FROM alarms WHERE id IN ({','.join('?' * len(part))})", part)
+        self.db.executemany("INSERT INTO changes (alarm_id) VALUES (?)",
+                            [(alarm_id,) for alarm_id, _ in puts] + [(alarm_id,) for alarm_id in deletes])
+        # Свои записи журнала уже учтены; блокировка записи наша, чужих между ними нет
+        self.seq = self.db.execute("SELECT max(seq) FROM changes").fetchone()[0]
+        self.db.execute("DELETE FROM changes WHERE seq <= ?", (self.seq - CHANGES_KEPT,))
+        for alarm_id, record in puts:
+            self.hashes[alarm_id] = hash(record)
+        for alarm_id in deletes:
+            del self.hashes[alarm_id]
+        return overridden
+
+    def claim(self, due):
+        """Оставить из due срабатывания, аренду которых получил этот экземпляр
+
+        due - [(id, повтор ли, оставшиеся повторы или None, назначенный момент)].
+        """
+        now = time.time()
+        owned = []
+        with self.transaction():
+            for item in due:
+                alarm_id, is_repeat, repeats_left, fire_time = item
+                cursor = self.db.execute(CLAIM, (alarm_id, fire_key(fire_time), int(is_repeat), repeats_left,
+                                                 self.owner, now + self.lease_seconds, now))
+                if cursor.rowcount:
+                    owned.append(item)
+        return owned
+
+    def release(self, alarm_id, fire_time):
+        """Звонок закончен: срабатывание больше никто не заберёт"""
+        with self.transaction():
+            self.db.execute("UPDATE fires SET done = 1 WHERE alarm_id = ? AND fire_time = ? AND owner = ?",
+                            (alarm_id, fire_key(fire_time), self.owner))
+
+    def renew(self, since):
+        """Продлить аренду своих звонков и найти брошенные срабатывания не раньше since
+
+        Делается раз в треть срока аренды, в остальное время сразу возвращает [].
+        Возвращает [(id, повтор ли, оставшиеся повторы, момент)] для trigger_alarms.
+        """
+        now = time.time()
+        if now - self.renewed < self.lease_seconds / 3:
+            return []
+        self.renewed = now
+        with self.transaction():
+            self.db.execute("UPDATE fires SET lease_until = ? WHERE owner = ? AND done = 0",
+                            (now + self.lease_seconds, self.owner))
+            self.db.execute("DELETE FROM fires WHERE fire_time < ?",
+                            (fire_key(datetime.fromtimestamp(now - FIRES_KEPT)),))
+            rows = self.db.execute(
+                "SELECT alarm_id, is_repeat, repeats_left, fire_time FROM fires "
+                "WHERE done = 0 AND lease_until < ? AND fire_time >= ?",
+                (now, fire_key(since))).fetchall()
+        return [(alarm_id, bool(is_repeat), repeats_left, datetime.fromisoformat(fire_time))
+                for alarm_id, is_repeat, repeats_left, fire_time in rows]
+
+
+if __name__ == "__main__":
+    # Проверка: WORKERS процессов одновременно получают одни и те же срабатывания
+    import argparse
+    import random
+    import statistics
+    import subprocess
+    import sys
+    import tempfile
+
+    from alarm_store import AlarmStore
+    from scheduler import Scheduler
+
+    WORKERS = 16
+    ALARMS = 200
+    TEST_LEASE = 2.0  # Короткая аренда, чтобы звонки упавшего забрали за секунды
+    DURATION = 6.0  # Сколько работает каждый процесс после общего старта, с
+    EDIT_AT = 1.0  # Когда проверка правит будильник 1, с от старта
+    CLAIM_BATCH = 20
+    BIG_ALARMS = 50000  # Будильников в базе для замера записи одной правки
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--worker", type=int)
+    parser.add_argument("--db")
+    parser.add_argument("--start", type=float)
+    parser.add_argument("--fire", type=float)
+    parser.add_argument("--crash", action="store_true", help="забрать звонки и пропасть, не отпустив их")
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        rung = []  # [(время, [id])] звонков этого процесса
+
+        class Worker(Scheduler):
+            def start_ring(self, due):
+                rung.append((time.time(), [alarm_id for alarm_id, *_ in due]))
+
+        worker = Worker()
+        worker.open_shared(args.db, TEST_LEASE)
+        started = time.perf_counter()
+        worker.load_alarms()
+        load_ms = (time.perf_counter() - started) * 1000
+        print("ready", flush=True)
+        time.sleep(max(0.0, args.start - time.time()))
+
+        # Срабатывания идут пачками в своём порядке у каждого процесса, чтобы аренды перемешались
+        fire = datetime.fromtimestamp(args.fire)
+        due = [(alarm['id'], False, None, fire) for alarm in worker.alarms]
+        random.Random(args.worker).shuffle(due)
+        claim_ms = []
+        for position in range(0, len(due), CLAIM_BATCH):
+            started = time.perf_counter()
+            worker.trigger_alarms(due[position:position + CLAIM_BATCH], datetime.now())
+            claim_ms.append((time.perf_counter() - started) * 1000)
+            time.sleep(0.01)  # Между пачками процессор достаётся другим
+        if args.crash:
+            os._exit(0)
+        # Все процессы разом добавляют по будильнику - у всех он получает один и тот же id
+        worker.alarms.add({'type': 'weekly', 'time': '12:00', 'weekdays': [0], 'enabled': True,
+                           'label': f"процесс {args.worker}"})
+
+        seen_edit = None
+        sync_ms = []
+        stopped = False
+        while time.time() < args.start + DURATION:
+            started = time.perf_counter()
+            worker.sync_store()
+            sync_ms.append((time.perf_counter() - started) * 1000)
+            if not stopped and time.time() > args.start + 0.5:
+                worker.stop_alarm()  # Свои звонки отпускаем; аренду упавшего продлевать некому
+                stopped = True
+            if seen_edit is None and worker.alarms.get(1) and worker.alarms[1]['label'] == "правка":
+                seen_edit = time.time()
+            time.sleep(0.02)
+        worker.stop_alarm()
+        worker.sync_store()
+        sync_ms.sort()
+        log.flush()  # Сообщения журнала - до отчёта: проверка читает последнюю строку
+        print(json.dumps({'owned': [alarm_id for at, ids in rung if at < args.start + 0.5 for alarm_id in ids],
+                          'taken': [alarm_id for at, ids in rung if at >= args.start + 0.5 for alarm_id in ids],
+                          'taken_at': [at - args.start for at, ids in rung if at >= args.start + 0.5],
+                          'seen_edit': seen_edit, 'load_ms': load_ms, 'claim_ms': claim_ms,
+                          'sync_p50_ms': sync_ms[len(sync_ms) // 2], 'sync_max_ms': sync_ms[-1],
+                          'labels': sorted(alarm['label'] for alarm in worker.alarms)}))
+        sys.exit(0)
+
+    directory = tempfile.mkdtemp()
+    db_path = os.path.join(directory, "shared.db")
+    store = AlarmStore()
+    store.add_many([{'type': 'weekly', 'time': '07:00', 'weekdays': list(range(7)), 'enabled': True,
+                     'label': f"будильник {i}"} for i in range(ALARMS)])
+    SharedStore(db_path).seed(store)
+
+    start = time.time() + 3.0 + WORKERS * 0.3
+    fire = datetime.now().replace(second=0, microsecond=0).timestamp()
+    processes = [subprocess.Popen([sys.executable, __file__, "--worker", str(index), "--db", db_path,
+                                   "--start", str(start), "--fire", str(fire)]
+                                  + (["--crash"] if index == 0 else []),
+                                  stdout=subprocess.PIPE, text=True)
+                 for index in range(WORKERS)]
+
+    editor = Scheduler()
+    editor.claims_fires = False
+    editor.open_shared(db_path, TEST_LEASE)
+    editor.load_alarms()
+    time.sleep(max(0.0, start + EDIT_AT - time.time()))
+    editor.alarms[1]['label'] = "правка"
+    editor.alarms.reindex(1)
+    edited = time.time()
+    editor.sync_store()
+
+    results = []
+    for process in processes:
+        output, _ = process.communicate()
+        lines = output.strip().splitlines()
+        results.append(json.loads(lines[-1]) if lines and lines[-1].startswith('{') else None)
+    crashed, survivors = results[0], results[1:]
+    if None in survivors:
+        print("Процесс завершился без отчёта")
+        sys.exit(1)
+
+    failures = []
+    owned = [alarm_id for result in survivors for alarm_id in result['owned']]
+    # Отчёта упавшего нет: его доля - то, чего не взял никто из живых
+    crashed_owned = set(range(1, ALARMS + 1)) - set(owned)
+    taken = [alarm_id for result in survivors for alarm_id in result['taken']]
+    if len(owned) != len(set(owned)):
+        failures.append(f"срабатывания звонили дважды: {len(owned) - len(set(owned))}")
+    if sorted(taken) != sorted(crashed_owned):
+        failures.append(f"звонки упавшего: владел {len(crashed_owned)}, забрали {len(taken)}, "
+                        f"без повторов {len(set(taken))}")
+    seen = [result['seen_edit'] for result in survivors]
+    if None in seen:
+        failures.append(f"правку не увидели {seen.count(None)} процессов")
+    labels = {tuple(result['labels']) for result in survivors}
+    final = AlarmStore()
+    SharedStore(db_path).load(final)
+    final_labels = tuple(sorted(alarm['label'] for alarm in final))
+    if labels != {final_labels} or len(final) != ALARMS + WORKERS - 1:
+        failures.append(f"будильники процессов разошлись с базой: вариантов {len(labels)}, в базе {len(final)}")
+
+    print(f"Процессов {WORKERS} (один падает, не отпустив аренду), срабатываний {ALARMS}")
+    print(f"Звонили: {len(owned)} живыми + {len(crashed_owned)} упавшим, по процессам "
+          f"{sorted(len(result['owned']) for result in survivors)}")
+    taken_at = [at for result in survivors for at in result['taken_at']]
+    if taken_at:
+        print(f"Звонки упавшего забраны: {len(taken)} через {min(taken_at):.1f}-{max(taken_at):.1f} с "
+              f"(аренда {TEST_LEASE:g} с)")
+    print(f"Правку увидели все за {max(value - edited for value in seen if value) * 1000:.0f} мс (макс)")
+    print(f"Загрузка базы: макс {max(result['load_ms'] for result in survivors):.1f} мс; аренда пачек "
+          f"по {CLAIM_BATCH}: медиана {statistics.median(ms for result in survivors for ms in result['claim_ms']):.1f} мс, "
+          f"макс {max(ms for result in survivors for ms in result['claim_ms']):.1f} мс")
+    print(f"Обмен правками: медиана {sorted(result['sync_p50_ms'] for result in survivors)[len(survivors) // 2]:.2f} мс, "
+          f"макс {max(result['sync_max_ms'] for result in survivors):.1f} мс")
+    print(f"Новые будильники {WORKERS - 1} процессов с одинаковым id: в базе {len(final) - ALARMS}, "
+          f"у всех одинаково: {'да' if len(labels) == 1 else 'нет'}")
+
+    # Запись одной правки в большой базе: сверяется изменённый будильник, а не все
+    big_path = os.path.join(directory, "big.db")
+    big = AlarmStore()
+    big.add_many([{'type': 'weekly', 'time': '07:00', 'weekdays': [i % 7], 'enabled': True,
+                   'label': f"будильник {i}"} for i in range(BIG_ALARMS)])
+    SharedStore(big_path).seed(big)
+    writer = SharedStore(big_path)
+    local = AlarmStore()
+    writer.load(local)
+    local.set_enabled(1, False)
+    started = time.perf_counter()
+    writer.sync(local, True)
+    touched_ms = (time.perf_counter() - started) * 1000
+    written = [row[0] for row in writer.db.execute("SELECT alarm_id FROM changes ORDER BY seq")]
+    if written != [1]:
+        failures.append(f"в журнал записана не только правка: {written[:10]}")
+    local.touched = None  # Как до отслеживания: сверка всех будильников
+    local.set_enabled(2, False)
+    started = time.perf_counter()
+    writer.sync(local, True)
+    all_ms = (time.perf_counter() - started) * 1000
+    print(f"Запись одной правки при {BIG_ALARMS} будильниках: {touched_ms:.1f} мс "
+          f"(сверка всех - {all_ms:.1f} мс)")
+    for failure in failures:
+        print(f"ОШИБКА: {failure}")
+    sys.exit(1 if failures else 0)
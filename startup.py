@@ -0,0 +1,138 @@
+"""Хронология запуска программы и замер времени до первого кадра
+
+main.py импортирует этот модуль первым и отмечает этапы: импорт, загрузка
+будильников, создание окна, интерфейс, фон и надписи, службы, первый кадр,
+готово. Когда запуск закончен, в журнал (journal.py) пишется одна строка - сколько
+занял каждый этап и через сколько после начала импорта появился первый кадр.
+Запуск интерпретатора до первой строки main.py в отсчёт не входит.
+
+Ленивый запуск (python main.py без --eager) рисует первый кадр только с
+часами и кнопками; фон, второстепенные надписи, прогрев шрифтов и сокет
+управления доделываются по шагу на кадр уже после него.
+
+python startup.py - замер: RUNS запусков в отдельных процессах в обычном и
+ленивом режимах, медианы этапов.
+"""
+import time
+
+
+STARTED = time.perf_counter()
+
+
+class StartupTimeline:
+    """Отметки этапов запуска: (имя, время perf_counter)"""
+    def __init__(self, started=STARTED):
+        self.started = started
+        self.marks = []
+        self.finished = False
+
+    def mark(self, name):
+        if not self.finished:
+            self.marks.append((name, time.perf_counter()))
+
+    def finish(self):
+        """Запуск закончен: последняя отметка и строка отчёта в журнал"""
+        if self.finished:
+            return
+        self.mark("готово")
+        self.finished = True
+        from journal import log  # Не на уровне модуля: отсчёт запуска начинается раньше всех импортов
+        log.info('startup', "{report}", report=self.format(), stages_ms=self.elapsed())
+
+    def elapsed(self):
+        """{этап: мс от начала запуска}; повторившийся этап - по последней отметке"""
+        return {name: (moment - self.started) * 1000 for name, moment in self.marks}
+
+    def format(self):
+        parts = []
+        previous = self.started
+        for name, moment in self.marks:
+            parts.append(f"{name} {(moment - previous) * 1000:.0f}")
+            previous = moment
+        elapsed = self.elapsed()
+        first_frame = elapsed.get("первый кадр")
+        summary = f"; первый кадр через {first_frame:.0f} мс" if first_frame is not None else ""
+        return f"Запуск (мс): {', '.join(parts)}{summary}"
+
+
+# Одна хронология на процесс, как font_cache в main.py
+timeline = StartupTimeline()
+
+
+if __name__ == "__main__":
+    # Замер: каждый запуск - новый процесс, как при настоящем старте программы
+    import json
+    import statistics
+    import subprocess
+    import sys
+    import tempfile
+    from pathlib import Path
+
+    RUNS = 11
+    ALARMS = ("07:00,пн ср пт", "07:30,вт чт", "09:00,сб вс", "12:15,пн", "22:45,пн вт ср чт пт")
+
+    if len(sys.argv) >= 4 and sys.argv[1] == "--child":
+        # Отсчёт - в модуле startup, который импортирует main.py: сам этот файл здесь __main__
+        import startup
+        import pyglet
+        if "--display" not in sys.argv:
+            pyglet.options['headless'] = True
+        import scheduler
+        import status
+        scheduler.STORE_PATH = sys.argv[3]  # Свои будильники, а не res/alarms.jsonl
+        status.STATUS_PATH = Path(sys.argv[3]).with_name("status.bin")  # И не res/status.bin
+        import main
+
+        app = main.AlarmApp(lazy=sys.argv[2] == "lazy")
+
+        def check_finished(dt):
+            if startup.timeline.finished:
+                pyglet.app.exit()
+        pyglet.clock.schedule_interval(check_finished, 0.01)
+        app.run()
+        main.log.flush()  # Строка отчёта журнала - до итоговой строки JSON
+        print(json.dumps(startup.timeline.elapsed(), ensure_ascii=False))
+        sys.exit(0)
+
+    import alarm_io
+    from alarm_store import AlarmStore
+
+    directory = Path(tempfile.mkdtemp())
+    source = directory / "alarms.csv"
+    source.write_text("time,weekdays,label\n" + "".join(f"{line},Будильник {index}\n"
+                                                          for index, line in enumerate(ALARMS)), encoding="utf-8")
+    store = AlarmStore()
+    alarm_io.import_alarms(store, source)
+    store_path = directory / "alarms.jsonl"
+    alarm_io.save_store(store, store_path)
+
+    results = {}
+    for run in range(RUNS):
+        for mode in ("eager", "lazy"):  # Режимы чередуются, чтобы фон машины влиял на оба одинаково
+            output = subprocess.run([sys.executable, __file__, "--child", mode, str(store_path), *sys.argv[1:]],
+                                    capture_output=True, text=True, timeout=120,
+                                    cwd=Path(__file__).resolve().parent)
+            if output.returncode != 0:
+                print(output.stdout, output.stderr)
+                sys.exit(1)
+            results.setdefault(mode, []).append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    def median(mode, name):
+        values = [run[name] for run in results[mode] if name in run]
+        return statistics.median(values) if values else float('nan')
+
+    print(f"Медианы {RUNS} запусков, мс от начала импорта main.py:")
+    names = list(results["eager"][0])
+    names += [name for name in results["lazy"][0] if name not in names]
+    names.sort(key=lambda name: median("eager", name) if name in results["eager"][0] else median("lazy", name))
+    print(f"{'этап':<14}{'обычный':>10}{'ленивый':>10}")
+    for name in names:
+        print(f"{name:<14}{median('eager', name):>10.0f}{median('lazy', name):>10.0f}")
+    # Импорт в обоих режимах одинаков, но шумит сильнее всего: отдельно - от конца импорта до первого кадра
+    after_import = {mode: statistics.median(run["первый кадр"] - run["импорт"] for run in results[mode])
+                    for mode in results}
+    eager, lazy = median("eager", "первый кадр"), median("lazy", "первый кадр")
+    print(f"Первый кадр: {eager:.0f} -> {lazy:.0f} мс ({(lazy - eager) / eager * 100:+.0f}%), "
+          f"после импорта {after_import['eager']:.0f} -> {after_import['lazy']:.0f} мс "
+          f"({(after_import['lazy'] - after_import['eager']) / after_import['eager'] * 100:+.0f}%)")
+    sys.exit(0 if after_import['lazy'] < after_import['eager'] else 1)
@@ -0,0 +1,57 @@
+"""Счётчики и гистограммы для замеров работы будильника"""
+import bisect
+
+
+# Границы корзин задержки срабатывания в секундах
+LATENCY_BOUNDS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: запись за O(log k), память O(k)
+
+    Корзина i считает значения <= bounds[i], последняя - всё, что больше.
+    """
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q):
+        """Верхняя граница корзины, в которую попадает доля q (0..1) значений"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket in enumerate(self.counts):
+            seen += bucket
+            if seen >= rank and bucket:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def buckets(self):
+        """[(верхняя граница, количество)], последняя граница - бесконечность"""
+        return list(zip(self.bounds + (float('inf'),), self.counts))
+
+    def format(self, unit="с"):
+        """Текстовый вид для вывода в консоль"""
+        if not self.count:
+            return "нет данных"
+        lines = [f"всего {self.count}, среднее {self.mean():.2f} {unit}, "
+                 f"p50 <= {self.percentile(0.5):g} {unit}, p99 <= {self.percentile(0.99):g} {unit}, "
+                 f"макс {self.max:.2f} {unit}"]
+        for bound, count in self.buckets():
+            if count:
+                lines.append(f"  <= {bound:g} {unit}: {count}")
+        return "\n".join(lines)
@@ -0,0 +1,226 @@
+"""Состояние будильника для виджетов и мониторинга: запись фиксированного вида в mmap
+
+Программа держит в res/status.bin запись STATUS_SIZE байт и переписывает её
+только при изменении состояния (ближайший будильник, звонки, число
+включённых). Читатель отображает файл в память один раз и дальше читает его
+без системных вызовов - хоть тысячи раз в секунду.
+
+Раскладка (little-endian, смещение: тип поле):
+    0: char[4]  magic "WKST"
+    4: u16      версия раскладки (1)
+    6: u16      флаги: 1 - программа работает, 2 - что-то звонит
+    8: u64      seq - чётный, когда запись целая; нечётный, пока её переписывают
+   16: f64      ближайшее срабатывание, секунды Unix (0 - нет)
+   24: i64      id ближайшего будильника (0 - нет)
+   32: u32      звонит будильников
+   36: u32      включено будильников
+   40: u32      всего будильников
+   44: u32      pid программы
+   48: f64      когда запись менялась, секунды Unix
+   56: char[64] подпись ближайшего будильника, UTF-8, дополнена нулями
+Читатель (seqlock): прочитать seq, если нечётный - повторить; прочитать поля;
+если seq не изменился - поля целые, иначе повторить.
+
+Из Python:
+    from status import StatusReader
+    reader = StatusReader()
+    state = reader.poll()  # dict, если запись изменилась с прошлого раза, иначе None
+
+python status.py - проверка: писатель в другом процессе меняет запись без
+остановки, читатель не видит ни одной разорванной; стоимость чтения.
+"""
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+
+
+STATUS_PATH = Path("res") / "status.bin"
+STATUS_SIZE = 128
+MAGIC = b"WKST"
+LAYOUT_VERSION = 1
+FLAG_RUNNING = 1
+FLAG_RINGING = 2
+LABEL_SIZE = 64
+
+HEADER = struct.Struct('<4sHHQ')  # magic, версия, флаги, seq
+PREFIX = struct.Struct('<4sHH')  # То же без seq: писатель меняет seq только отдельно
+SEQ = struct.Struct('<Q')
+SEQ_OFFSET = 8
+BODY = struct.Struct('<dqIIIId64s')  # Поля после seq
+BODY_OFFSET = 16
+FIELDS = ('next_time', 'next_id', 'ringing', 'active', 'total', 'pid', 'changed', 'label')
+
+
+def encode_label(text):
+    """Подпись в LABEL_SIZE байт, обрезанная по границе символа"""
+    data = text.encode('utf-8')[:LABEL_SIZE]
+    return data.decode('utf-8', 'ignore').encode('utf-8')
+
+
+class StatusWriter:
+    """Сторона программы: переписывает запись, только когда состояние изменилось"""
+    def __init__(self, path=STATUS_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Файл не пересоздаётся: читатели, отобразившие его раньше, видят новые записи
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, STATUS_SIZE)
+            self.map = mmap.mmap(fd, STATUS_SIZE)
+        finally:
+            os.close(fd)
+        magic, version, _, seq = HEADER.unpack_from(self.map)
+        # seq продолжается с прошлого запуска, чтобы читатель не принял новую запись за старую
+        self.seq = seq + (seq & 1) if magic == MAGIC and version == LAYOUT_VERSION else 0
+        self.flags = FLAG_RUNNING
+        self.fields = None
+
+    def update(self, next_time=None, next_id=None, label='', ringing=0, active=0, total=0):
+        """Записать состояние; ничего не делает, если оно не изменилось
+
+        next_time - datetime ближайшего срабатывания или None.
+        """
+        fields = (next_time.timestamp() if next_time else 0.0, next_id or 0, ringing, active, total,
+                  os.getpid(), encode_label(label))
+        if fields == self.fields:
+            return False
+        self.fields = fields
+        self.flags = (self.flags & ~FLAG_RINGING) | (FLAG_RINGING if ringing else 0)
+        self.write()
+        return True
+
+    def write(self):
+        next_time, next_id, ringing, active, total, pid, label = self.fields
+        self.write_seq(self.seq + 1)  # Нечётный: запись меняется
+        PREFIX.pack_into(self.map, 0, MAGIC, LAYOUT_VERSION, self.flags)
+        BODY.pack_into(self.map, BODY_OFFSET, next_time, next_id, ringing, active, total, pid,
+                       time.time(), label)
+        self.seq += 2
+        self.write_seq(self.seq)
+
+    def write_seq(self, seq):
+        # pack_into сперва обнуляет свои байты: читатель застал бы чётный seq 0 посреди записи.
+        # Срез mmap копируется одним memcpy без промежуточных значений
+        self.map[SEQ_OFFSET:BODY_OFFSET] = SEQ.pack(seq)
+
+    def close(self):
+        """Программа завершается: снять флаг работы"""
+        self.flags = 0
+        if self.fields is not None:
+            self.write()
+        self.map.close()
+
+
+class StatusReader:
+    """Сторона виджета: файл отображается один раз, дальше чтение из памяти"""
+    def __init__(self, path=STATUS_PATH):
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), STATUS_SIZE, access=mmap.ACCESS_READ)
+        self.seq = None
+
+    def read(self, attempts=10000):
+        """Целая копия записи (dict) или None, если писатель так и не закончил запись"""
+        for _ in range(attempts):
+            seq = SEQ.unpack_from(self.map, SEQ_OFFSET)[0]
+            if seq & 1:
+                continue
+            magic, version, flags, _ = HEADER.unpack_from(self.map)
+            body = BODY.unpack_from(self.map, BODY_OFFSET)
+            if SEQ.unpack_from(self.map, SEQ_OFFSET)[0] != seq:
+                continue
+            if magic != MAGIC or version != LAYOUT_VERSION:
+                return None
+            self.seq = seq
+            state = dict(zip(FIELDS, body))
+            state['label'] = state['label'].rstrip(b'\0').decode('utf-8', 'replace')
+            state['running'] = bool(flags & FLAG_RUNNING)
+            state['ringing_now'] = bool(flags & FLAG_RINGING)
+            state['seq'] = seq
+            return state
+        return None
+
+    def poll(self):
+        """Запись, если она изменилась с прошлого чтения, иначе None; стоит одно чтение seq"""
+        if SEQ.unpack_from(self.map, SEQ_OFFSET)[0] == self.seq:
+            return None
+        return self.read()
+
+    def close(self):
+        self.map.close()
+
+
+if __name__ == "__main__":
+    # Проверка: писатель в дочернем процессе переписывает запись без пауз DURATION секунд
+    import subprocess
+    import sys
+    import tempfile
+    from datetime import datetime
+
+    DURATION = 3.0
+    POLLS = 1_000_000
+
+    if len(sys.argv) == 3 and sys.argv[1] == "--writer":
+        # Поля согласованы между собой: по любому из них читатель проверяет остальные
+        writer = StatusWriter(sys.argv[2])
+        print("ready", flush=True)
+        count = 0
+        end = time.time() + DURATION
+        while time.time() < end:
+            count += 1
+            writer.update(datetime.fromtimestamp(1_700_000_000 + count), count, f"будильник {count}",
+                          count % 7, count % 1000, count % 1000 + 5)
+        writer.close()
+        print(count)
+        sys.exit(0)
+
+    path = os.path.join(tempfile.mkdtemp(), "status.bin")
+    writer_process = subprocess.Popen([sys.executable, __file__, "--writer", path],
+                                      stdout=subprocess.PIPE, text=True)
+    writer_process.stdout.readline()
+    reader = StatusReader(path)
+    reads = torn = changes = 0
+    deadline = time.time() + DURATION  # time.time() - без системного вызова, в отличие от poll() процесса
+    while time.time() < deadline:
+        state = reader.poll()
+        reads += 1
+        if state is None:
+            continue
+        changes += 1
+        count = state['next_id']
+        if (state['label'] != f"будильник {count}" or state['ringing'] != count % 7
+                or state['active'] != count % 1000 or state['total'] != count % 1000 + 5
+                or state['next_time'] != 1_700_000_000 + count
+                or state['running'] and state['ringing_now'] != bool(count % 7)):
+            torn += 1
+    written = int(writer_process.stdout.read())
+    writer_process.wait()
+
+    started = time.perf_counter()
+    for _ in range(POLLS):
+        reader.poll()
+    poll_ns = (time.perf_counter() - started) / POLLS * 1e9
+    started = time.perf_counter()
+    for _ in range(POLLS // 10):
+        reader.read()
+    read_ns = (time.perf_counter() - started) / (POLLS // 10) * 1e9
+    writer = StatusWriter(path)
+    args = (datetime.now(), 1, "подъём", 0, 10, 10)
+    writer.update(*args)
+    started = time.perf_counter()
+    for _ in range(POLLS // 10):
+        writer.update(*args)
+    same_ns = (time.perf_counter() - started) / (POLLS // 10) * 1e9
+    started = time.perf_counter()
+    for index in range(POLLS // 10):
+        writer.update(args[0], index, *args[2:])
+    changed_ns = (time.perf_counter() - started) / (POLLS // 10) * 1e9
+    final = reader.read()
+    writer.close()
+
+    print(f"Записей за {DURATION:g} с: {written}; чтений {reads}, увидено изменений {changes}, разорванных {torn}")
+    print(f"Чтение: poll без изменений {poll_ns:.0f} нс, полное чтение {read_ns:.0f} нс")
+    print(f"Запись: то же состояние {same_ns:.0f} нс, новое {changed_ns:.0f} нс")
+    print(f"После закрытия писателя: работает {StatusReader(path).read()['running']}, seq {final['seq']} чётный")
+    sys.exit(1 if torn or not changes else 0)
@@ -0,0 +1,89 @@
+"""Хэшированное колесо таймеров для отложенных повторов будильников"""
+import math
+
+
+class TimingWheel:
+    """Хэшированное колесо таймеров: вставка и отмена за O(1)
+
+    Время делится на тики по resolution секунд, дедлайн попадает в ячейку
+    тик % size. Дедлайны дальше одного оборота лежат в той же ячейке и ждут
+    своего оборота. За тик просматривается одна ячейка, а не все таймеры.
+    """
+    def __init__(self, now, resolution=1.0, size=512):
+        self.resolution = resolution
+        self.size = size
+        self.cells = [{} for _ in range(size)]  # Ключ -> (тик, данные)
+        self.cell_of = {}  # Ключ -> номер ячейки
+        self.current_tick = int(now // resolution)
+
+    def __len__(self):
+        return len(self.cell_of)
+
+    def __contains__(self, key):
+        return key in self.cell_of
+
+    def schedule(self, key, deadline, payload=None):
+        """Поставить (или переставить) таймер key на момент deadline"""
+        self.cancel(key)
+        # Уже прошедший дедлайн срабатывает на ближайшем тике
+        tick = max(math.ceil(deadline / self.resolution), self.current_tick + 1)
+        cell = tick % self.size
+        self.cells[cell][key] = (tick, payload)
+        self.cell_of[key] = cell
+
+    def cancel(self, key):
+        """Отменить таймер; True, если он был"""
+        cell = self.cell_of.pop(key, None)
+        if cell is None:
+            return False
+        del self.cells[cell][key]
+        return True
+
+    def deadline(self, key):
+        """Момент срабатывания таймера (с точностью до тика) или None"""
+        cell = self.cell_of.get(key)
+        if cell is None:
+            return None
+        return self.cells[cell][key][0] * self.resolution
+
+    def clear(self):
+        for cell in self.cells:
+            cell.clear()
+        self.cell_of.clear()
+
+    def rebase(self, now, shift):
+        """Начать отсчёт заново с момента now, сдвинув все таймеры на shift секунд
+
+        Нужно, когда часы перевели назад: иначе таймеры ждали бы лишний час.
+        """
+        timers = [(key, tick * self.resolution + shift, payload)
+                  for cell in self.cells for key, (tick, payload) in cell.items()]
+        self.clear()
+        self.current_tick = int(now // self.resolution)
+        for key, deadline, payload in timers:
+            self.schedule(key, deadline, payload)
+        return len(timers)
+
+    def advance(self, now):
+        """Продвинуть колесо до момента now, вернуть [(ключ, данные, срок)] сработавших
+
+        После долгого простоя обходится не больше одного оборота колеса.
+        """
+        target = int(now // self.resolution)
+        if target <= self.current_tick:
+            return []
+
+        expired = []
+        last = min(target, self.current_tick + self.size)
+        for tick in range(self.current_tick + 1, last + 1):
+            cell = self.cells[tick % self.size]
+            if not cell:
+                continue
+            due = [key for key, (key_tick, _) in cell.items() if key_tick <= target]
+            for key in due:
+                key_tick, payload = cell.pop(key)
+                del self.cell_of[key]
+                expired.append((key, payload, key_tick * self.resolution))
+
+        self.current_tick = target
+        return expired
@@ -0,0 +1,263 @@
+"""Трассировка обратных вызовов pyglet.clock и обработчиков событий окон
+
+Когда программа подтормаживает, по времени кадра не видно, кто виноват:
+лямбда из schedule_once, on_draw какого-то окна или on_mouse_press.
+Tracer, пока включён, оборачивает все обратные вызовы часов pyglet и методы
+on_* классов окон программы и складывает (имя, начало, конец) в кольцевой
+буфер на TRACE_EVENTS записей. dump() пишет буфер в формате trace-event JSON
+Chrome - его открывают chrome://tracing и ui.perfetto.dev.
+
+    python main.py --trace [res/trace.json]  - трассировка с запуска, запись при выходе
+    ControlClient().call('trace', enabled=True)  - включить у запущенной программы
+    ControlClient().call('trace_dump')           - записать буфер сейчас
+
+Выключенный Tracer ничего не оборачивает. Включённый стоит около микросекунды
+на вызов (замер - python tracing.py), этого хватает, чтобы держать его
+включённым в рабочей программе.
+"""
+import json
+import os
+import time
+from collections import deque
+from pathlib import Path
+
+import pyglet
+
+from journal import log
+
+
+TRACE_PATH = Path("res") / "trace.json"
+TRACE_EVENTS = 100000  # Записей в кольцевом буфере; при 60 к/с - несколько минут
+SCHEDULE_METHODS = ('schedule', 'schedule_once', 'schedule_interval', 'schedule_interval_soft')
+
+
+def qualified_name(func):
+    """Имя для трассы: Класс.метод, функция или <lambda> с местом определения"""
+    name = getattr(func, '__qualname__', None)
+    if name is None:
+        name = getattr(getattr(func, 'func', None), '__qualname__', None) or type(func).__name__  # functools.partial
+    return name
+
+
+class TracedCall:
+    """Обёртка обратного вызова часов; равна исходной функции, так что unschedule её находит"""
+    __slots__ = ('func', 'name', 'events')
+
+    def __init__(self, func, events):
+        self.func = func
+        self.name = qualified_name(func)
+        self.events = events
+
+    def __call__(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            self.events.append((self.name, 'clock', started, time.perf_counter()))
+
+    def __eq__(self, other):
+        if isinstance(other, TracedCall):
+            other = other.func
+        return self.func == other
+
+    def __hash__(self):
+        return hash(self.func)
+
+
+def traced_handler(method, events):
+    """Обёртка метода-обработчика класса окна (функция, поэтому привязывается к окну)"""
+    name = method.__qualname__
+
+    def handler(window, *args):
+        started = time.perf_counter()
+        try:
+            return method(window, *args)
+        finally:
+            events.append((name, 'event', started, time.perf_counter()))
+    handler.__wrapped__ = method
+    handler.__qualname__ = name
+    return handler
+
+
+def window_classes():
+    """Классы окон, объявленные вне pyglet (со всеми подклассами)"""
+    found = []
+    pending = [pyglet.window.BaseWindow]
+    while pending:
+        cls = pending.pop()
+        pending.extend(cls.__subclasses__())
+        if not cls.__module__.startswith('pyglet'):
+            found.append(cls)
+    return found
+
+
+class Tracer:
+    """Кольцевой буфер вызовов; start() оборачивает, stop() возвращает всё как было"""
+    def __init__(self, path=TRACE_PATH, size=TRACE_EVENTS):
+        self.path = Path(path)
+        self.events = deque(maxlen=size)
+        self.enabled = False
+        self.clock = None
+        self.handlers = []  # (класс, имя события, исходный метод)
+
+    def start(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        events = self.events
+        # Часы: уже стоящие в расписании вызовы и все новые
+        self.clock = clock = pyglet.clock.get_default()
+        for item in self.scheduled_items():
+            if not isinstance(item.func, TracedCall):
+                item.func = TracedCall(item.func, events)
+        for name in SCHEDULE_METHODS:
+            original = getattr(clock, name)
+
+            def schedule(func, *args, _original=original, **kwargs):
+                return _original(func if isinstance(func, TracedCall) else TracedCall(func, events), *args, **kwargs)
+            setattr(clock, name, schedule)
+        # Окна: методы on_* классов, так что и окна, открытые позже, трассируются сразу
+        for cls in window_classes():
+            for event_type in cls.event_types:
+                method = cls.__dict__.get(event_type)
+                if callable(method):
+                    self.handlers.append((cls, event_type, method))
+                    setattr(cls, event_type, traced_handler(method, events))
+        log.info('trace-started', "Трассировка включена: буфер на {size} вызовов", size=self.events.maxlen)
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        for name in SCHEDULE_METHODS:
+            self.clock.__dict__.pop(name, None)
+        for item in self.scheduled_items():
+            if isinstance(item.func, TracedCall):
+                item.func = item.func.func
+        for cls, event_type, method in self.handlers:
+            setattr(cls, event_type, method)
+        self.handlers.clear()
+        log.info('trace-stopped', "Трассировка выключена")
+
+    def scheduled_items(self):
+        clock = self.clock
+        items = list(clock._schedule_items) + list(clock._schedule_interval_items)
+        if clock._current_interval_item is not None:
+            items.append(clock._current_interval_item)
+        return items
+
+    def chrome_trace(self):
+        """Буфер в формате trace-event Chrome: события "X" с длительностью, время в мкс"""
+        events = list(self.events)
+        origin = events[0][2] if events else 0.0
+        pid = os.getpid()
+        trace = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 1, 'args': {'name': "wakeup"}}]
+        trace.extend({'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': 1,
+                      'ts': round((started - origin) * 1e6, 3), 'dur': round((ended - started) * 1e6, 3)}
+                     for name, category, started, ended in events)
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path=None):
+        """Записать буфер в файл; возвращает (путь, число событий)"""
+        path = Path(path) if path else self.path
+        trace = self.chrome_trace()
+        temporary = path.with_name(path.name + ".tmp")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(trace, file, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temporary, path)
+        count = len(trace['traceEvents']) - 1
+        log.info('trace-written', "Трасса: {count} вызовов записано в {path}", count=count, path=str(path))
+        return path, count
+
+    def finish(self):
+        """Выход из программы: снять обёртки и записать, что накопилось"""
+        if not self.enabled:
+            return
+        self.stop()
+        try:
+            self.dump()
+        except OSError as e:
+            log.error('trace-error', "Не удалось записать трассу в {path}: {error}", path=str(self.path), error=str(e))
+
+
+if __name__ == "__main__":
+    # Замер: цена вызова обратного вызова часов и обработчика окна с трассировкой и без
+    import statistics
+    import sys
+    import tempfile
+
+    if "--display" not in sys.argv:
+        pyglet.options['headless'] = True
+    import scheduler
+    import status
+    # Не трогаем res/alarms.jsonl и res/status.bin: настоящие будильники не зазвонят,
+    # а запись состояния запущенной программы не перепишется
+    directory = Path(tempfile.mkdtemp())
+    scheduler.STORE_PATH = directory / "alarms.jsonl"
+    status.STATUS_PATH = directory / "status.bin"
+    import main
+
+    CALLS = 50000
+    BATCHES = 5
+    FRAMES = 1000
+
+    app = main.AlarmApp()
+    window = app.main_window
+    pyglet.window.Window._enable_event_queue = False  # Вне pyglet.app.run события окна иначе копятся в очереди
+    clock = pyglet.clock.get_default()
+    tracer = Tracer(directory / "trace.json")
+
+    def tick(dt):
+        pass
+
+    def per_call():
+        """Наносекунд на вызов (лучшая из BATCHES серий): tick через часы и on_key_press через dispatch_event"""
+        clock_ns = event_ns = float('inf')
+        clock.schedule(tick)
+        for _ in range(BATCHES):
+            started = time.perf_counter()
+            for _ in range(CALLS):
+                clock.call_scheduled_functions(0.0)
+            clock_ns = min(clock_ns, (time.perf_counter() - started) / CALLS * 1e9)
+            started = time.perf_counter()
+            for _ in range(CALLS):
+                window.dispatch_event('on_key_press', 0, 0)
+            event_ns = min(event_ns, (time.perf_counter() - started) / CALLS * 1e9)
+        clock.unschedule(tick)
+        return clock_ns, event_ns
+
+    def frames():
+        times = []
+        for _ in range(FRAMES):
+            started = time.perf_counter()
+            window.draw(1 / 60)
+            times.append((time.perf_counter() - started) * 1000)
+        return statistics.median(times)
+
+    # Прогрев шрифтов идёт вызовами часов - дожидаемся его, чтобы он не попал в замер
+    deadline = time.perf_counter() + 3.0
+    while time.perf_counter() < deadline:
+        clock.tick(True)
+    frames()
+    plain = per_call(), frames()
+    tracer.start()
+    traced = per_call(), frames()
+    pyglet.clock.schedule_once(lambda dt: None, 0)  # Новый вызов после start тоже трассируется
+    clock.tick(True)
+    tracer.stop()
+    after = per_call(), frames()
+    path, count = tracer.dump()
+    names = {event['name'] for event in json.loads(path.read_text())['traceEvents']}
+    left = [item for item in tracer.scheduled_items() if isinstance(item.func, TracedCall)]
+
+    for title, ((clock_ns, event_ns), frame_ms) in (("без трассировки", plain), ("с трассировкой", traced),
+                                                    ("после выключения", after)):
+        print(f"{title:<18} часы {clock_ns:6.0f} нс/вызов, событие окна {event_ns:6.0f} нс, "
+              f"кадр главного окна {frame_ms:.2f} мс")
+    print(f"В трассе {count} событий; среди имён: "
+          f"{', '.join(sorted(name for name in names if name.startswith(('MainWindow', 'BaseWindow', '<lambda>'))))}")
+    app.shutdown()
+    ok = {'MainWindow.on_draw', 'BaseWindow.on_key_press'} <= names and not left and \
+        any('<lambda>' in name for name in names)
+    sys.exit(0 if ok else 1)